@@ -0,0 +1,221 @@
+# About
+#############################################################################################################
+
+# Synthetic-data benchmark for the WUI pipeline.
+# Generates NLCD-like land cover rasters and clustered address points at county, state and multi-state sizes,
+# times every stage of the moving window engine (moving_window.py) for several neighborhood radii and reports
+# throughput in megapixels per second. No Montana data or ArcGIS license is needed.
+# Results are saved as JSON in benchmark_results/ and compared against the most recent earlier result file,
+# so regressions between versions show up as soon as the benchmark is rerun.
+#
+# Usage: python benchmark_WUI_pipeline.py [--sizes county state] [--radii 100 500 1000] [--repeat 3]
+
+
+# Imports
+#############################################################################################################
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+import platform
+import subprocess
+from datetime import datetime
+
+import numpy as np
+from scipy import ndimage
+
+import moving_window as mw
+
+
+# Settings
+#############################################################################################################
+cell_size = 30                                              # m, matches arcpy.env.cellSize in generate_WUI_maps.py
+sizes = {                                                   # rows, cols of the synthetic study area
+    "county": (2048, 2048),                                 # ~3,800 km^2, about the size of a large Montana county
+    "state": (8192, 8192),                                  # ~60,000 km^2
+    "multi-state": (16384, 16384),                          # ~240,000 km^2
+}
+radii = [100, 250, 500, 1000]                               # neighborhood radii in m
+houses_per_km2 = 3.0                                        # average address point density of the synthetic study area
+zone_blocks = 8                                             # synthetic "counties" are an zone_blocks x zone_blocks grid of blocks
+regression_tolerance = 0.10                                 # report stages more than 10% slower than the previous result
+results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_results")
+
+
+# Synthetic data
+#############################################################################################################
+# Land cover from smoothed noise fields: valleys of water and agriculture, developed areas near towns, forest and shrub elsewhere
+def syntheticNLCD(rows, cols, rng):
+    def field(scale):
+        noise = rng.standard_normal((rows // 8 + 1, cols // 8 + 1)).astype(np.float32)
+        smooth = ndimage.gaussian_filter(noise, scale / 8)
+        return ndimage.zoom(smooth, 8, order=1)[:rows, :cols]
+
+    elevation = field(60)
+    moisture = field(25)
+    nlcd = np.full((rows, cols), 71, dtype=np.uint8)                     # grassland
+    nlcd[moisture > 0.3 * moisture.std()] = 52                          # shrub
+    nlcd[elevation > 0.2 * elevation.std()] = 42                        # evergreen forest
+    nlcd[(elevation > 0) & (moisture > elevation)] = 41                 # deciduous forest
+    nlcd[(elevation < -0.8 * elevation.std()) & (moisture < 0)] = 81    # pasture
+    nlcd[(elevation < -1.0 * elevation.std()) & (moisture > 0)] = 82    # crops
+    nlcd[(elevation < -0.8 * elevation.std()) & (moisture > 1.5 * moisture.std())] = 90
+    nlcd[elevation < -2.0 * elevation.std()] = 11                       # lakes in the lowest valleys
+    return nlcd, elevation
+
+
+# Address points clustered into towns on low ground, plus scattered rural houses
+def syntheticAddressPoints(nlcd, elevation, grid, rng):
+    rows, cols = nlcd.shape
+    area_km2 = rows * cols * grid["cell_size"] ** 2 / 1e6
+    count = int(area_km2 * houses_per_km2)
+    town_count = max(3, int(area_km2 / 400))
+    lowland = np.flatnonzero((elevation < 0).ravel() & (nlcd.ravel() != 11))
+    town_cells = rng.choice(lowland, town_count)
+    town_x = grid["x_min"] + (town_cells % cols + 0.5) * grid["cell_size"]
+    town_y = grid["y_max"] - (town_cells // cols + 0.5) * grid["cell_size"]
+    town_sizes = rng.pareto(1.5, town_count) + 1
+
+    clustered = int(count * 0.8)
+    town = rng.choice(town_count, clustered, p=town_sizes / town_sizes.sum())
+    spread = 500 + 300 * np.sqrt(town_sizes[town])
+    x = np.concatenate([town_x[town] + rng.normal(0, 1, clustered) * spread, grid["x_min"] + rng.random(count - clustered) * cols * grid["cell_size"]])
+    y = np.concatenate([town_y[town] + rng.normal(0, 1, clustered) * spread, grid["y_max"] - rng.random(count - clustered) * rows * grid["cell_size"]])
+    rows_, cols_, inside = mw.pointsToCells(x, y, grid)
+    return x[inside], y[inside]
+
+
+def syntheticZones(rows, cols):
+    zone_rows = np.minimum(np.arange(rows) * zone_blocks // rows, zone_blocks - 1)
+    zone_cols = np.minimum(np.arange(cols) * zone_blocks // cols, zone_blocks - 1)
+    return (zone_rows[:, None] * zone_blocks + zone_cols[None, :]).astype(np.int32)
+
+
+# Timing
+#############################################################################################################
+# Best wall time of repeat calls (the minimum is the least noisy estimate), and the result of the last call
+def timeStage(function, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def benchmarkSize(size_name, repeat, radii_to_run, seed=0):
+    rows, cols = sizes[size_name]
+    megapixels = rows * cols / 1e6
+    rng = np.random.default_rng(seed)
+    grid = mw.makeGrid(500000, 300000 + rows * cell_size, cell_size, rows, cols)
+    nlcd, elevation = syntheticNLCD(rows, cols, rng)
+    x, y = syntheticAddressPoints(nlcd, elevation, grid, rng)
+    zones = syntheticZones(rows, cols)
+    print(f"{size_name}: {rows}x{cols} cells ({megapixels:.1f} MP), {len(x)} address points.")
+
+    results = []
+
+    def record(stage, radius, seconds):
+        results.append({"size": size_name, "stage": stage, "radius": radius, "seconds": round(seconds, 4),
+                        "mp_per_s": round(megapixels / seconds, 2) if seconds > 0 else None})
+        print(f"\t{stage:<22} radius {str(radius):>5}: {seconds:8.3f}s  {results[-1]['mp_per_s']} MP/s")
+
+    def classify():
+        return mw.validMask(nlcd), mw.waterRaster(nlcd), mw.wildlandBaseRaster(nlcd)
+    seconds, (valid, buildable, wildveg) = timeStage(classify, repeat)
+    record("classification", None, seconds)
+
+    seconds, (wildland_areas, wildveg_buffer) = timeStage(lambda: mw.findWildlandAreas(wildveg, cell_size), repeat)
+    record("large_patch_buffer", None, seconds)
+
+    for radius in radii_to_run:
+        seconds, nbr_houses = timeStage(lambda: mw.makeNeighborhoods(x, y, grid, radius), repeat)
+        record("house_counts", radius, seconds)
+
+        seconds, wildcover50 = timeStage(lambda: mw.calcWildlandCover(wildveg, valid, radius, cell_size), repeat)
+        record("wildland_cover", radius, seconds)
+
+        def classifyWUI():
+            return mw.calcWUI(mw.neighborhoodDensity(nbr_houses, radius), buildable, wildcover50, wildveg_buffer, valid)
+        seconds, wui = timeStage(classifyWUI, repeat)
+        record("wui_classification", radius, seconds)
+
+        seconds, regions = timeStage(lambda: mw.polygonizeWUI(wui), repeat)
+        record("polygonization", radius, seconds)
+
+        seconds, areas = timeStage(lambda: mw.tabulateArea(zones, wui, cell_size, zone_blocks * zone_blocks), repeat)
+        record("zonal_tabulation", radius, seconds)
+    return results
+
+
+# Results
+#############################################################################################################
+def gitRevision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def latestResults():
+    files = sorted(glob.glob(os.path.join(results_dir, "*.json")))
+    if not files:
+        return None, None
+    with open(files[-1]) as f:
+        return files[-1], json.load(f)
+
+
+def compareResults(previous, current):
+    before = {(r["size"], r["stage"], r["radius"]): r["seconds"] for r in previous["results"]}
+    regressions = 0
+    for r in current["results"]:
+        key = (r["size"], r["stage"], r["radius"])
+        if key not in before or before[key] <= 0:
+            continue
+        change = r["seconds"] / before[key] - 1
+        if change > regression_tolerance:
+            regressions += 1
+            print(f"\tREGRESSION {r['size']} {r['stage']} radius {r['radius']}: {before[key]:.3f}s -> {r['seconds']:.3f}s ({change:+.0%})")
+    if regressions == 0:
+        print(f"\tNo stage is more than {regression_tolerance:.0%} slower than the previous result.")
+    return regressions
+
+
+# Main
+#############################################################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the WUI pipeline stages on synthetic data.")
+    parser.add_argument("--sizes", nargs="+", choices=list(sizes), default=["county"])
+    parser.add_argument("--radii", nargs="+", type=int, default=radii)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    current = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "revision": gitRevision(),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "machine": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "cell_size": cell_size,
+        "results": [],
+    }
+    for size_name in args.sizes:
+        current["results"] += benchmarkSize(size_name, args.repeat, args.radii, args.seed)
+
+    previous_file, previous = latestResults()
+    if previous is not None:
+        print(f"Comparing with {os.path.basename(previous_file)} (revision {previous.get('revision')}):")
+        compareResults(previous, current)
+
+    if not os.path.exists(results_dir):
+        os.makedirs(results_dir)
+    out_file = os.path.join(results_dir, datetime.now().strftime("%Y%m%d_%H%M%S") + "_" + str(current["revision"]) + ".json")
+    with open(out_file, "w") as f:
+        json.dump(current, f, indent=1)
+    print(f"Results saved to {out_file}.")
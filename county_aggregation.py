@@ -23,27 +23,19 @@ arcpy.env.cellSize = 30                                                     # Se
 
 # Paths
 #############################################################################################################
-# workspace
-space = "C:\\Users\\Cheryl\\Documents\\montana_wui_mapping"     # Make sure all other input files are in this folder!
-
-# main folders
-output = space + "\\output\\"
-temp = space + "\\temp\\"
-county_analysis_output = space + "\\analysis\\county_analysis_output\\"
+# main folders and county polygons (see wui_settings.py)
+from wui_settings import output, temp, county_analysis_output, county_polygons
 
 # objects
-county_polygons = county_analysis_output + "county_analysis_output.shp"
 temp_county_polygons = temp + "temp_county_polygons.shp"
 
 
 
-
-
-
-# Main
+# Aggregation
 #############################################################################################################
-if __name__ == "__main__":
-    for year in range(2012, 2025):
+# Join intermix and interface WUI area per county of every year onto county_polygons as imWUI_{year} and ifWUI_{year}
+def aggregateCounties(years):
+    for year in years:
         print("tabulating year " + str(year))
         wui_raster = output + str(year) + ".tif"
         curr_tabulated_areas_table = os.path.join(env.scratchGDB, "tabulated_areas_table_" + str(year))
@@ -58,7 +50,7 @@ if __name__ == "__main__":
             in_class_data = wui_raster,
             class_field = "VALUE",
             out_table = curr_tabulated_areas_table,
-            processing_cell_size = arcpy.env.cellSize
+            processing_cell_size = arcpy.Describe(wui_raster).meanCellWidth     # areas at the map's own cell size (10m maps too)
         )
 
         # create renamed fields
@@ -79,4 +71,10 @@ if __name__ == "__main__":
             join_table=curr_tabulated_areas_table,
             join_field="COUNTYNUMB",
             fields = ["imWUI_" + str(year), "ifWUI_" + str(year)]
-        )
\ No newline at end of file
+        )
+
+
+# Main
+#############################################################################################################
+if __name__ == "__main__":
+    aggregateCounties(range(2012, 2025))
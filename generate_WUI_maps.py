@@ -10,12 +10,20 @@
 # Imports
 #############################################################################################################
 import os
-import shutil
 import sys, string 
 import arcpy
-import gc
+import json
+import numpy as np
+from datetime import datetime
 from arcpy import env
 from arcpy.sa import *
+from stage_trace import StageTrace
+from pipeline_dag import Stage, PipelineRunner
+from input_catalog import InputCatalog
+import scratch_manager
+import moving_window as mw
+import raster_io
+import shapefile_reader
 
 
 # Settings
@@ -26,31 +34,15 @@ env.overwriteOutput = True                                                  # Al
 projection_factory_code = 6514                                              # Factory code for the NAD 1983 (2011) StatePlane Montana FIPS 2500 (Meters) projection
 NAD_1983_2011_SP_Montana = arcpy.SpatialReference(projection_factory_code)  # Spatial reference object for the NAD 1983 (2011) StatePlane Montana FIPS 2500 (Meters) projection
 env.workspace = "C:\\Users\\Cheryl\\Documents\\montana_wui_mapping"         # Make sure all input files are in this folder
-arcpy.env.cellSize = 30                                                     # Set default raster cell size to 30m
+arcpy.env.cellSize = 30                                                     # Set default raster cell size to 30m (cell_size in wui_settings.py)
+arcpy.env.parallelProcessingFactor = "100%"                                 # Let tools that support it (e.g. ProjectRaster) split work across all cores
+arcpy.env.geographicTransformations = "WGS_1984_(ITRF08)_To_NAD_1983_2011"  # Datum transformation used when reprojecting WGS 1984 based inputs (e.g. NLCD Albers)
 
 
 # Paths
 #############################################################################################################
-# workspace
-space = "C:\\Users\\Cheryl\\Documents\\montana_wui_mapping"     # Make sure all other input files are in this folder!
-
-# main folders
-output = space + "\\output\\" 
-temp = space + "\\temp\\"
-raw = space + "\\data\\raw\\"
-prepared = space + "\\data\\prepared\\"
-misc = space + "\\data\\misc\\"
-
-# raw data
-address_point_downloads = raw + "\\address_point_downloads\\"
-boundary_downloads = raw + "\\boundary_downloads\\"
-nlcd_downloads = raw + "\\nlcd_downloads\\"
-
-# prepared data
-address_points = prepared + "\\address_points\\"
-study_areas = prepared + "\\study_area\\"
-nlcd_projected = prepared + "\\nlcd\\nlcd_projected\\"
-nlcd_projected_clipped = prepared + "\\nlcd\\nlcd_projected_clipped\\"
+# folders, inputs and scenarios are defined in wui_settings.py so they can be read without arcpy
+from wui_settings import *
 
 
 
@@ -85,52 +77,108 @@ def projectNLCDRaster():
 
 # Data preparation functions
 #############################################################################################################
-def clipNLCD(map_name, curr_nlcd, study_area):
+def clipNLCD(map_name, curr_nlcd, study_area, clipped_nlcd):
     clipped_NLCD_raster = ExtractByMask(curr_nlcd, study_area)
-    clipped_NLCD_raster.save(nlcd_projected_clipped + "nlcd_" + str(map_name) + "_pc.tif")
+    clipped_NLCD_raster.save(clipped_nlcd)
     print(f"{map_name}: NLCD raster clipping completed.")
 
 
-def clearTempDirectory():
-    print("Clearing temp directory.")
-    for filename in os.listdir(temp):
-        curr_file = os.path.join(temp, filename)
-        try:
-            if os.path.isfile(curr_file) or os.path.islink(curr_file):
-                os.remove(curr_file)
-            elif os.path.isdir(curr_file):
-                shutil.rmtree(curr_file)
-            print(f"Deleted: {curr_file}")
-        except Exception as e:
-            print(f"Failed to delete {curr_file}: {e}")
-    gc.collect()
+# Metadata index of the inputs, opened once per process
+_catalog = None
+def getCatalog():
+    global _catalog
+    if _catalog is None:
+        _catalog = InputCatalog(catalog_file)
+    return _catalog
+
+
+# Scratch workspaces of the maps, one manager (and cleanup thread) per process; workspaces of the parents of sub_regions
+# are kept out of eviction since windowedWUI reads their intermediates
+_scratch = None
+def getScratch():
+    global _scratch
+    if _scratch is None:
+        _scratch = scratch_manager.ScratchManager(scratch_roots, protected={sub_region["parent"] for sub_region in sub_regions.values()})
+    return _scratch
+
+
+# Scratch workspace of a map, sized from the cataloged NLCD so it spills to a slower root when the fast one is full
+def mapWorkspace(map_name, curr_nlcd, fresh=False):
+    record = getCatalog().cached(curr_nlcd)
+    expected_bytes = record["rows"] * record["cols"] * scratch_manager.bytes_per_cell if record and record["rows"] else 0
+    return getScratch().workspace(map_name, fresh, expected_bytes)
+
+
+# Reproject a raster or feature class to projection_factory_code, reusing the cached copy if this source was already warped
+def reprojectInput(map_name, in_path, record):
+    stem, ext = os.path.splitext(os.path.basename(in_path))
+    is_raster = record["data_type"] in ("RasterDataset", "RasterBand")
+    out_path = reprojected + f"{stem}_{getCatalog().checksum(in_path)[:16]}_{projection_factory_code}" + (".tif" if is_raster else ".shp")
+    if arcpy.Exists(out_path):
+        print(f"\t{record['name']} was already reprojected, using cached '{out_path}'.")
+        return out_path
+
+    # warp to a partial name and rename on success, so a warp that failed part way is never taken for a cached copy
+    partial_path = os.path.splitext(out_path)[0] + "_partial" + os.path.splitext(out_path)[1]
+    if arcpy.Exists(partial_path):
+        arcpy.management.Delete(partial_path)
+    if is_raster:
+        # nearest neighbour keeps NLCD class codes intact, registration point (0, 0) snaps cells onto the 30m grid,
+        # and parallelProcessingFactor lets ProjectRaster warp the raster in chunks on every core
+        arcpy.management.ProjectRaster(
+            in_raster=in_path,
+            out_raster=partial_path,
+            out_coor_system=NAD_1983_2011_SP_Montana,
+            resampling_type="NEAREST",
+            cell_size=f"{arcpy.env.cellSize} {arcpy.env.cellSize}",
+            Registration_Point="0 0"
+        )
+    else:
+        # projects every feature of the class in one batch tool call
+        arcpy.management.Project(in_path, partial_path, NAD_1983_2011_SP_Montana)
+    arcpy.management.Rename(partial_path, out_path)
+    print(f"\t{record['name']} reprojected to '{out_path}'.")
+    return out_path
 
 
-# Make sure that NLCD raster, boundary, and house polygons/points are using the desired projection
+# Make sure that NLCD raster, boundary, and house polygons/points are using the desired projection, reprojecting them if not
 def checkProjections(map_name, curr_nlcd, curr_address_points, curr_study_area):
     projected_objects = [curr_address_points, curr_study_area, curr_nlcd]
+    checked_objects = []
+    if not os.path.exists(reprojected):
+        os.makedirs(reprojected)
     print(f"{map_name}: checking object projections.")
     for projected_object in projected_objects:
-        description = arcpy.Describe(projected_object)
-        spatial_ref = description.spatialReference
-        if spatial_ref.factoryCode != projection_factory_code:
-            print("\t" + description.name + " has factory code of " + str(spatial_ref.factoryCode) + " and needs to be reprojected.")
+        record = getCatalog().lookup(projected_object)
+        if record["wkid"] != projection_factory_code:
+            print("\t" + record["name"] + " has factory code of " + str(record["wkid"]) + " and needs to be reprojected.")
+            checked_objects.append(reprojectInput(map_name, projected_object, record))
         else:
-            print("\t" + description.name + " does not need to be reprojected.")
+            print("\t" + record["name"] + " does not need to be reprojected.")
+            checked_objects.append(projected_object)
+    return checked_objects
 
 
 # Ensure proper 'value1' field for housing file
 def addValue1(map_name, curr_address_points):
     print(f"{map_name}: managing value1 field in housing .shp file.")
     # Check if 'value1' field already exists, add it if not
-    fields = [field.name for field in arcpy.ListFields(curr_address_points)]
+    fields = getCatalog().fieldNames(curr_address_points)
     if "value1" not in fields:
         arcpy.AddField_management(curr_address_points, "value1", "SHORT")
         print("\tHousing shapefile did not have value1 field, it has been added.")
     else:
         print("\tHousing shapefile already had value1 field.")
 
-    # Set value1 = 1 for all rows
+    # Set value1 = 1 for all rows, only rewriting the file (and so invalidating its catalog entry) if some row needs it
+    if curr_address_points.lower().endswith(".shp"):
+        needs_update = bool((shapefile_reader.readDBF(curr_address_points, ["value1"])["value1"] != 1).any())
+    else:
+        with arcpy.da.SearchCursor(curr_address_points, ["value1"]) as cursor:
+            needs_update = any(row[0] != 1 for row in cursor)
+    if not needs_update:
+        print("\tvalue1 is already 1 for all rows in housing shapefile.")
+        return
     with arcpy.da.UpdateCursor(curr_address_points, ["value1"]) as cursor:
         for row in cursor:
             row[0] = 1
@@ -140,28 +188,56 @@ def addValue1(map_name, curr_address_points):
 
 # WUI generation functions
 #############################################################################################################
-def waterRaster(map_name, curr_nlcd):
+# Paths of every intermediate and output dataset of one map, keyed by the names the stages below use
+def mapPaths(map_name, buffer, curr_temp):
+    return {
+        "workspace": curr_temp,
+        "water": curr_temp + "waterRaster.tif",
+        "wildveg": curr_temp + "wildveg.tif",
+        "wildland_polygons": curr_temp + "wildLandPoly.shp",
+        "wildland_areas": curr_temp + "wildlandAreas.tif",
+        "wildveg_buffer": curr_temp + "wildveg_buffer.tif",
+        "centroids": curr_temp + "housesCentroids.shp",
+        "nbr_houses": curr_temp + "nbrHouses" + str(buffer) + ".tif",
+        "house_density": curr_temp + "houseDen" + str(buffer) + ".tif",
+        "density_filled": curr_temp + "outCon" + str(buffer) + ".tif",
+        "den_no_water": curr_temp + "denNoWater" + str(buffer) + ".tif",
+        "nbr_cover": curr_temp + "nbrcover" + str(buffer) + ".tif",
+        "sum_cover": curr_temp + "sumCover_" + str(buffer) + ".tif",
+        "wildcover50": curr_temp + "wildcover50_" + str(buffer) + ".tif",
+        "wui_polygons_unclipped": curr_temp + "wui_polig_" + str(buffer) + ".shp",
+        "native_nlcd": curr_temp + "nlcd_native.tif",
+        "native_wui": curr_temp + "wui_native_" + str(buffer) + ".tif",
+        "intermix": output + map_name[:10] + "_im.tif",
+        "interface": output + map_name[:10] + "_if.tif",
+        "wui": output + map_name[:10] + ".tif",
+        "wui_polygons": output + map_name[:10] + "_p.shp",
+    }
+
+
+def waterRaster(map_name, curr_nlcd, paths):
     outRas = Con(curr_nlcd, 0, 1, "Value = 11")
-    outRas.save(temp + "waterRaster.tif")
+    outRas.save(paths["water"])
     print(f"{map_name}: water raster completed.")
    
 
-def wildlandBaseRaster(map_name, curr_nlcd):
+def wildlandBaseRaster(map_name, curr_nlcd, paths):
     outRas = Con(curr_nlcd, 1, 0, "Value = 41 OR Value = 42 OR Value = 43 OR Value = 52 OR Value = 71 OR Value = 90 OR Value = 95")
-    outRas.save(temp + "wildveg.tif")
+    outRas.save(paths["wildveg"])
     print(f"{map_name}: wildland base raster completed.")
 
  
-def findWildlandAreas(map_name):
-    inRas = temp + "wildveg.tif"
-    polys = arcpy.RasterToPolygon_conversion(inRas, temp + "wildLandPoly" + map_name, "NO_SIMPLIFY", "Value")
+def findWildlandAreas(map_name, paths):
+    curr_temp = paths["workspace"]
+    inRas = paths["wildveg"]
+    polys = arcpy.RasterToPolygon_conversion(inRas, paths["wildland_polygons"], "NO_SIMPLIFY", "Value")
     
     polys2 = polys
     arcpy.AddField_management(polys, "value", "SHORT")
     
     arcpy.AddGeometryAttributes_management(polys, "AREA", "METERS", "SQUARE_METERS")
     
-    with arcpy.da.UpdateCursor(temp + "wildLandPoly" + map_name + ".shp", ["POLY_AREA", "gridcode", "value"]) as cursor:
+    with arcpy.da.UpdateCursor(paths["wildland_polygons"], ["POLY_AREA", "gridcode", "value"]) as cursor:
         for row in cursor:
             if (row[0] > 5000 and str(row[1]) == "1"):
                 row[2] = 1
@@ -169,63 +245,63 @@ def findWildlandAreas(map_name):
                 row[2] = 0
             cursor.updateRow(row)
     
-    arcpy.PolygonToRaster_conversion(polys, "value",temp + "wildlandAreas.tif")
+    arcpy.PolygonToRaster_conversion(polys, "value", paths["wildland_areas"])
     
-    ftLayer = arcpy.MakeFeatureLayer_management(polys2, temp + "polys2Feat")
+    ftLayer = arcpy.MakeFeatureLayer_management(polys2, "polys2Feat_" + str(map_name).replace(" ", "_"))
     arcpy.SelectLayerByAttribute_management(ftLayer, "NEW_SELECTION", 'POLY_AREA > 25000000 AND gridcode = 1')
     
-    arcpy.CopyFeatures_management(ftLayer, temp + "preBuffer.shp")
+    arcpy.CopyFeatures_management(ftLayer, curr_temp + "preBuffer.shp")
 
     # this is the line where there was an error "ERROR 002836: An error occurred during the buffer operation. Failed to execute (Buffer)."
     # fixed by first creating non-dissolved layer (last param = "NONE"), then dissolving seperately
-    buffPolys = arcpy.Buffer_analysis(temp + "preBuffer.shp", temp + "bufferNoDissolve.shp", "2400 meters", "FULL", "ROUND", "NONE")
-    arcpy.Dissolve_management(temp + "bufferNoDissolve.shp", temp + "bufferPolys.shp")
+    buffPolys = arcpy.Buffer_analysis(curr_temp + "preBuffer.shp", curr_temp + "bufferNoDissolve.shp", "2400 meters", "FULL", "ROUND", "NONE")
+    arcpy.Dissolve_management(curr_temp + "bufferNoDissolve.shp", curr_temp + "bufferPolys.shp")
 
     
-    arcpy.AddField_management(temp + "bufferPolys.shp", "value", "SHORT")
+    arcpy.AddField_management(curr_temp + "bufferPolys.shp", "value", "SHORT")
     
-    with arcpy.da.UpdateCursor(temp + "bufferPolys.shp", ["id", "value"]) as cursor:
+    with arcpy.da.UpdateCursor(curr_temp + "bufferPolys.shp", ["id", "value"]) as cursor:
         for row in cursor:
             row[1] = 1
             cursor.updateRow(row)
     
-    arcpy.PolygonToRaster_conversion(temp + "bufferPolys.shp", "value", temp + "farcover")
+    arcpy.PolygonToRaster_conversion(curr_temp + "bufferPolys.shp", "value", curr_temp + "farcover.tif")
     
-    farcover = temp + "farcover"
-    outcon = Con(IsNull(farcover), 0, temp + "farcover")
-    outcon.save(temp + "wildveg_buffer.tif")
+    farcover = curr_temp + "farcover.tif"
+    outcon = Con(IsNull(farcover), 0, farcover)
+    outcon.save(paths["wildveg_buffer"])
     
     print(f"{map_name}: Wildland areas completed.")
 
 
-def footprintCentroids(map_name, curr_address_points):
-    arcpy.FeatureToPoint_management(curr_address_points, temp + "housesCentroids.shp")
+def footprintCentroids(map_name, curr_address_points, paths):
+    arcpy.FeatureToPoint_management(curr_address_points, paths["centroids"])
     print(f"{map_name}: footprint centroids completed.")
 
 
-def makeNeighborhoods(map_name, buffer):
-    nbrHouses = PointStatistics(temp + "housesCentroids.shp", "value1", 30, NbrCircle(buffer, "MAP"), "SUM")
-    nbrHouses.save(temp + "nbrHouses" + str(buffer) + ".tif")
+def makeNeighborhoods(map_name, buffer, paths):
+    nbrHouses = PointStatistics(paths["centroids"], "value1", arcpy.env.cellSize, NbrCircle(buffer, "MAP"), "SUM")
+    nbrHouses.save(paths["nbr_houses"])
     print(f"{map_name}: house counting completed.")
     
 
-def neighborhoodDensity(map_name, buffer):
-    houseDen = ((arcpy.Raster(temp + "nbrHouses" + str(buffer) + ".tif") / (3.14 * float(buffer) * float(buffer))) * 1000000) > 6.17
-    houseDen.save(temp + "houseDen" + str(buffer) + ".tif")
+def neighborhoodDensity(map_name, buffer, paths):
+    houseDen = ((arcpy.Raster(paths["nbr_houses"]) / (3.14 * float(buffer) * float(buffer))) * 1000000) > 6.17
+    houseDen.save(paths["house_density"])
     print(f"{map_name}: neighborhood density completed.")
     
 
-def replaceNoData(map_name, buffer):
-    outCon = Con(IsNull(temp + "houseDen" + str(buffer) + ".tif"), 0, temp + "houseDen" + str(buffer) + ".tif")
-    outCon.save(temp + "outCon" + str(buffer) + ".tif")
+def replaceNoData(map_name, buffer, paths):
+    outCon = Con(IsNull(paths["house_density"]), 0, paths["house_density"])
+    outCon.save(paths["density_filled"])
     print(f"{map_name}: finished replacing nulls in neigborhood density.")
     
 
-def removeWater(map_name, buffer):
-    denNoWater = Raster(temp + "outCon" + str(buffer) + ".tif") * Raster(temp + "waterRaster.tif")
+def removeWater(map_name, buffer, paths):
+    denNoWater = Raster(paths["density_filled"]) * Raster(paths["water"])
     arcpy.management.CopyRaster(
         denNoWater,
-        temp + "denNoWater" + str(buffer) + ".tif",
+        paths["den_no_water"],
         pixel_type="32_BIT_FLOAT",      # May need to change this
         nodata_value="0",
         format="TIFF"
@@ -233,88 +309,336 @@ def removeWater(map_name, buffer):
     print(f"{map_name}: finished removing water areas from housing density raster.")
    
 
-def calcWildlandCover(map_name, buffer):
-    wildland_base = temp + "wildveg.tif"
+def calcWildlandCover(map_name, buffer, paths):
+    wildland_base = paths["wildveg"]
     NbrCover = FocalStatistics(arcpy.Raster(wildland_base), NbrCircle(int(buffer), "MAP"), "SUM")
-    NbrCover.save(temp + "nbrcover" + str(buffer) + ".tif")
+    NbrCover.save(paths["nbr_cover"])
     NbrCoverZero = FocalStatistics(EqualTo(arcpy.Raster(wildland_base),0), NbrCircle(int(buffer), "MAP"), "SUM")
     sumCover = NbrCover+NbrCoverZero
-    sumCover.save(temp + "sumCover_" + str(buffer) + ".tif")
+    sumCover.save(paths["sum_cover"])
     wildcover = float(1)*NbrCover/(NbrCover+NbrCoverZero)
     wildcover50 = wildcover > 0.5
-    wildcover50.save(temp+"wildcover50_" + str(buffer) + ".tif")
+    wildcover50.save(paths["wildcover50"])
     print(f"{map_name}: finished calculating wildland cover.")
    
 
-def calcWUI(map_name, buffer, curr_study_area):
+def calcWUI(map_name, buffer, paths):
     # calculate intermix
-    IMWui = Con((Raster(temp+"denNoWater" + str(buffer) + ".tif") == 1) & (Raster(temp + "wildcover50_" + str(buffer) + ".tif") == 1), 1 , 0)
+    IMWui = Con((Raster(paths["den_no_water"]) == 1) & (Raster(paths["wildcover50"]) == 1), 1 , 0)
     # save intermix
     arcpy.management.CopyRaster(
         IMWui,
-        output + map_name[:10] + "_im.tif",
+        paths["intermix"],
         pixel_type="8_BIT_UNSIGNED",
         nodata_value="0",
         format="TIFF"
     )
     # calculate interface
-    IFWui = Raster(temp+"denNoWater" + str(buffer) + ".tif") * Raster(temp + "wildveg_buffer.tif")
+    IFWui = Raster(paths["den_no_water"]) * Raster(paths["wildveg_buffer"])
     # save interface
-    IFWui.save(output + map_name[:10] + "_if.tif")
+    IFWui.save(paths["interface"])
     # calculate overall map
     Wui = Con(IMWui == 1, 1, Con(IFWui == 1, 2 , 0))
     # save overall map raster
     arcpy.management.CopyRaster(
         Wui,
-        output + map_name[:10] + ".tif",
+        paths["wui"],
         pixel_type="8_BIT_UNSIGNED",
         nodata_value="0",
         format="TIFF"
     )
-    # save overall map as polygons
-    arcpy.RasterToPolygon_conversion(output + map_name[:10] + ".tif", temp + "wui_polig_" + str(buffer) + ".shp", "NO_SIMPLIFY", "VALUE")
-    arcpy.Clip_analysis(temp + "wui_polig_" + str(buffer) + ".shp", curr_study_area, output + map_name[:10] + "_p.shp")
     print (f"{map_name}: WUI map at " + str(buffer) + "m neighborhood buffer size completed.")
 
 
-def createMaps(map_name, buffer):
-    # decide which source data to use
-    if (map_name == "Ketchpaw Flathead"):
-        curr_address_points = address_points + "Flathead_2020_address_points.shp"
-        curr_nlcd = nlcd_projected_clipped + "nlcd_flathead.tif"
-        curr_study_area = study_areas + "FlatheadCounty.shp"
-    elif (map_name == "Ketchpaw Source Flathead"):
-        curr_address_points = address_points + "Flathead_2020_address_points.shp"
-        curr_nlcd = nlcd_projected_clipped + "nlcd_kp_pc2.tif"
-        curr_study_area = study_areas + "FlatheadCounty.shp"
+# Intermix and interface rasters of a map computed in one step (windowed, tiled and native runs), split from its WUI map.
+# Saved like calcWUI's intermix (1 or NoData); unlike calcWUI's interface, which is 1 wherever dense housing is near a
+# large patch, the interface raster here leaves out the cells that are already intermix.
+def classRasters(map_name, buffer, paths):
+    wui = Raster(paths["wui"])
+    for value, name in [(1, "intermix"), (2, "interface")]:
+        arcpy.management.CopyRaster(
+            Con(wui == value, 1, 0),
+            paths[name],
+            pixel_type="8_BIT_UNSIGNED",
+            nodata_value="0",
+            format="TIFF"
+        )
+    print(f"{map_name}: intermix and interface maps at " + str(buffer) + "m neighborhood buffer size completed.")
+
+
+def classStage(map_name, buffer, paths):
+    return Stage("classRasters", classRasters, (map_name, buffer, paths), [paths["wui"]], [paths["intermix"], paths["interface"]], buffer)
+
+
+def polygonizeWUI(map_name, buffer, curr_study_area, paths):
+    arcpy.RasterToPolygon_conversion(paths["wui"], paths["wui_polygons_unclipped"], "NO_SIMPLIFY", "VALUE")
+    arcpy.Clip_analysis(paths["wui_polygons_unclipped"], curr_study_area, paths["wui_polygons"])
+    print(f"{map_name}: WUI polygons at " + str(buffer) + "m neighborhood buffer size completed.")
+
+
+# WUI of a sub-region from windows of its parent map's intermediates. The patch buffer (built from whole statewide
+# patches) and the neighborhood house counts are read as they are; wildland cover is recomputed from the wildland mask
+# read with a halo of one radius, so cells near the sub-region edge still see the neighborhood across it.
+def windowedWUI(map_name, buffer, parent_paths, curr_study_area, paths):
+    grid = raster_io.rasterGrid(parent_paths["wildveg"])
+    cell_size = grid["cell_size"]
+    extent = getCatalog().lookup(curr_study_area)
+    row = max(int((grid["y_max"] - extent["y_max"]) // cell_size), 0)
+    col = max(int((extent["x_min"] - grid["x_min"]) // cell_size), 0)
+    nrows = min(int(-(-(grid["y_max"] - extent["y_min"]) // cell_size)), grid["rows"]) - row
+    ncols = min(int(-(-(extent["x_max"] - grid["x_min"]) // cell_size)), grid["cols"]) - col
+    halo = int(np.ceil(buffer / cell_size))
+    halo_grid = raster_io.windowGrid(grid, row - halo, col - halo, nrows + 2 * halo, ncols + 2 * halo)
+    inner = (slice(halo, halo + nrows), slice(halo, halo + ncols))
+
+    # 255 marks cells outside the parent's clipped NLCD, which count for neither wildland nor non-wildland cover
+    wildveg = raster_io.readWindow(parent_paths["wildveg"], grid, row - halo, col - halo, halo_grid["rows"], halo_grid["cols"], nodata=255, dtype=np.uint8)
+    valid = wildveg != 255
+    wildcover50 = mw.calcWildlandCover((wildveg == 1).astype(np.uint8), valid, buffer, cell_size)[inner]
+    buildable = raster_io.readWindow(parent_paths["water"], grid, row, col, nrows, ncols, nodata=0, dtype=np.uint8)
+    wildveg_buffer = raster_io.readWindow(parent_paths["wildveg_buffer"], grid, row, col, nrows, ncols, nodata=0, dtype=np.uint8)
+    if arcpy.Exists(parent_paths["nbr_houses"]):
+        nbr_houses = raster_io.readWindow(parent_paths["nbr_houses"], grid, row, col, nrows, ncols, nodata=0, dtype=np.int32)
     else:
-        curr_address_points = address_points + map_name + "_address_points.shp"
-        curr_unclipped_nlcd = nlcd_projected + "nlcd_" + map_name + "_p.tif"
-        curr_nlcd = nlcd_projected_clipped + "nlcd_" + map_name + "_pc.tif"
-        curr_study_area = study_areas + "StateofMontanaBuffered.shp"
+        x, y = raster_io.readPointCoordinates(parent_paths["centroids"])
+        nbr_houses = mw.makeNeighborhoods(x, y, halo_grid, buffer)[inner]
+    wui = mw.calcWUI(mw.neighborhoodDensity(nbr_houses, buffer), buildable, wildcover50, wildveg_buffer, valid[inner])
 
-    print(f"Creating map {map_name} using NLCD raster '{curr_nlcd}' and address points '{curr_address_points}'.")
+    raster_io.saveArray(wui, raster_io.windowGrid(grid, row, col, nrows, ncols), paths["workspace"] + "wui_window.tif", nodata=0)
+    arcpy.management.CopyRaster(
+        ExtractByMask(paths["workspace"] + "wui_window.tif", curr_study_area),
+        paths["wui"],
+        pixel_type="8_BIT_UNSIGNED",
+        nodata_value="0",
+        format="TIFF"
+    )
+    print(f"{map_name}: WUI map at " + str(buffer) + "m neighborhood buffer size completed from a window of the parent map.")
+
+
+# WUI of a map at any cell size on the tiled NumPy engine. Disc sums grow with the radius in cells by at most one term
+# per disc row (or not at all with FFT), where FocalStatistics grows with its area, and run_planner.py picks the method,
+# tile size and worker count for this grid and point count within the memory budget.
+def tiledWUI(map_name, buffer, curr_nlcd, curr_address_points, curr_study_area, paths):
+    import point_cache
+    import run_planner
+    import tiled_WUI
+
+    grid = raster_io.rasterGrid(curr_nlcd, getCatalog())
+    points = point_cache.cachedPoints(curr_address_points)     # each tile reads only its own points from the cache
+    plan = run_planner.planRun(grid, points.count, buffer)
+    run_planner.printPlan(plan, grid, points.count, buffer)
+    tiled_WUI.runTiled(curr_nlcd, None, None, buffer, paths["workspace"] + "wui_tiled.tif", points=points, **run_planner.tiledArguments(plan))
+    arcpy.management.CopyRaster(
+        ExtractByMask(paths["workspace"] + "wui_tiled.tif", curr_study_area),
+        paths["wui"],
+        pixel_type="8_BIT_UNSIGNED",
+        nodata_value="0",
+        format="TIFF"
+    )
+    print(f"{map_name}: WUI map at " + str(buffer) + "m neighborhood buffer size completed at " + f"{grid['cell_size']:g}m cells.")
+
+
+def tiledStages(map_name, buffer, curr_nlcd, curr_address_points, curr_study_area, paths):
+    return [
+        Stage("tiledWUI", tiledWUI, (map_name, buffer, curr_nlcd, curr_address_points, curr_study_area, paths), [curr_nlcd, curr_address_points, curr_study_area], [paths["wui"]], buffer),
+        classStage(map_name, buffer, paths),
+        Stage("polygonizeWUI", polygonizeWUI, (map_name, buffer, curr_study_area, paths), [paths["wui"], curr_study_area], [paths["wui_polygons_unclipped"], paths["wui_polygons"]], buffer),
+    ]
+
+
+# Clip the source NLCD to the study area on its own grid: same CRS, cell size and cell boundaries, nothing is resampled
+def clipNativeNLCD(map_name, source_nlcd, curr_study_area, paths):
+    with arcpy.EnvManager(outputCoordinateSystem=arcpy.Describe(source_nlcd).spatialReference, snapRaster=source_nlcd, cellSize=source_nlcd):
+        clipped_NLCD_raster = ExtractByMask(source_nlcd, curr_study_area)
+        clipped_NLCD_raster.save(paths["native_nlcd"])
+    print(f"{map_name}: NLCD raster clipping on its native grid completed.")
+
+
+# WUI on the native NLCD grid. The address points are transformed from the CRS their point cache recorded (the .prj of
+# the address points) into the NLCD's with projections.py, a few array operations per point where warping the NLCD resamples every cell of the state.
+def nativeWUI(map_name, buffer, curr_address_points, curr_study_area, paths):
+    import point_cache
+    import projections
+    import run_planner
+    import tiled_WUI
+
+    grid = raster_io.rasterGrid(paths["native_nlcd"], getCatalog())
+    points = point_cache.cachedPoints(curr_address_points)
+    x, y = projections.transform(*points.points(), points.crs(), grid)
+    plan = run_planner.planRun(grid, len(x), buffer)
+    run_planner.printPlan(plan, grid, len(x), buffer)
+    tiled_WUI.runTiled(paths["native_nlcd"], x, y, buffer, paths["workspace"] + "wui_native_tiled.tif", **run_planner.tiledArguments(plan))
+    arcpy.management.CopyRaster(
+        ExtractByMask(paths["workspace"] + "wui_native_tiled.tif", curr_study_area),
+        paths["native_wui"] if reproject_native_output else paths["wui"],
+        pixel_type="8_BIT_UNSIGNED",
+        nodata_value="0",
+        format="TIFF"
+    )
+    print(f"{map_name}: WUI map at " + str(buffer) + "m neighborhood buffer size completed on the native NLCD grid.")
+
+
+# Warp only the finished map to StatePlane; nearest neighbour keeps the class codes and (0, 0) snaps the cells as in reprojectInput
+def projectNativeWUI(map_name, buffer, paths):
+    cell_size = raster_io.rasterGrid(paths["native_wui"])["cell_size"]
+    arcpy.management.ProjectRaster(
+        in_raster=paths["native_wui"],
+        out_raster=paths["wui"],
+        out_coor_system=NAD_1983_2011_SP_Montana,
+        resampling_type="NEAREST",
+        cell_size=f"{cell_size} {cell_size}",
+        Registration_Point="0 0"
+    )
+    print(f"{map_name}: WUI map at " + str(buffer) + "m neighborhood buffer size reprojected.")
+
+
+# Stages of a map on the grid of its source NLCD; replaces checkProjections, clipNLCD and the StatePlane stages
+def nativeStages(map_name, buffer, source_nlcd, curr_address_points, curr_study_area, paths):
+    wui = paths["native_wui"] if reproject_native_output else paths["wui"]
+    stages = [
+        Stage("clipNativeNLCD", clipNativeNLCD, (map_name, source_nlcd, curr_study_area, paths), [source_nlcd, curr_study_area], [paths["native_nlcd"]]),
+        Stage("nativeWUI", nativeWUI, (map_name, buffer, curr_address_points, curr_study_area, paths), [paths["native_nlcd"], curr_address_points, curr_study_area], [wui], buffer),
+    ]
+    if reproject_native_output:
+        stages.append(Stage("projectNativeWUI", projectNativeWUI, (map_name, buffer, paths), [paths["native_wui"]], [paths["wui"]], buffer))
+    stages.append(classStage(map_name, buffer, paths))
+    stages.append(Stage("polygonizeWUI", polygonizeWUI, (map_name, buffer, curr_study_area, paths), [paths["wui"], curr_study_area], [paths["wui_polygons_unclipped"], paths["wui_polygons"]], buffer))
+    return stages
+
+
+# Stages of a sub-region map when its parent's intermediates exist, None when it has to run the full pipeline
+def subRegionStages(map_name, buffer, paths):
+    sub_region = sub_regions[map_name]
+    parent_temp = getScratch().find(sub_region["parent"])
+    if parent_temp is None:
+        print(f"{map_name}: no workspace of map {sub_region['parent']} found (it has not been run on these scratch roots), running the full pipeline.")
+        return None
+    parent_paths = mapPaths(sub_region["parent"], buffer, parent_temp)
+    houses = parent_paths["nbr_houses"] if arcpy.Exists(parent_paths["nbr_houses"]) else parent_paths["centroids"]
+    inputs = [parent_paths["wildveg"], parent_paths["water"], parent_paths["wildveg_buffer"], houses, sub_region["study_area"]]
+    if not all(arcpy.Exists(curr_input) for curr_input in inputs):
+        print(f"{map_name}: intermediates of map {sub_region['parent']} not found in {parent_temp} (its run did not finish), running the full pipeline.")
+        return None
+    return [
+        Stage("windowedWUI", windowedWUI, (map_name, buffer, parent_paths, sub_region["study_area"], paths), inputs, [paths["wui"]], buffer),
+        classStage(map_name, buffer, paths),
+        Stage("polygonizeWUI", polygonizeWUI, (map_name, buffer, sub_region["study_area"], paths), [paths["wui"], sub_region["study_area"]], [paths["wui_polygons_unclipped"], paths["wui_polygons"]], buffer),
+    ]
+
+
+# Pipeline stages of one map with the datasets each one reads and writes
+def mapStages(map_name, buffer, curr_nlcd, curr_address_points, curr_study_area, paths):
+    return [
+        # generate centroids, water, and wildland areas - run for each year
+        Stage("waterRaster", waterRaster, (map_name, curr_nlcd, paths), [curr_nlcd], [paths["water"]]),
+        Stage("addValue1", addValue1, (map_name, curr_address_points), [curr_address_points], [curr_address_points]),
+        Stage("wildlandBaseRaster", wildlandBaseRaster, (map_name, curr_nlcd, paths), [curr_nlcd], [paths["wildveg"]]),
+        Stage("footprintCentroids", footprintCentroids, (map_name, curr_address_points, paths), [curr_address_points], [paths["centroids"]]),
+        Stage("findWildlandAreas", findWildlandAreas, (map_name, paths), [paths["wildveg"]], [paths["wildland_polygons"], paths["wildland_areas"], paths["wildveg_buffer"]]),
+
+        # calculate WUI - run for each year and neighborhood buffer size
+        Stage("makeNeighborhoods", makeNeighborhoods, (map_name, buffer, paths), [paths["centroids"]], [paths["nbr_houses"]], buffer),
+        Stage("neighborhoodDensity", neighborhoodDensity, (map_name, buffer, paths), [paths["nbr_houses"]], [paths["house_density"]], buffer),
+        Stage("replaceNoData", replaceNoData, (map_name, buffer, paths), [paths["house_density"]], [paths["density_filled"]], buffer),
+        Stage("removeWater", removeWater, (map_name, buffer, paths), [paths["density_filled"], paths["water"]], [paths["den_no_water"]], buffer),
+        Stage("calcWildlandCover", calcWildlandCover, (map_name, buffer, paths), [paths["wildveg"]], [paths["nbr_cover"], paths["sum_cover"], paths["wildcover50"]], buffer),
+        Stage("calcWUI", calcWUI, (map_name, buffer, paths), [paths["den_no_water"], paths["wildcover50"], paths["wildveg_buffer"]], [paths["intermix"], paths["interface"], paths["wui"]], buffer),
+        Stage("polygonizeWUI", polygonizeWUI, (map_name, buffer, curr_study_area, paths), [paths["wui"], curr_study_area], [paths["wui_polygons_unclipped"], paths["wui_polygons"]], buffer),
+    ]
+
+
+# Stages are skipped when their outputs are up to date and a failed run resumes where it stopped; pass fresh=True to start over.
+# Independent stages run in up to `workers` separate processes, since arcpy geoprocessing is not thread safe.
+# native=True computes a yearly map on the grid of its source NLCD download (defaults to native_grid in wui_settings.py).
+def createMaps(map_name, buffer, trace=None, fresh=False, workers=3, native=None):
+    map_name = str(map_name)
+    native = native_grid if native is None else native
+    if trace is None:
+        trace = StageTrace(traces + "wui_trace_" + datetime.now().strftime("%Y%m%d_%H%M%S") + ".csv")
 
-    # data and directory prep
-    clearTempDirectory()
-    if (map_name != "Ketchpaw Flathead" and map_name != "Ketchpaw Source Flathead"):
-        checkProjections(map_name, curr_unclipped_nlcd, curr_address_points, curr_study_area)
-        clipNLCD(map_name, curr_unclipped_nlcd, curr_study_area)
+    # decide which source data to use
+    curr_address_points, curr_unclipped_nlcd, curr_nlcd, curr_study_area = mapInputs(map_name)
 
-    # generate centroids, water, and wildland areas - run for each year
-    waterRaster(map_name, curr_nlcd)
-    addValue1(map_name, curr_address_points)
-    wildlandBaseRaster(map_name, curr_nlcd)
-    footprintCentroids(map_name, curr_address_points)
-    findWildlandAreas(map_name)
+    print(f"Creating map {map_name} using NLCD raster '{curr_nlcd}' and address points '{curr_address_points}'.")
 
-    # calculate WUI - run for each year and neighborhood buffer size
-    makeNeighborhoods(map_name, buffer)
-    neighborhoodDensity(map_name, buffer)
-    replaceNoData(map_name, buffer)
-    removeWater(map_name, buffer)
-    calcWildlandCover(map_name, buffer)
-    calcWUI(map_name, buffer, curr_study_area)
+    # data and directory prep - each map keeps its intermediates in its own scratch workspace so they survive for the
+    # next run; fresh moves the old workspace aside and it is deleted in the background
+    with trace.stage("scratchWorkspace", map_name):
+        curr_temp = mapWorkspace(map_name, curr_nlcd, fresh)
+    try:
+        runMap(map_name, buffer, curr_address_points, curr_unclipped_nlcd, curr_nlcd, curr_study_area, curr_temp, trace, workers, native)
+    finally:
+        getScratch().release(curr_temp)
+
+
+# Stages of one map with its intermediates in curr_temp
+def runMap(map_name, buffer, curr_address_points, curr_unclipped_nlcd, curr_nlcd, curr_study_area, curr_temp, trace, workers, native=False):
+    paths = mapPaths(map_name, buffer, curr_temp)
+    stages = subRegionStages(map_name, buffer, paths) if map_name in sub_regions else None
+    if stages is None and native and nativeNLCD(map_name) is not None:
+        stages = nativeStages(map_name, buffer, nativeNLCD(map_name), curr_address_points, curr_study_area, paths)
+    if stages is None:
+        prep_stages = []
+        if curr_unclipped_nlcd is not None:
+            with trace.stage("checkProjections", map_name):
+                curr_address_points, curr_study_area, curr_unclipped_nlcd = checkProjections(map_name, curr_unclipped_nlcd, curr_address_points, curr_study_area)
+            prep_stages.append(Stage("clipNLCD", clipNLCD, (map_name, curr_unclipped_nlcd, curr_study_area, curr_nlcd), [curr_unclipped_nlcd, curr_study_area], [curr_nlcd]))
+        if mapCellSize(map_name) != cell_size:                  # fine maps go through the tiled NumPy engine
+            stages = prep_stages + tiledStages(map_name, buffer, curr_nlcd, curr_address_points, curr_study_area, paths)
+        else:
+            stages = prep_stages + mapStages(map_name, buffer, curr_nlcd, curr_address_points, curr_study_area, paths)
+
+    runner = PipelineRunner(curr_temp + "pipeline_state.json", map_name, workers=workers, processes=workers > 1, trace=trace)
+    runner.run(stages)
+
+
+# Stages of several scenarios {name: {"address_points", "nlcd", "study_area"}} as one graph. A stage is identified by
+# its name, radius and the identity of its inputs (the source path, or the identity of the stage that wrote it), so a
+# stage identical to one of an earlier scenario is dropped and the later scenario's paths point at the shared outputs.
+def scenarioStages(scenarios, buffer, workspaces=None):
+    workspaces = {scenario: temp + scenario + "\\" for scenario in scenarios} if workspaces is None else workspaces
+    producers = {}                                              # output path -> identity of the stage that writes it
+    computed = {}                                               # stage identity -> outputs of the scenario that runs it
+    all_stages = []
+    for scenario, inputs in scenarios.items():
+        paths = mapPaths(scenario, buffer, workspaces[scenario])
+        curr_stages = mapStages(scenario, buffer, inputs["nlcd"], inputs["address_points"], inputs["study_area"], paths)
+        remap = {}
+        shared = set()
+        for stage in curr_stages:
+            # stages that rewrite their input in place (addValue1) are identified by the path itself
+            identity = (stage.name, stage.radius, tuple(path if path in stage.outputs else producers.get(path, path) for path in stage.inputs))
+            if identity in computed:
+                remap.update(zip(stage.outputs, computed[identity]))
+                shared.add(stage.name)
+            else:
+                computed[identity] = stage.outputs
+            for path in stage.outputs:
+                producers[path] = identity
+
+        paths = {key: remap.get(path, path) for key, path in paths.items()}
+        for stage in mapStages(scenario, buffer, inputs["nlcd"], inputs["address_points"], inputs["study_area"], paths):
+            if stage.name not in shared:
+                stage.name = scenario + ": " + stage.name
+                all_stages.append(stage)
+        if shared:
+            print(f"{scenario}: reusing {', '.join(sorted(shared))} from an earlier scenario.")
+    return all_stages
+
+
+def runScenarios(scenarios, buffer, trace=None, workers=3):
+    if trace is None:
+        trace = StageTrace(traces + "wui_trace_" + datetime.now().strftime("%Y%m%d_%H%M%S") + ".csv")
+    workspaces = {}
+    try:
+        for scenario, inputs in scenarios.items():
+            workspaces[scenario] = mapWorkspace(scenario, inputs["nlcd"])
+        # the state lives with the intermediates it describes, in the first scenario's workspace
+        runner = PipelineRunner(workspaces[next(iter(scenarios))] + "scenario_state.json", "scenarios", workers=workers, processes=workers > 1, trace=trace)
+        runner.run(scenarioStages(scenarios, buffer, workspaces))
+    finally:
+        for workspace in workspaces.values():
+            getScratch().release(workspace)
 
 
 # Main
@@ -324,8 +648,26 @@ if __name__ == "__main__":
     curr_maps = range(2012, 2025)
     curr_buffer = 500
 
+    # refresh the metadata index of everything under data/prepared before any heavy I/O starts
+    print("Cataloging prepared inputs.")
+    getCatalog().scan(prepared)
+    profile_stages = False                                      # Set to True to also dump a cProfile file per stage next to the trace
+    compare_scenarios = False                                   # Set to True to also run the Ketchpaw source comparison
+
+    run_stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    trace = StageTrace(
+        traces + "wui_trace_" + run_stamp + ".csv",
+        profile_dir=traces + "profiles_" + run_stamp + "\\" if profile_stages else None
+    )
+
     for curr_map in curr_maps:
         try:
-            createMaps(curr_map, curr_buffer)
+            createMaps(curr_map, curr_buffer, trace)
         except Exception as e:
-            print(f"An error occurred while creating {curr_map} at {curr_buffer}m buffer distance: {e}")
\ No newline at end of file
+            print(f"An error occurred while creating {curr_map} at {curr_buffer}m buffer distance: {e}")
+    if compare_scenarios:
+        runScenarios(ketchpaw_scenarios, curr_buffer, trace)
+
+    print("Total time per stage:")
+    for stage, seconds in trace.summary():
+        print(f"\t{stage}: {seconds:.1f}s")
\ No newline at end of file
@@ -10,6 +10,7 @@
 # Imports
 #############################################################################################################
 import os
+import csv
 import shutil
 import sys, string 
 import arcpy
@@ -31,17 +32,8 @@ arcpy.env.cellSize = 30                                                     # Se
 
 # Paths
 #############################################################################################################
-# workspace
-space = "C:\\Users\\Cheryl\\Documents\\montana_wui_mapping\\"     # Make sure all other input files are in this folder!
-
-# county polygons
-counties = space + "data\\prepared\\counties\\County.shp"
-
-# year over year tabular
-yoy_data = space + "analysis\\tabular\\YOY_WUI.csv"
-
-# YOY WUI maps output
-output_dir = space + "analysis\\yoy_wui_maps\\"
+# county polygons, year over year tabular and YOY WUI maps output (see wui_settings.py)
+from wui_settings import counties, yoy_data, yoy_output_dir as output_dir, yoy_wide_gdb as wide_gdb
 
 
 
@@ -67,18 +59,72 @@ def createMaps(curr_map):
     arcpy.management.RemoveJoin("county_layer")
 
 
+# COUNTYNUMB can come through as text from the CSV and as a number from the shapefile
+def countyKey(value):
+    try:
+        return str(int(float(value)))
+    except (TypeError, ValueError):
+        return str(value)
+
+
+# Read YOY_WUI.csv once and pivot it to {COUNTYNUMB: {"<column>_<year>": value}} for every numeric column
+def pivotYOYTable(years):
+    pivoted = {}
+    columns = []
+    with open(yoy_data, newline="") as f:
+        for row in csv.DictReader(f):
+            year = int(float(row["Year"]))
+            if year not in years:
+                continue
+            county = pivoted.setdefault(countyKey(row["COUNTYNUMB"]), {})
+            for column, value in row.items():
+                if column in ("Year", "COUNTYNUMB"):
+                    continue
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    continue
+                field = f"{column}_{year}"
+                if field not in columns:
+                    columns.append(field)
+                county[field] = value
+    return pivoted, columns
+
+
+# One copy of the county geometry with per-year columns, filled in a single cursor pass, instead of one joined copy per year
+def createWideMap(curr_maps, out_name="yoy_wui_wide"):
+    pivoted, columns = pivotYOYTable(set(curr_maps))
+    print(f"Pivoted {len(pivoted)} counties into {len(columns)} year columns.")
+
+    if not arcpy.Exists(wide_gdb):
+        arcpy.management.CreateFileGDB(os.path.dirname(wide_gdb.rstrip("\\")), os.path.basename(wide_gdb))
+    out_features = os.path.join(wide_gdb, out_name)
+    arcpy.management.CopyFeatures(counties, out_features)
+    arcpy.management.AddFields(out_features, [[column, "DOUBLE"] for column in columns])
+
+    with arcpy.da.UpdateCursor(out_features, ["COUNTYNUMB"] + columns) as cursor:
+        for row in cursor:
+            values = pivoted.get(countyKey(row[0]), {})
+            cursor.updateRow([row[0]] + [values.get(column) for column in columns])
+    print(f"Wide YOY map written to {out_features}.")
+
+
 # Main
 #############################################################################################################
 if __name__ == "__main__":
 
     # define years to map
     curr_maps = range(2013, 2025)
-
-    # create county polygon layer
-    arcpy.management.MakeFeatureLayer(counties, "county_layer")
-
-    for curr_map in curr_maps:
-        try:
-            createMaps(curr_map)
-        except Exception as e:
-            print(f"An error occurred while creating {curr_map}: {e}")
\ No newline at end of file
+    export_mode = "wide"                                        # "wide" writes one layer with per-year columns, "per_year" one shapefile per year
+
+    if export_mode == "wide":
+        createWideMap(curr_maps)
+    else:
+        # create county polygon layer
+        arcpy.management.MakeFeatureLayer(counties, "county_layer")
+
+        for curr_map in curr_maps:
+            try:
+                createMaps(curr_map)
+            except Exception as e:
+                print(f"An error occurred while creating {curr_map}: {e}")
\ No newline at end of file
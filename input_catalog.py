@@ -0,0 +1,160 @@
+# About
+#############################################################################################################
+
+# Persistent SQLite index of the prepared inputs (rasters and feature classes under data/prepared).
+# Stores CRS, extent, cell size, raster shape, feature count, schema and checksum of every dataset and only
+# re-describes a dataset when the size or mtime of one of its files changes, so run planning and validation can
+# read input metadata in milliseconds instead of calling arcpy.Describe/ListFields on every run.
+# The checksum reads every byte of the dataset, so it is only computed when a caller asks for it (checksum) and is
+# cleared again whenever the dataset is re-described.
+# arcpy is only imported when a dataset actually has to be (re)described.
+# SQLite connections can only be used by the thread that opened them, so every thread (pipeline stages run on a thread
+# pool with processes=False, wui_service answers each request on its own thread) gets its own connection.
+
+
+# Imports
+#############################################################################################################
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+from pipeline_dag import datasetStamp, hashDataset
+
+
+# Settings
+#############################################################################################################
+catalog_extensions = (".tif", ".tiff", ".img", ".shp")              # Dataset types picked up by scan()
+busy_timeout = 30                                                   # seconds a connection waits on another thread's write
+catalog_columns = ["path", "stamp", "data_type", "name", "wkid", "crs_wkt", "x_min", "y_min", "x_max", "y_max",
+                   "cell_size", "rows", "cols", "feature_count", "schema", "checksum", "refreshed_at"]
+
+
+# Describing datasets
+#############################################################################################################
+# Everything the pipeline needs to know about a dataset, from one arcpy.Describe call
+def describeDataset(path):
+    import arcpy
+
+    description = arcpy.Describe(path)
+    spatial_ref = description.spatialReference
+    extent = description.extent
+    record = {
+        "data_type": description.dataType,
+        "name": description.name,
+        "wkid": spatial_ref.factoryCode,
+        "crs_wkt": spatial_ref.exportToString(),
+        "x_min": extent.XMin, "y_min": extent.YMin, "x_max": extent.XMax, "y_max": extent.YMax,
+        "cell_size": None, "rows": None, "cols": None, "feature_count": None, "schema": [],
+    }
+    if description.dataType in ("RasterDataset", "RasterBand"):
+        record["cell_size"] = description.meanCellWidth
+        record["rows"] = description.height
+        record["cols"] = description.width
+    else:
+        record["feature_count"] = int(arcpy.management.GetCount(path)[0])
+        record["schema"] = [[field.name, field.type, field.length] for field in arcpy.ListFields(path)]
+    return record
+
+
+# Catalog
+#############################################################################################################
+class InputCatalog:
+    def __init__(self, db_path, describe=describeDataset):
+        self.db_path = db_path
+        self.describe = describe
+        folder = os.path.dirname(db_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self._local = threading.local()
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS datasets (path TEXT PRIMARY KEY, stamp TEXT, data_type TEXT, name TEXT, wkid INTEGER, crs_wkt TEXT, "
+            "x_min REAL, y_min REAL, x_max REAL, y_max REAL, cell_size REAL, rows INTEGER, cols INTEGER, feature_count INTEGER, "
+            "schema TEXT, checksum TEXT, refreshed_at TEXT)"
+        )
+        self.connection.commit()
+
+    # Connection of the calling thread, opened on first use
+    @property
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=busy_timeout)
+            self._local.connection = connection
+        return connection
+
+    def _row(self, path):
+        row = self.connection.execute(f"SELECT {', '.join(catalog_columns)} FROM datasets WHERE path = ?", (os.path.normpath(path),)).fetchone()
+        if row is None:
+            return None
+        record = dict(zip(catalog_columns, row))
+        record["stamp"] = json.loads(record["stamp"])
+        record["schema"] = json.loads(record["schema"])
+        return record
+
+    # Metadata of a dataset, described again only if its files changed since they were last cataloged
+    def lookup(self, path):
+        stamp = datasetStamp(path)
+        if not stamp:
+            raise FileNotFoundError(f"{path} does not exist.")
+        record = self._row(path)
+        if record is not None and record["stamp"] == stamp:
+            return record
+        return self.refresh(path, stamp)
+
+    # Stored metadata of a dataset without checking it against the files (None if it was never cataloged)
+    def cached(self, path):
+        return self._row(path)
+
+    def refresh(self, path, stamp=None):
+        stamp = datasetStamp(path) if stamp is None else stamp
+        record = self.describe(path)
+        record["path"] = os.path.normpath(path)
+        record["stamp"] = stamp
+        record["checksum"] = None                               # hashed on demand by checksum
+        record["refreshed_at"] = datetime.now().isoformat(timespec="seconds")
+        values = [json.dumps(record[c]) if c in ("stamp", "schema") else record[c] for c in catalog_columns]
+        self.connection.execute(f"INSERT OR REPLACE INTO datasets ({', '.join(catalog_columns)}) VALUES ({', '.join('?' * len(catalog_columns))})", values)
+        self.connection.commit()
+        print(f"\tCataloged {path}.")
+        return record
+
+    # Catalog every dataset under folder, returning the records
+    def scan(self, folder):
+        records = []
+        for root, dirs, files in os.walk(folder):
+            for filename in sorted(files):
+                if filename.lower().endswith(catalog_extensions):
+                    try:
+                        records.append(self.lookup(os.path.join(root, filename)))
+                    except Exception as e:
+                        print(f"\tFailed to catalog {os.path.join(root, filename)}: {e}")
+        return records
+
+    # Drop datasets that no longer exist on disk
+    def prune(self):
+        paths = [row[0] for row in self.connection.execute("SELECT path FROM datasets")]
+        missing = [path for path in paths if not datasetStamp(path)]
+        self.connection.executemany("DELETE FROM datasets WHERE path = ?", [(path,) for path in missing])
+        self.connection.commit()
+        return missing
+
+    def fieldNames(self, path):
+        return [field[0] for field in self.lookup(path)["schema"]]
+
+    # Content checksum of a dataset, hashed on first request after each change and stored with its metadata
+    def checksum(self, path):
+        record = self.lookup(path)
+        if record["checksum"] is None:
+            record["checksum"] = hashDataset(path)
+            self.connection.execute("UPDATE datasets SET checksum = ? WHERE path = ?", (record["checksum"], record["path"]))
+            self.connection.commit()
+        return record["checksum"]
+
+    # Close the calling thread's connection; connections of other threads close when their threads end
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
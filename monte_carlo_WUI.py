@@ -0,0 +1,280 @@
+# About
+#############################################################################################################
+
+# Monte Carlo uncertainty for the WUI maps.
+# Runs N realizations of the moving window pipeline with jittered address points and NLCD cells randomly
+# reclassified according to a misclassification model, and streams the results into per-cell WUI probabilities and
+# per-county area confidence intervals. Random draws are keyed on (seed, realization, cell or point), not on the order
+# they are taken in, so every tile window sees the same realization of the cells and points it shares with its
+# neighbours, and a tiled run reproduces an in-memory one.
+# runEnsembleTiled classifies the state tile by tile with the halo of preview_WUI.tileHalo (patches cut by a tile edge
+# are sized on the coarse pyramid level, as in tiled_WUI), so memory depends on the tile size and not on the state:
+# only the current tile's realizations and the per-tile probability blocks are held. runEnsemble keeps a whole study
+# area in memory and is meant for county-sized areas. Both process realizations in batches that share one FFT of the
+# disc kernel, with the batch capped so it stays within run_planner.memory_budget_gb.
+
+
+# Imports
+#############################################################################################################
+import os
+import csv
+
+import numpy as np
+
+import moving_window as mw
+import preview_WUI
+import raster_io
+import run_planner
+import tiled_WUI
+
+
+# Settings
+#############################################################################################################
+from wui_settings import address_points, nlcd_projected_clipped, space
+uncertainty_output = space + "\\analysis\\uncertainty\\"
+
+realizations = 200                                              # number of ensemble members
+batch_size = 8                                                  # realizations convolved together, at most
+bytes_per_member_cell = 64                                      # peak bytes per FFT cell for each realization in a batch
+point_sigma = 15.0                                              # m, standard deviation of address point location error per axis
+misclassification_rate = 0.15                                   # probability an NLCD cell is labeled with the wrong class (1 - overall accuracy)
+uint64_mask = 0xFFFFFFFFFFFFFFFF
+
+
+# Random draws
+#############################################################################################################
+# Uniform (0, 1) draw for every index, a splitmix64 hash of (seed, member, stream, index). Streams 0 and 1 jitter the
+# address points (by point number), stream 2 reclassifies NLCD cells (by row * cols + col of the full grid).
+def hashUniform(seed, member, stream, index):
+    key = (seed * 0x9E3779B97F4A7C15 + (member + 1) * 0xBF58476D1CE4E5B9 + (stream + 1) * 0x94D049BB133111EB) & uint64_mask
+    z = np.asarray(index, dtype=np.int64).astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15) + np.uint64(key)   # wraps modulo 2^64
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    z = z ^ (z >> np.uint64(31))
+    return ((z >> np.uint64(11)).astype(np.float64) + 0.5) / 2.0 ** 53
+
+
+# Address points moved by a normal error of sigma per axis (Box-Muller on the two point streams)
+def jitterPoints(x, y, point_index, seed, member, sigma):
+    distance = sigma * np.sqrt(-2 * np.log(hashUniform(seed, member, 0, point_index)))
+    angle = 2 * np.pi * hashUniform(seed, member, 1, point_index)
+    return x + distance * np.cos(angle), y + distance * np.sin(angle)
+
+
+# Global cell number of every cell of a window whose upper-left cell is (row, col) of grid
+def cellIndex(grid, row, col, shape):
+    return (row + np.arange(shape[0], dtype=np.int64))[:, None] * grid["cols"] + (col + np.arange(shape[1], dtype=np.int64))[None, :]
+
+
+# Perturbations
+#############################################################################################################
+# Confusion model {true class: (classes, probabilities)}: each cell keeps its class with 1 - rate and otherwise takes
+# another class in proportion to how common it is in the study area
+def defaultConfusion(nlcd, rate=misclassification_rate, nodata=0):
+    classes, counts = np.unique(nlcd[nlcd != nodata], return_counts=True)
+    return confusionFromCounts(classes, counts, rate)
+
+
+def confusionFromCounts(classes, counts, rate=misclassification_rate):
+    confusion = {}
+    for index, curr_class in enumerate(classes):
+        others = counts.astype(np.float64).copy()
+        others[index] = 0
+        probabilities = others / others.sum() * rate if others.sum() > 0 else others
+        probabilities[index] = 1 - probabilities.sum()
+        confusion[int(curr_class)] = (classes, probabilities)
+    return confusion
+
+
+# Classes and cell counts of an NLCD raster, read block by block
+def classCounts(curr_nlcd, grid, nodata=0):
+    counts = np.zeros(256, dtype=np.int64)
+    for row, col, nrows, ncols in raster_io.iterBlocks(grid["rows"], grid["cols"]):
+        counts += np.bincount(raster_io.readWindow(curr_nlcd, grid, row, col, nrows, ncols, nodata=nodata, dtype=np.uint8).ravel(), minlength=256)
+    counts[nodata] = 0
+    classes = np.flatnonzero(counts)
+    return classes, counts[classes]
+
+
+# NLCD with every cell reclassified by its uniform draw
+def perturbNLCD(nlcd, confusion, draws):
+    perturbed = nlcd.copy()
+    for curr_class, (classes, probabilities) in confusion.items():
+        cells = nlcd == curr_class
+        # index of the first cumulative probability above each draw picks the replacement class
+        picks = np.searchsorted(np.cumsum(probabilities), draws[cells], side="right")
+        perturbed[cells] = classes[np.minimum(picks, len(classes) - 1)]
+    return perturbed
+
+
+# Ensemble
+#############################################################################################################
+# Realizations per batch for windows of the given shape, within the memory budget
+def batchLimit(shape, radius, cell_size, batch=batch_size, budget_gb=run_planner.memory_budget_gb):
+    kernel = 2 * int(radius // cell_size) + 1
+    fft_cells = (shape[0] + kernel - 1) * (shape[1] + kernel - 1)
+    return max(1, min(batch, int(budget_gb * 1e9 // (bytes_per_member_cell * fft_cells))))
+
+
+# House counts on a window of grid; points jittered off the grid are dropped as they are without tiles, even where a
+# tile's halo reaches past the grid edge
+def windowHouses(x, y, grid, window):
+    inside = mw.pointsToCells(x, y, grid)[2]
+    return mw.houseCounts(x[inside], y[inside], window)
+
+
+# WUI classes of a batch of realizations of a window whose upper-left cell is (row, col) of grid, without its halo.
+# x, y and point_index are the address points near the window and their numbers in the full point set. Without a
+# coarse level the window is the whole study area and patches are sized as they are.
+def classifyMembers(nlcd, x, y, point_index, grid, row, col, halo, radius, members, confusion, sigma, seed, spectrum, valid_count,
+                    coarse_level=None, nodata=0):
+    cell_size = grid["cell_size"]
+    window = raster_io.windowGrid(grid, row, col, nlcd.shape[0], nlcd.shape[1])
+    cells = cellIndex(grid, row, col, nlcd.shape)
+    valid = mw.validMask(nlcd, nodata)
+    density_scale = 1000000 / (3.14 * float(radius) * float(radius))
+    perturbed = [perturbNLCD(nlcd, confusion, hashUniform(seed, member, 2, cells)) for member in members]
+    wildveg = np.stack([mw.wildlandBaseRaster(curr_nlcd) for curr_nlcd in perturbed])
+    houses = np.stack([windowHouses(*jitterPoints(x, y, point_index, seed, member, sigma), grid, window) for member in members])
+
+    # one forward and inverse FFT per batch for both neighborhood sums, sharing the kernel spectrum
+    sums = mw.discSumBatch(np.concatenate([houses, wildveg]), spectrum)
+    nbr_houses, nbr_cover = sums[:len(members)], sums[len(members):]
+    del houses, sums
+
+    inner = (slice(halo, nlcd.shape[0] - halo), slice(halo, nlcd.shape[1] - halo))
+    wui = np.zeros((len(members), nlcd.shape[0] - 2 * halo, nlcd.shape[1] - 2 * halo), dtype=np.uint8)
+    for index in range(len(members)):
+        buildable = mw.waterRaster(perturbed[index])
+        if coarse_level is None:
+            wildland_areas, wildveg_buffer = mw.findWildlandAreas(wildveg[index], cell_size)
+        else:
+            wildveg_buffer = preview_WUI.windowPatchBuffer(wildveg[index], cell_size, row, col, coarse_level)
+        dense = nbr_houses[index] * density_scale > mw.density_threshold
+        with np.errstate(invalid="ignore", divide="ignore"):
+            wildcover50 = np.where(valid_count > 0, nbr_cover[index] / np.maximum(valid_count, 1), 0) > mw.cover_threshold
+        wui[index] = mw.calcWUI(dense, buildable, wildcover50, wildveg_buffer, valid)[inner]
+    return wui
+
+
+# Run the ensemble on an in-memory study area and return per-cell class probabilities and the [realization, zone, class] area table
+def runEnsemble(nlcd, x, y, grid, radius, zones, count=realizations, batch=batch_size, sigma=point_sigma, confusion=None, seed=0, nodata=0):
+    cell_size = grid["cell_size"]
+    confusion = defaultConfusion(nlcd, nodata=nodata) if confusion is None else confusion
+    batch = batchLimit(nlcd.shape, radius, cell_size, batch)
+    spectrum = mw.discKernelSpectrum(nlcd.shape, radius, cell_size)
+    valid_count = mw.discSumBatch(mw.validMask(nlcd, nodata)[None], spectrum)[0]      # valid cells do not change between realizations
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    point_index = np.arange(len(x))
+    zone_count = int(zones.max()) + 1
+
+    intermix_count = np.zeros(nlcd.shape, dtype=np.uint16)
+    interface_count = np.zeros(nlcd.shape, dtype=np.uint16)
+    areas = np.zeros((count, zone_count, len(mw.wui_classes)))
+    for start in range(0, count, batch):
+        members = range(start, min(start + batch, count))
+        wui = classifyMembers(nlcd, x, y, point_index, grid, 0, 0, 0, radius, members, confusion, sigma, seed, spectrum, valid_count, nodata=nodata)
+        for index, member in enumerate(members):
+            intermix_count += wui[index] == 1
+            interface_count += wui[index] == 2
+            areas[member] = mw.tabulateArea(zones, wui[index], cell_size, zone_count)
+        print(f"Ensemble: {members[-1] + 1} of {count} realizations completed.")
+
+    probabilities = {
+        "intermix": intermix_count / count,
+        "interface": interface_count / count,
+        "wui": (intermix_count + interface_count) / count,
+    }
+    return probabilities, areas
+
+
+# Run the ensemble tile by tile over an NLCD raster, writing the per-cell class probabilities to out_prefix_p_{class}.tif,
+# and return the [realization, zone, class] area table. Zones are read from zone_raster, which must share the NLCD grid.
+def runEnsembleTiled(curr_nlcd, x, y, radius, zone_raster, out_prefix, count=realizations, batch=batch_size, sigma=point_sigma, confusion=None,
+                     seed=0, nodata=0, tile_size=None):
+    tile_size = tiled_WUI.tile_size if tile_size is None else tile_size
+    grid = raster_io.rasterGrid(curr_nlcd)
+    cell_size = grid["cell_size"]
+    halo = preview_WUI.tileHalo(radius, cell_size)
+    factor = preview_WUI.previewFactor(cell_size)
+    coarse_level = preview_WUI.buildPyramid(curr_nlcd, [factor])[factor]
+    confusion = confusionFromCounts(*classCounts(curr_nlcd, grid, nodata)) if confusion is None else confusion
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    margin = 6 * sigma                                          # points this far outside a window can not jitter into it
+
+    # every window has the same padded shape, so all tiles share one kernel spectrum
+    shape = (tile_size + 2 * halo, tile_size + 2 * halo)
+    spectrum = mw.discKernelSpectrum(shape, radius, cell_size)
+    batch = batchLimit(shape, radius, cell_size, batch)
+    areas = np.zeros((count, 1, len(mw.wui_classes)))
+    writers = {name: raster_io.BlockWriter(f"{out_prefix}_p_{name}.tif", grid, np.float32) for name in ("intermix", "interface", "wui")}
+    for row, col, nrows, ncols in raster_io.iterBlocks(grid["rows"], grid["cols"], tile_size):
+        nlcd = raster_io.readWindow(curr_nlcd, grid, row - halo, col - halo, shape[0], shape[1], nodata=nodata, dtype=np.uint8)
+        zones = raster_io.readWindow(zone_raster, grid, row, col, nrows, ncols, nodata=0, dtype=np.int64)
+        if zones.max() >= areas.shape[1]:
+            areas = np.pad(areas, ((0, 0), (0, int(zones.max()) + 1 - areas.shape[1]), (0, 0)))
+        window = raster_io.windowGrid(grid, row - halo, col - halo, shape[0], shape[1])
+        near = np.flatnonzero((x >= window["x_min"] - margin) & (x < window["x_min"] + shape[1] * cell_size + margin)
+                              & (y <= window["y_max"] + margin) & (y > window["y_max"] - shape[0] * cell_size - margin))
+        valid_count = mw.discSumBatch(mw.validMask(nlcd, nodata)[None], spectrum)[0]
+
+        intermix_count = np.zeros((nrows, ncols), dtype=np.uint16)
+        interface_count = np.zeros((nrows, ncols), dtype=np.uint16)
+        for start in range(0, count, batch):
+            members = range(start, min(start + batch, count))
+            wui = classifyMembers(nlcd, x[near], y[near], near, grid, row - halo, col - halo, halo, radius, members, confusion, sigma, seed,
+                                  spectrum, valid_count, coarse_level, nodata)[:, :nrows, :ncols]
+            for index, member in enumerate(members):
+                intermix_count += wui[index] == 1
+                interface_count += wui[index] == 2
+                areas[member, :, :] += mw.tabulateArea(zones, wui[index], cell_size, areas.shape[1])
+        writers["intermix"].write(row, col, (intermix_count / count).astype(np.float32))
+        writers["interface"].write(row, col, (interface_count / count).astype(np.float32))
+        writers["wui"].write(row, col, ((intermix_count + interface_count) / count).astype(np.float32))
+        print(f"Ensemble: tile at row {row}, col {col} completed.")
+    for writer in writers.values():
+        writer.close()
+    return areas
+
+
+# Mean and confidence interval of intermix and interface area per zone across realizations
+def countyIntervals(areas, confidence=0.95):
+    low, high = (1 - confidence) / 2 * 100, (1 + confidence) / 2 * 100
+    rows = []
+    for zone in range(1, areas.shape[1]):
+        for value, name in [(1, "intermix"), (2, "interface")]:
+            samples = areas[:, zone, value]
+            if not samples.any():
+                continue
+            rows.append({
+                "COUNTYNUMB": zone, "class": name, "mean_m2": float(samples.mean()), "std_m2": float(samples.std(ddof=1)) if len(samples) > 1 else 0.0,
+                "low_m2": float(np.percentile(samples, low)), "median_m2": float(np.median(samples)), "high_m2": float(np.percentile(samples, high)),
+            })
+    return rows
+
+
+def writeIntervals(rows, out_csv):
+    folder = os.path.dirname(out_csv)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(out_csv, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["COUNTYNUMB", "class", "mean_m2", "std_m2", "low_m2", "median_m2", "high_m2"])
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"County confidence intervals written to {out_csv}.")
+
+
+# Main
+#############################################################################################################
+if __name__ == "__main__":
+    import wui_transitions
+
+    map_name = "2020"
+    curr_buffer = 500
+
+    curr_nlcd = nlcd_projected_clipped + "nlcd_" + map_name + "_pc.tif"
+    x, y = raster_io.readPointCoordinates(address_points + map_name + "_address_points.shp")
+    zone_raster = wui_transitions.countyZoneRaster(curr_nlcd)
+
+    areas = runEnsembleTiled(curr_nlcd, x, y, curr_buffer, zone_raster, uncertainty_output + map_name)
+    writeIntervals(countyIntervals(areas), uncertainty_output + f"{map_name}_county_intervals.csv")
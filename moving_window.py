@@ -0,0 +1,264 @@
+# About
+#############################################################################################################
+
+# NumPy/SciPy implementation of the moving window WUI method (Bar-Massada, et. al.) used in generate_WUI_maps.py.
+# Each function mirrors one arcpy stage of the pipeline but works on in-memory arrays, so the pipeline can be run,
+# benchmarked and experimented with without an ArcGIS license.
+# Grids are described by a dict with the upper-left corner, cell size and shape (see makeGrid).
+# NLCD cells equal to nodata (0 by default) are treated like the NoData cells outside the clipped study area.
+
+
+# Imports
+#############################################################################################################
+import numpy as np
+import scipy.fft
+from scipy import ndimage
+from scipy.signal import oaconvolve
+
+
+# Settings
+#############################################################################################################
+water_classes = [11]                                        # NLCD open water, houses can never be built here
+wildland_classes = [41, 42, 43, 52, 71, 90, 95]             # NLCD forest, shrub, grassland and wetland classes that can carry fire
+density_threshold = 6.17                                    # Houses per km^2 for a neighborhood to count as WUI
+cover_threshold = 0.5                                       # Share of wildland vegetation in the neighborhood for intermix WUI
+small_patch_area = 5000                                     # m^2, wildland patches larger than this are kept in wildlandAreas
+large_patch_area = 25000000                                 # m^2, wildland patches larger than this are buffered for interface WUI
+patch_buffer_distance = 2400                                # m, distance from large wildland patches that counts as interface WUI
+wui_classes = {0: "non-WUI", 1: "intermix", 2: "interface"}
+disc_sum_method = "fft"                                     # default discSum algorithm, see discSum
+
+
+# Grid utilities
+#############################################################################################################
+def makeGrid(x_min, y_max, cell_size, rows, cols):
+    return {"x_min": float(x_min), "y_max": float(y_max), "cell_size": float(cell_size), "rows": int(rows), "cols": int(cols)}
+
+
+# Row/column of the cell containing each point, with a mask of the points that fall inside the grid
+def pointsToCells(x, y, grid):
+    cols = np.floor((np.asarray(x, dtype=np.float64) - grid["x_min"]) / grid["cell_size"]).astype(np.int64)
+    rows = np.floor((grid["y_max"] - np.asarray(y, dtype=np.float64)) / grid["cell_size"]).astype(np.int64)
+    inside = (rows >= 0) & (rows < grid["rows"]) & (cols >= 0) & (cols < grid["cols"])
+    return rows, cols, inside
+
+
+# Cells whose centers fall within radius map units of the center cell, like NbrCircle(radius, "MAP")
+def discKernel(radius, cell_size):
+    half = int(radius // cell_size)
+    offsets = np.arange(-half, half + 1) * cell_size
+    return (offsets[:, None] ** 2 + offsets[None, :] ** 2 <= radius ** 2).astype(np.float32)
+
+
+# Focal SUM over a circular neighborhood; cells outside the array contribute nothing, like FocalStatistics with NoData edges.
+# method is "fft" (overlap-add FFT convolution), "rows" (row prefix sums) or "direct" (spatial convolution), see run_planner.py
+def discSum(array, radius, cell_size, method=None):
+    method = disc_sum_method if method is None else method
+    if method == "rows":
+        return discSumRows(array, radius, cell_size)
+    kernel = discKernel(radius, cell_size)
+    if method == "direct":
+        summed = ndimage.correlate(array.astype(np.float32), kernel, mode="constant", cval=0)
+    elif method == "fft":
+        summed = oaconvolve(array.astype(np.float32), kernel, mode="same")
+    else:
+        raise ValueError(f"Unknown disc sum method {method}.")
+    return np.rint(summed).astype(np.int32)
+
+
+# Disc sum from prefix sums along each row: every row of the disc is one run of cells, so a cell costs one subtraction
+# per disc row (2 * radius / cell_size + 1) however wide the disc is
+def discSumRows(array, radius, cell_size):
+    half = int(radius // cell_size)
+    offsets = np.arange(-half, half + 1) * cell_size
+    widths = np.floor(np.sqrt(np.maximum(radius ** 2 - offsets ** 2, 0)) / cell_size + 1e-9).astype(np.int64)
+    rows, cols = array.shape
+    values = np.rint(array).astype(np.int64) if np.issubdtype(np.asarray(array).dtype, np.floating) else array.astype(np.int64)
+    prefix = np.zeros((rows + 2 * half, cols + 2 * half + 1), dtype=np.int64)
+    np.cumsum(values, axis=1, out=prefix[half:half + rows, half + 1:half + 1 + cols])
+    prefix[half:half + rows, half + 1 + cols:] = prefix[half:half + rows, half + cols:half + cols + 1]
+    summed = np.zeros((rows, cols), dtype=np.int64)
+    for index, width in enumerate(widths):
+        band = prefix[index:index + rows]
+        summed += band[:, half + width + 1:half + width + 1 + cols] - band[:, half - width:half - width + cols]
+    return summed.astype(np.int32)
+
+
+# FFT of the disc kernel padded for arrays of the given shape, so a batch of rasters (or many realizations) can share one kernel
+def discKernelSpectrum(shape, radius, cell_size):
+    kernel = discKernel(radius, cell_size)
+    fft_shape = [scipy.fft.next_fast_len(n + k - 1, real=True) for n, k in zip(shape, kernel.shape)]
+    return {"spectrum": scipy.fft.rfft2(kernel, fft_shape), "kernel_shape": kernel.shape, "fft_shape": fft_shape, "shape": tuple(shape)}
+
+
+# discSum of every raster in a (batch, rows, cols) stack with a precomputed kernel spectrum
+def discSumBatch(stack, spectrum, workers=-1):
+    fft_shape = spectrum["fft_shape"]
+    transformed = scipy.fft.rfft2(np.asarray(stack, dtype=np.float32), fft_shape, axes=(-2, -1), workers=workers)
+    summed = scipy.fft.irfft2(transformed * spectrum["spectrum"], fft_shape, axes=(-2, -1), workers=workers)
+    r0, c0 = spectrum["kernel_shape"][0] // 2, spectrum["kernel_shape"][1] // 2
+    rows, cols = spectrum["shape"]
+    return np.rint(summed[..., r0:r0 + rows, c0:c0 + cols]).astype(np.int32)
+
+
+# Data preparation functions
+#############################################################################################################
+def validMask(nlcd, nodata=0):
+    return nlcd != nodata
+
+
+# WUI generation functions
+#############################################################################################################
+# 0 for water, 1 for areas where houses can be built
+def waterRaster(nlcd):
+    return (~np.isin(nlcd, water_classes)).astype(np.uint8)
+
+
+def wildlandBaseRaster(nlcd, classes=None):
+    return np.isin(nlcd, wildland_classes if classes is None else classes).astype(np.uint8)
+
+
+# Label 4-connected wildland patches (the polygons RasterToPolygon would build) and return labels with each patch's area in m^2
+def labelWildlandPatches(wildveg, cell_size):
+    labels, count = ndimage.label(wildveg == 1)
+    areas = np.bincount(labels.ravel(), minlength=count + 1).astype(np.float64) * cell_size * cell_size
+    areas[0] = 0
+    return labels, areas
+
+
+# Distance in map units from every cell center to the nearest large patch, measured to the patch edge rather than its cell centers
+def distanceToLargePatches(labels, areas, cell_size, min_area=large_patch_area):
+    large = (areas > min_area)[labels]
+    if not large.any():
+        return np.full(labels.shape, np.inf)
+    return np.maximum(ndimage.distance_transform_edt(~large) * cell_size - cell_size / 2, 0)
+
+
+# Returns the wildlandAreas raster (patches over small_patch_area) and the wildveg_buffer raster (within patch_buffer_distance of large patches)
+def findWildlandAreas(wildveg, cell_size, min_area=small_patch_area, large_area=large_patch_area, buffer_distance=patch_buffer_distance):
+    labels, areas = labelWildlandPatches(wildveg, cell_size)
+    wildland_areas = (areas > min_area)[labels].astype(np.uint8)
+    wildveg_buffer = (distanceToLargePatches(labels, areas, cell_size, large_area) <= buffer_distance).astype(np.uint8)
+    return wildland_areas, wildveg_buffer
+
+
+# Number of houses in every cell
+def houseCounts(x, y, grid):
+    rows, cols, inside = pointsToCells(x, y, grid)
+    houses = np.bincount(rows[inside] * grid["cols"] + cols[inside], minlength=grid["rows"] * grid["cols"])
+    return houses.reshape(grid["rows"], grid["cols"])
+
+
+# Number of houses within radius of every cell, like PointStatistics(..., NbrCircle(radius, "MAP"), "SUM")
+def makeNeighborhoods(x, y, grid, radius):
+    return discSum(houseCounts(x, y, grid), radius, grid["cell_size"])
+
+
+def neighborhoodDensity(nbr_houses, radius, threshold=density_threshold):
+    return (nbr_houses / (3.14 * float(radius) * float(radius)) * 1000000) > threshold
+
+
+# Share of valid cells within radius that are wildland vegetation
+def wildlandCoverFraction(wildveg, valid, radius, cell_size, method=None):
+    cover = discSum(wildveg, radius, cell_size, method)
+    total = discSum(valid, radius, cell_size, method)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(total > 0, cover / np.maximum(total, 1), 0.0)
+
+
+def calcWildlandCover(wildveg, valid, radius, cell_size, threshold=cover_threshold, method=None):
+    return wildlandCoverFraction(wildveg, valid, radius, cell_size, method) > threshold
+
+
+# 1 for intermix, 2 for interface, 0 otherwise
+def calcWUI(dense, buildable, wildcover50, wildveg_buffer, valid=None):
+    den_no_water = dense & (buildable == 1)
+    if valid is not None:
+        den_no_water &= valid
+    intermix = den_no_water & wildcover50
+    interface = den_no_water & (wildveg_buffer == 1)
+    return np.where(intermix, 1, np.where(interface, 2, 0)).astype(np.uint8)
+
+
+# Raster side of RasterToPolygon: 4-connected regions of each WUI class with their cell counts and bounding boxes,
+# and with outlines=True the rings of each region's outline (see outlineRings)
+def polygonizeWUI(wui, outlines=False):
+    regions = []
+    for value in [1, 2]:
+        labels, count = ndimage.label(wui == value)
+        if count == 0:
+            continue
+        cells = np.bincount(labels.ravel(), minlength=count + 1)[1:]
+        for index, box in enumerate(ndimage.find_objects(labels)):
+            region = {"value": value, "cells": int(cells[index]), "rows": (box[0].start, box[0].stop), "cols": (box[1].start, box[1].stop)}
+            if outlines:
+                region["rings"] = [ring + (box[0].start, box[1].start) for ring in outlineRings(labels[box] == index + 1)]
+            regions.append(region)
+    return regions
+
+
+# Outline of a mask as closed rings of (row, col) cell corners, traced along the cell edges with the mask on the left:
+# the outer ring runs counterclockwise and holes clockwise in map coordinates (x right, y up), as GeoJSON expects, and
+# only corners where the outline turns are kept. Where cells touch only at a corner the outline turns left around each
+# of them, so the rings keep the 4-connectivity of ndimage.label. Outer rings come first.
+def outlineRings(mask):
+    padded = np.pad(np.asarray(mask, dtype=bool), 1)
+    inside = padded[1:-1, 1:-1]
+    # (neighbour offset, start corner, end corner, direction) of each cell side; directions 0 east, 1 north, 2 west, 3 south
+    sides = [((1, 0), (1, 0), (1, 1), 0), ((0, 1), (1, 1), (0, 1), 1), ((-1, 0), (0, 1), (0, 0), 2), ((0, -1), (0, 0), (1, 0), 3)]
+    parts = []
+    for (dr, dc), start, end, direction in sides:
+        rows, cols = np.nonzero(inside & ~padded[1 + dr:padded.shape[0] - 1 + dr, 1 + dc:padded.shape[1] - 1 + dc])
+        parts.append((rows + start[0], cols + start[1], rows + end[0], cols + end[1], np.full(len(rows), direction)))
+    r0, c0, r1, c1, direction = (np.concatenate(values) for values in zip(*parts))
+    if len(r0) == 0:
+        return []
+
+    # the next edge starts where an edge ends; a corner shared by two diagonal cells has two, take the left turn
+    width = padded.shape[1]
+    order = np.argsort(r0 * width + c0, kind="stable")
+    starts = (r0 * width + c0)[order]
+    first = np.searchsorted(starts, r1 * width + c1)
+    second = order[np.minimum(first + 1, len(order) - 1)]
+    pinched = (first + 1 < len(order)) & (starts[np.minimum(first + 1, len(order) - 1)] == r1 * width + c1)
+    successor = np.where(pinched & (direction[second] == (direction + 1) % 4), second, order[first]).tolist()
+
+    rings = []
+    visited = bytearray(len(successor))
+    for edge in range(len(successor)):
+        ring = []
+        while not visited[edge]:
+            visited[edge] = 1
+            ring.append(edge)
+            edge = successor[edge]
+        if ring:
+            ring = np.array(ring)
+            corners = ring[direction[ring] != direction[np.roll(ring, 1)]]
+            rings.append(np.column_stack([r0[corners], c0[corners]]))
+    # shoelace area with x = col and y = -row: positive for outer rings
+    signed = [float(np.sum(ring[:, 1] * -np.roll(ring[:, 0], -1) - np.roll(ring[:, 1], -1) * -ring[:, 0])) for ring in rings]
+    return [ring for area, ring in sorted(zip(signed, rings), key=lambda item: -item[0])]
+
+
+# Area in m^2 of each WUI class per zone, like TabulateArea with VALUE_0, VALUE_1 and VALUE_2 columns
+def tabulateArea(zones, wui, cell_size, zone_count=None, class_count=3):
+    zone_count = int(zones.max()) + 1 if zone_count is None else zone_count
+    counts = np.bincount(zones.ravel().astype(np.int64) * class_count + wui.ravel(), minlength=zone_count * class_count)
+    return counts.reshape(zone_count, class_count) * cell_size * cell_size
+
+
+# Run every stage on in-memory inputs and return the intermediate and final arrays
+def runPipeline(nlcd, x, y, grid, radius, nodata=0):
+    cell_size = grid["cell_size"]
+    valid = validMask(nlcd, nodata)
+    buildable = waterRaster(nlcd)
+    wildveg = wildlandBaseRaster(nlcd)
+    wildland_areas, wildveg_buffer = findWildlandAreas(wildveg, cell_size)
+    nbr_houses = makeNeighborhoods(x, y, grid, radius)
+    dense = neighborhoodDensity(nbr_houses, radius)
+    wildcover50 = calcWildlandCover(wildveg, valid, radius, cell_size)
+    wui = calcWUI(dense, buildable, wildcover50, wildveg_buffer, valid)
+    return {
+        "valid": valid, "buildable": buildable, "wildveg": wildveg, "wildland_areas": wildland_areas,
+        "wildveg_buffer": wildveg_buffer, "nbr_houses": nbr_houses, "dense": dense, "wildcover50": wildcover50, "wui": wui
+    }
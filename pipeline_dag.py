@@ -0,0 +1,242 @@
+# About
+#############################################################################################################
+
+# Make-style dependency graph runner for the WUI pipeline.
+# Every stage declares the datasets it reads and writes. A stage is skipped when its outputs exist and either its
+# inputs are unchanged since it last completed (same size/mtime, or with use_checksums=True the same content checksum),
+# or, with no record of a previous run, its outputs are newer than its inputs. Checksums hash every byte of every input
+# after each stage, which for statewide rasters can cost more than the stage, so they are only computed on request.
+# Completed stages are recorded in a JSON state file after each success, so rerunning a failed pipeline resumes from
+# the first stage that did not finish.
+# Stages whose dependencies are done run concurrently, so independent branches (water, wildland, centroids) overlap.
+
+
+# Imports
+#############################################################################################################
+import os
+import glob
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from stage_trace import StageTrace
+
+
+# Dataset fingerprints
+#############################################################################################################
+# List every file that makes up a dataset (shapefiles and rasters come with sidecar files, grids are folders)
+def datasetFiles(path):
+    if os.path.isdir(path):
+        return sorted(os.path.join(root, f) for root, dirs, files in os.walk(path) for f in files)
+    stem, ext = os.path.splitext(path)
+    if ext.lower() == ".shp":
+        return sorted(f for f in glob.glob(glob.escape(stem) + ".*") if not f.lower().endswith(".lock"))
+    return [path] if os.path.exists(path) else []
+
+
+def datasetExists(path):
+    return os.path.exists(path)
+
+
+# Size and modification time of every file in a dataset, cheap enough to check before every stage
+def datasetStamp(path):
+    return [[os.path.basename(f), os.path.getsize(f), os.path.getmtime(f)] for f in datasetFiles(path)]
+
+
+def datasetMTime(path):
+    return max((os.path.getmtime(f) for f in datasetFiles(path)), default=0)
+
+
+def hashDataset(path):
+    digest = hashlib.sha256()
+    for curr_file in datasetFiles(path):
+        digest.update(os.path.basename(curr_file).lower().encode())
+        with open(curr_file, "rb") as f:
+            for chunk in iter(lambda: f.read(8 * 1024 * 1024), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+_checksum_cache = {}
+_checksum_lock = threading.Lock()
+
+
+# Content checksum of a dataset, only recomputed when its stamp changes
+def datasetChecksum(path):
+    stamp = datasetStamp(path)
+    with _checksum_lock:
+        cached = _checksum_cache.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    checksum = hashDataset(path)
+    with _checksum_lock:
+        _checksum_cache[path] = (stamp, checksum)
+    return checksum
+
+
+# Stages
+#############################################################################################################
+# One unit of work: function(*args) reads the inputs and writes the outputs.
+# Stages that modify an input in place list it as an output too; stages that depend on such a stage see it as its producer.
+class Stage:
+    def __init__(self, name, function, args=(), inputs=(), outputs=(), radius=None):
+        self.name = name
+        self.function = function
+        self.args = tuple(args)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.radius = radius
+
+    # Identifies what the stage computes apart from its input files, so changing e.g. the buffer distance reruns it
+    def key(self):
+        return self.function.__name__ + repr([arg for arg in self.args if not isinstance(arg, str) or arg not in self.inputs + self.outputs])
+
+
+# Failure of a stage traced in a worker process, carrying its failed record (status, wall time and error) to the parent
+class StageFailed(Exception):
+    def __init__(self, record):
+        super().__init__(record)
+        self.record = record
+
+    def __str__(self):
+        return self.record["error"]
+
+
+# Runs a stage in a worker process, tracing it there so CPU time and peak RSS belong to the process that did the work.
+# The record is returned, or raised in a StageFailed, and written to the CSV by the parent, never by several processes
+# at once.
+def runTracedStage(function, args, name, year, radius, profile_dir):
+    trace = StageTrace(None, profile_dir)
+    try:
+        with trace.stage(name, year, radius):
+            function(*args)
+    except Exception:
+        raise StageFailed(trace.records[-1])
+    return trace.records[-1]
+
+
+# Runner
+#############################################################################################################
+class PipelineRunner:
+    def __init__(self, state_file, year, workers=3, processes=False, trace=None, use_checksums=False):
+        self.state_file = state_file
+        self.year = year
+        self.workers = workers
+        self.processes = processes
+        self.trace = trace
+        self.use_checksums = use_checksums
+        self.state = {}
+        self._state_lock = threading.Lock()
+        if os.path.exists(state_file):
+            with open(state_file) as f:
+                self.state = json.load(f)
+
+    def _saveState(self):
+        folder = os.path.dirname(self.state_file)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        temp_file = self.state_file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(temp_file, self.state_file)
+
+    def _inputRecord(self, path):
+        record = {"stamp": datasetStamp(path)}
+        if self.use_checksums:
+            record["checksum"] = datasetChecksum(path)
+        return record
+
+    # Decide whether a stage's outputs can be reused
+    def isUpToDate(self, stage):
+        if not stage.outputs or not all(datasetExists(path) for path in stage.outputs):
+            return False
+        previous = self.state.get(stage.name)
+        if previous is not None:
+            if previous["key"] != stage.key() or sorted(previous["inputs"]) != sorted(stage.inputs):
+                return False
+            for path in stage.inputs:
+                recorded = previous["inputs"][path]
+                if datasetStamp(path) == recorded["stamp"]:
+                    continue
+                if not self.use_checksums or "checksum" not in recorded or datasetChecksum(path) != recorded["checksum"]:
+                    return False
+            return True
+        # no record of this stage: plain make rule, outputs newer than every input
+        in_place = [path for path in stage.outputs if path in stage.inputs]
+        if in_place:
+            return False
+        newest_input = max((datasetMTime(path) for path in stage.inputs), default=0)
+        return min(datasetMTime(path) for path in stage.outputs) >= newest_input
+
+    def _markComplete(self, stage):
+        record = {"key": stage.key(), "inputs": {path: self._inputRecord(path) for path in stage.inputs}}
+        with self._state_lock:
+            self.state[stage.name] = record
+            self._saveState()
+
+    def _dependencies(self, stages):
+        producers = {}
+        for stage in stages:
+            for path in stage.outputs:
+                if path in producers:
+                    raise ValueError(f"{path} is written by both {producers[path].name} and {stage.name}.")
+                producers[path] = stage
+        return {stage.name: {producers[path].name for path in stage.inputs if path in producers and producers[path] is not stage} for stage in stages}
+
+    def _execute(self, executor, stage):
+        if self.processes:
+            profile_dir = self.trace.profile_dir if self.trace else None
+            return executor.submit(runTracedStage, stage.function, stage.args, stage.name, self.year, stage.radius, profile_dir)
+
+        def run():
+            if self.trace is None:
+                return stage.function(*stage.args)
+            with self.trace.stage(stage.name, self.year, stage.radius):
+                stage.function(*stage.args)
+        return executor.submit(run)
+
+    # Run the stages in dependency order; raises the first stage failure after letting already running stages finish
+    def run(self, stages):
+        dependencies = self._dependencies(stages)
+        by_name = {stage.name: stage for stage in stages}
+        done, running, failures = set(), {}, []
+        pool = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+        with pool(max_workers=self.workers) as executor:
+            while True:
+                scheduling = not failures
+                while scheduling:
+                    scheduling = False
+                    for stage in stages:
+                        if stage.name in done or stage.name in running.values() or not dependencies[stage.name] <= done:
+                            continue
+                        if self.isUpToDate(stage):
+                            print(f"{self.year}: {stage.name} is up to date, skipping.")
+                            done.add(stage.name)
+                            scheduling = True
+                            continue
+                        running[self._execute(executor, stage)] = stage.name
+                if not running:
+                    break
+                finished, pending = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        record = future.result()
+                        if self.processes and self.trace is not None:
+                            self.trace.add(record)
+                        self._markComplete(by_name[name])
+                        done.add(name)
+                    except StageFailed as e:
+                        if self.trace is not None:
+                            self.trace.add(e.record)
+                        failures.append((name, e))
+                    except Exception as e:
+                        failures.append((name, e))
+
+        if failures:
+            name, error = failures[0]
+            raise RuntimeError(f"{self.year}: stage {name} failed: {error}") from error
+        skipped = [stage.name for stage in stages if stage.name not in done]
+        if skipped:
+            raise RuntimeError(f"{self.year}: stages {skipped} could not run, check the stage inputs and outputs for cycles.")
@@ -0,0 +1,334 @@
+# About
+#############################################################################################################
+
+# Columnar cache of address points (or footprint centroids), so runs stop reparsing shapefiles.
+# ingest converts a shapefile, CSV or GeoJSON into a folder of .npy columns: x and y in projected meters (float64) and any
+# requested attributes. CSV and GeoJSON are parsed in chunks of chunk_points features, so the text is never held in
+# memory; lon/lat inputs (and shapefiles whose .prj is geographic) are projected to EPSG:6514 with projections.py.
+# The cache records the CRS of its coordinates: the .prj WKT of a projected shapefile (with its factory code when it
+# is one of projections.crs_definitions), else target_wkid. Projected CSV columns are taken to be in target_wkid. Points are sorted along a Morton (Z-order)
+# curve and cut into blocks of block_points with a bounding box each, so PointCache.within reads only the blocks that
+# touch a window, through memory maps, instead of scanning every point. A cache is stale, and rebuilt by cachedPoints,
+# once the files of its source change.
+
+
+# Imports
+#############################################################################################################
+import os
+import csv
+import json
+import time
+import itertools
+
+import numpy as np
+
+import projections
+import shapefile_reader
+from pipeline_dag import datasetStamp
+
+
+# Settings
+#############################################################################################################
+from wui_settings import address_points, prepared
+point_cache_dir = prepared + "point_cache\\"
+
+chunk_points = 500000                                           # features parsed per chunk from CSV and GeoJSON
+block_points = 4096                                             # points per indexed block
+target_wkid = 6514                                              # lon/lat inputs are projected to this CRS
+coordinate_fields = [("x", "y"), ("point_x", "point_y"), ("easting", "northing"), ("lon", "lat"), ("longitude", "latitude"), ("long", "lat")]
+geographic_fields = {"lon", "long", "longitude"}
+
+
+# Readers
+#############################################################################################################
+# Coordinates of a CSV column; blank values become NaN so ingest drops their rows
+def parseCoordinates(values):
+    values = np.char.strip(np.array(values, dtype=str))
+    return np.where(values == "", "nan", values).astype(np.float64)
+
+
+# Chunks of (x, y, {field: values}) from a CSV; coordinates come from the first known pair of column names
+def csvChunks(path, fields=(), x_field=None, y_field=None):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        lower = [name.lower() for name in header]
+        if x_field is None:
+            x_field, y_field = next(((x, y) for x, y in coordinate_fields if x in lower and y in lower), (None, None))
+            if x_field is None:
+                raise ValueError(f"{path} has none of the coordinate columns {coordinate_fields}.")
+        x_index, y_index = lower.index(x_field.lower()), lower.index(y_field.lower())
+        field_index = [header.index(name) for name in fields]
+        geographic = x_field.lower() in geographic_fields
+        while True:
+            rows = list(itertools.islice(reader, chunk_points))
+            if not rows:
+                return
+            x = parseCoordinates([row[x_index] for row in rows])
+            y = parseCoordinates([row[y_index] for row in rows])
+            attributes = {name: np.array([row[index] for row in rows]) for name, index in zip(fields, field_index)}
+            yield (*projections.forward(x, y, target_wkid), attributes) if geographic else (x, y, attributes)
+
+
+# Features of a GeoJSON FeatureCollection one at a time, decoding the file in pieces
+def geojsonFeatures(path, read_size=1 << 22):
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as f:
+        text = f.read(read_size)
+        start = text.find('"features"')
+        while start < 0:
+            more = f.read(read_size)
+            if not more:
+                return
+            text = text[-16:] + more
+            start = text.find('"features"')
+        position = text.index("[", start) + 1
+        while True:
+            # skip separators, then decode the next whole feature, reading more text when it is cut off
+            while True:
+                while position < len(text) and text[position] in " \t\r\n,":
+                    position += 1
+                if position < len(text):
+                    break
+                more = f.read(read_size)
+                if not more:
+                    return
+                text, position = more, 0
+            if text[position] == "]":
+                return
+            while True:
+                try:
+                    feature, end = decoder.raw_decode(text, position)
+                    break
+                except json.JSONDecodeError:
+                    more = f.read(read_size)
+                    if not more:
+                        raise
+                    text, position = text[position:] + more, 0
+            yield feature
+            position = end
+
+
+# Point of a GeoJSON geometry: the point itself or the area-weighted centroid of a (multi)polygon
+def geometryPoint(geometry):
+    if geometry is None:
+        return None
+    kind, coordinates = geometry["type"], geometry["coordinates"]
+    if kind == "Point":
+        return coordinates[0], coordinates[1]
+    if kind == "MultiPoint":
+        return coordinates[0][0], coordinates[0][1]
+    rings = [ring for polygon in (coordinates if kind == "MultiPolygon" else [coordinates]) for ring in polygon]
+    area = cx = cy = 0.0
+    x0, y0 = rings[0][0][0], rings[0][0][1]
+    for ring in rings:
+        ring = np.asarray(ring, dtype=np.float64)[:, :2] - (x0, y0)
+        cross = ring[:-1, 0] * ring[1:, 1] - ring[1:, 0] * ring[:-1, 1]
+        # holes are wound opposite to their polygon in GeoJSON, so their areas subtract
+        area += cross.sum()
+        cx += ((ring[:-1, 0] + ring[1:, 0]) * cross).sum()
+        cy += ((ring[:-1, 1] + ring[1:, 1]) * cross).sum()
+    if area == 0:
+        return x0, y0
+    return cx / (3 * area) + x0, cy / (3 * area) + y0
+
+
+# Chunks of (x, y, {field: values}) from a GeoJSON (lon/lat as RFC 7946 requires); features without geometry are dropped
+def geojsonChunks(path, fields=()):
+    x, y, attributes = [], [], {name: [] for name in fields}
+    for feature in geojsonFeatures(path):
+        point = geometryPoint(feature.get("geometry"))
+        if point is None:
+            continue
+        x.append(point[0])
+        y.append(point[1])
+        properties = feature.get("properties") or {}
+        for name in fields:
+            attributes[name].append("" if properties.get(name) is None else str(properties[name]))
+        if len(x) == chunk_points:
+            yield (*projections.forward(x, y, target_wkid), {name: np.array(values) for name, values in attributes.items()})
+            x, y, attributes = [], [], {name: [] for name in fields}
+    if x:
+        yield (*projections.forward(x, y, target_wkid), {name: np.array(values) for name, values in attributes.items()})
+
+
+# WKT of a shapefile's .prj, None without one
+def shapefileWKT(path):
+    prj = os.path.splitext(path)[0] + ".prj"
+    if not os.path.exists(prj):
+        return None
+    with open(prj) as f:
+        return f.read().strip()
+
+
+# The shapefile as one chunk: shapefile_reader already memory-maps it (footprints become centroids). Attributes are
+# taken at the records the points came from, since null shapes are dropped; geographic coordinates are projected.
+def shapefileChunks(path, fields=()):
+    x, y, records = shapefile_reader.readPointCoordinates(path, records=True)
+    columns = {name: values[records] for name, values in shapefile_reader.readDBF(path, list(fields), deleted=True).items()} if fields else {}
+    wkt = shapefileWKT(path)
+    if wkt is not None and wkt.upper().startswith("GEOGCS"):
+        x, y = projections.forward(x, y, target_wkid)
+    yield x, y, columns
+
+
+# CRS of the cached coordinates of a source as {"wkid": ..., "crs_wkt": ...} (see projections.crsDefinition)
+def sourceCRS(path):
+    wkt = shapefileWKT(path) if os.path.splitext(path)[1].lower() == ".shp" else None
+    if wkt is None or wkt.upper().startswith("GEOGCS"):
+        return {"wkid": target_wkid, "crs_wkt": None}
+    try:
+        wkid = projections.definitionCode(projections.crsFromWKT(wkt))
+    except (ValueError, KeyError):
+        wkid = None                                             # a projection projections.py does not implement
+    return {"wkid": wkid, "crs_wkt": wkt}
+
+
+def readChunks(path, fields=()):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".shp":
+        return shapefileChunks(path, fields)
+    if extension in (".csv", ".txt"):
+        return csvChunks(path, fields)
+    if extension in (".geojson", ".json"):
+        return geojsonChunks(path, fields)
+    raise ValueError(f"{path} is not a shapefile, CSV or GeoJSON.")
+
+
+# Ingest
+#############################################################################################################
+# Interleave the bits of two arrays of 32-bit cell indices into 64-bit Morton keys
+def mortonKeys(col, row):
+    def spread(v):
+        v = v.astype(np.uint64) & np.uint64(0xFFFFFFFF)
+        for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F), (2, 0x3333333333333333), (1, 0x5555555555555555)):
+            v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+        return v
+    return spread(col) | (spread(row) << np.uint64(1))
+
+
+# Numeric columns as float64 when every value parses (blank is NaN), the rest as strings
+def attributeColumn(values):
+    if values.dtype.kind in "fiu":
+        return values.astype(np.float64)
+    try:
+        return np.where(values == "", "nan", values).astype(np.float64)
+    except ValueError:
+        return values.astype(str)
+
+
+def cacheFolder(path):
+    return point_cache_dir + os.path.splitext(os.path.basename(path))[0] + "\\"
+
+
+def ingest(path, fields=(), out_dir=None):
+    start = time.perf_counter()
+    out_dir = cacheFolder(path) if out_dir is None else out_dir
+    stamp = datasetStamp(path)
+    chunks = list(readChunks(path, fields))
+    x = np.concatenate([chunk[0] for chunk in chunks]) if chunks else np.zeros(0)
+    y = np.concatenate([chunk[1] for chunk in chunks]) if chunks else np.zeros(0)
+    attributes = {name: attributeColumn(np.concatenate([chunk[2][name] for chunk in chunks])) for name in fields} if chunks else {}
+    del chunks
+    keep = np.isfinite(x) & np.isfinite(y)
+    x, y = x[keep], y[keep]
+
+    # Morton order on a 1m lattice over the points' extent
+    if len(x):
+        order = np.argsort(mortonKeys(np.floor(x - x.min()).astype(np.int64), np.floor(y - y.min()).astype(np.int64)), kind="stable")
+    else:
+        order = np.zeros(0, dtype=np.int64)
+    x, y = x[order], y[order]
+    starts = np.arange(0, len(x), block_points)
+    if len(x):
+        blocks = np.column_stack([np.minimum.reduceat(x, starts), np.minimum.reduceat(y, starts), np.maximum.reduceat(x, starts), np.maximum.reduceat(y, starts)])
+    else:
+        blocks = np.zeros((0, 4))
+
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    np.save(os.path.join(out_dir, "x.npy"), x)
+    np.save(os.path.join(out_dir, "y.npy"), y)
+    np.save(os.path.join(out_dir, "blocks.npy"), blocks)
+    for name, values in attributes.items():
+        np.save(os.path.join(out_dir, f"attr_{name}.npy"), values[keep][order])
+    meta = dict({"source": os.path.normpath(path), "stamp": stamp, "count": int(len(x)), "block_points": block_points, "fields": list(fields)}, **sourceCRS(path))
+    # written last, so an interrupted ingest leaves no cache that looks complete
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=1)
+    print(f"Point cache: {len(x)} points of {path} cached in {out_dir} in {time.perf_counter() - start:.1f}s.")
+    return out_dir
+
+
+# Reading
+#############################################################################################################
+class PointCache:
+    def __init__(self, folder):
+        with open(os.path.join(folder, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.folder = folder
+        self.count = self.meta["count"]
+        self.x = np.load(os.path.join(folder, "x.npy"), mmap_mode="r")
+        self.y = np.load(os.path.join(folder, "y.npy"), mmap_mode="r")
+        self.blocks = np.load(os.path.join(folder, "blocks.npy"))
+
+    def attribute(self, name):
+        return np.load(os.path.join(self.folder, f"attr_{name}.npy"), mmap_mode="r")
+
+    # Indices of the points inside x_min <= x < x_max, y_min < y <= y_max, read only from the blocks that touch the box
+    def indices(self, x_min, y_min, x_max, y_max):
+        touching = np.nonzero((self.blocks[:, 0] < x_max) & (self.blocks[:, 2] >= x_min) & (self.blocks[:, 1] <= y_max) & (self.blocks[:, 3] > y_min))[0]
+        if len(touching) == 0:
+            return np.zeros(0, dtype=np.int64)
+        size = self.meta["block_points"]
+        starts = touching * size
+        lengths = np.minimum(starts + size, self.count) - starts
+        # consecutive positions within each touching block, without a Python loop over blocks
+        index = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        x, y = self.x[index], self.y[index]
+        return index[(x >= x_min) & (x < x_max) & (y > y_min) & (y <= y_max)]
+
+    # x and y of the points that fall in the cells of a grid
+    def within(self, grid):
+        x_max = grid["x_min"] + grid["cols"] * grid["cell_size"]
+        y_min = grid["y_max"] - grid["rows"] * grid["cell_size"]
+        index = self.indices(grid["x_min"], y_min, x_max, grid["y_max"])
+        return np.asarray(self.x[index]), np.asarray(self.y[index])
+
+    def points(self):
+        return np.asarray(self.x), np.asarray(self.y)
+
+    # CRS of x and y, for projections.transform
+    def crs(self):
+        return {"wkid": self.meta["wkid"], "crs_wkt": self.meta["crs_wkt"]}
+
+
+# Cache of a point dataset if it is up to date with its source, else None
+def openCache(path):
+    folder = cacheFolder(path)
+    meta_file = os.path.join(folder, "meta.json")
+    if not os.path.exists(meta_file):
+        return None
+    with open(meta_file) as f:
+        meta = json.load(f)
+    if meta["stamp"] != json.loads(json.dumps(datasetStamp(path))) or "crs_wkt" not in meta:
+        return None                                             # caches from before the CRS was recorded are rebuilt too
+    return PointCache(folder)
+
+
+# Cache of a point dataset, ingesting it first if it is missing or stale; a cache missing some of fields is rebuilt with
+# the fields it already had as well, so callers asking for different fields do not keep evicting each other's
+def cachedPoints(path, fields=()):
+    cache = openCache(path)
+    if cache is None:
+        cache = PointCache(ingest(path, list(fields)))
+    elif any(name not in cache.meta["fields"] for name in fields):
+        cache = PointCache(ingest(path, list(cache.meta["fields"]) + [name for name in fields if name not in cache.meta["fields"]]))
+    return cache
+
+
+# Main
+#############################################################################################################
+if __name__ == "__main__":
+    for year in range(2012, 2025):
+        ingest(address_points + str(year) + "_address_points.shp")
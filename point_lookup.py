@@ -0,0 +1,148 @@
+# About
+#############################################################################################################
+
+# Batch lookup of the WUI class of address points in every year.
+# The yearly {year}.tif maps in the output folder are stacked once, block by block, into a memory-mapped
+# (rows, cols, years) uint8 .npy file so all years of a cell sit next to each other. A lookup converts the point
+# coordinates to pixel indices in one vectorized step and gathers every year of every point with a single fancy
+# index into the memmap, chunk by chunk, so millions of points stream through without loading the maps.
+# Every record of a points shapefile gets a row keyed by its .dbf record index, with the id field written as stored;
+# null shapes have no coordinates and are written with empty x, y and class columns.
+
+
+# Imports
+#############################################################################################################
+import os
+import csv
+import json
+
+import numpy as np
+
+import moving_window as mw
+import raster_io
+import shapefile_reader
+
+
+# Settings
+#############################################################################################################
+from wui_settings import address_points, output, space
+lookup_output = space + "\\analysis\\lookup\\"
+stack_file = output + "wui_stack.npy"
+block_size = 2048                                               # rows and columns per block when building the stack
+chunk_size = 1000000                                            # points per lookup chunk
+outside = 255                                                   # class reported for points outside the maps
+
+
+# Stack
+#############################################################################################################
+# Build (or reuse, when it is newer than every yearly map) the memory-mapped stack and return it with its grid and years
+def yearlyStack(years, path=stack_file):
+    years = sorted(int(year) for year in years)
+    wui_rasters = [output + str(year) + ".tif" for year in years]
+    meta_file = os.path.splitext(path)[0] + ".json"
+    if os.path.exists(path) and os.path.exists(meta_file):
+        with open(meta_file) as f:
+            meta = json.load(f)
+        if meta["years"] == years and os.path.getmtime(path) >= max(os.path.getmtime(raster) for raster in wui_rasters):
+            return np.load(path, mmap_mode="r"), meta["grid"], years
+
+    grid = raster_io.rasterGrid(wui_rasters[0])
+    for raster in wui_rasters[1:]:
+        if not raster_io.sameGrid(grid, raster_io.rasterGrid(raster)):
+            raise ValueError(f"{raster} is not on the same grid as {wui_rasters[0]}.")
+    stack = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(grid["rows"], grid["cols"], len(years)))
+    for row, col, nrows, ncols in raster_io.iterBlocks(grid["rows"], grid["cols"], block_size):
+        for index, raster in enumerate(wui_rasters):
+            # NoData in the WUI maps is non-WUI (calcWUI saves 0 as NoData)
+            stack[row:row + nrows, col:col + ncols, index] = raster_io.readWindow(raster, grid, row, col, nrows, ncols, nodata=0, dtype=np.uint8)
+    stack.flush()
+    with open(meta_file, "w") as f:
+        json.dump({"years": years, "grid": grid}, f)
+    print(f"Lookup: stack of {len(years)} years written to {path}.")
+    return np.load(path, mmap_mode="r"), grid, years
+
+
+# Points
+#############################################################################################################
+# Coordinates, ids and record indices of every feature; for shapefiles null shapes are kept with NaN coordinates and
+# the ids are id_field as shapefile_reader.readDBF types it, or the record index
+def readLookupPoints(path, id_field=None):
+    if not path.lower().endswith(".shp"):
+        x, y = raster_io.readPointCoordinates(path)
+        return x, y, np.arange(len(x)), np.arange(len(x))
+    present_x, present_y, present = shapefile_reader.readPointCoordinates(path, records=True)
+    count = len(shapefile_reader.recordOffsets(path)[0])
+    x, y = np.full(count, np.nan), np.full(count, np.nan)
+    x[present], y[present] = present_x, present_y
+    records = np.arange(count)
+    if id_field is None:
+        return x, y, records, records
+    return x, y, shapefile_reader.readDBF(path, [id_field], deleted=True)[id_field], records
+
+
+# Lookup
+#############################################################################################################
+# [point, year] WUI classes of the given points, with outside for points beyond the maps (or without coordinates)
+def lookupPoints(stack, grid, x, y):
+    missing = ~(np.isfinite(x) & np.isfinite(y))
+    if missing.any():
+        x, y = np.where(missing, grid["x_min"] - grid["cell_size"], x), np.where(missing, grid["y_max"], y)
+    rows, cols, inside = mw.pointsToCells(x, y, grid)
+    if inside.all():
+        return np.asarray(stack[rows, cols])
+    classes = np.full((len(rows), stack.shape[2]), outside, dtype=np.uint8)
+    classes[inside] = stack[rows[inside], cols[inside]]
+    return classes
+
+
+# Yield (start, classes) for consecutive chunks of points
+def lookupChunks(stack, grid, x, y, chunk=chunk_size):
+    for start in range(0, len(x), chunk):
+        yield start, lookupPoints(stack, grid, x[start:start + chunk], y[start:start + chunk])
+
+
+# Text of a CSV column, empty where the value is missing (NaN)
+def csvColumn(values, fmt):
+    values = np.asarray(values)
+    if values.dtype.kind != "f":
+        return values.astype(str)
+    text = np.char.mod(fmt, values).astype(object)
+    text[np.isnan(values)] = ""
+    return text
+
+
+# Stream the classes of every point to a CSV with one column per year, chunk by chunk. ids are written in their own
+# dtype and records (the .dbf record index) default to the position of each point; points without coordinates get
+# empty x, y and class columns.
+def writeLookup(stack, grid, years, x, y, out_csv, ids=None, records=None, chunk=chunk_size):
+    folder = os.path.dirname(out_csv)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    records = np.arange(len(x)) if records is None else np.asarray(records)
+    ids = records if ids is None else np.asarray(ids)
+    with open(out_csv, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "record", "x", "y"] + [f"wui_{year}" for year in years])
+        for start, classes in lookupChunks(stack, grid, x, y, chunk):
+            stop = start + len(classes)
+            missing = ~(np.isfinite(x[start:stop]) & np.isfinite(y[start:stop]))
+            class_columns = []
+            for index in range(len(years)):
+                text = classes[:, index].astype(str).astype(object)
+                text[missing] = ""
+                class_columns.append(text)
+            writer.writerows(zip(csvColumn(ids[start:stop], "%.15g"), records[start:stop].astype(str),
+                                 csvColumn(x[start:stop], "%.3f"), csvColumn(y[start:stop], "%.3f"), *class_columns))
+            print(f"Lookup: {stop} of {len(x)} points written.")
+    print(f"Point lookup written to {out_csv}.")
+
+
+# Main
+#############################################################################################################
+if __name__ == "__main__":
+    years = range(2012, 2025)
+    points = address_points + "2024_address_points.shp"
+
+    stack, grid, years = yearlyStack(years)
+    x, y, ids, records = readLookupPoints(points)
+    writeLookup(stack, grid, years, x, y, lookup_output + "point_lookup.csv", ids, records)
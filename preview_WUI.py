@@ -0,0 +1,187 @@
+# About
+#############################################################################################################
+
+# Coarse-resolution preview of the WUI map.
+# Builds a resolution pyramid of the NLCD raster (wildland, valid and water fractions per coarse cell at 90m, 240m, ...)
+# in one block-wise pass and caches it by NLCD checksum, then classifies the WUI on a coarse level in seconds with the
+# neighborhood radius kept in meters (so it spans fewer, larger cells). Tiles the user asks for are then refined to the
+# full 30m pipeline on a window around the tile, so wiring up inputs and exploring parameters does not need a full run.
+
+
+# Imports
+#############################################################################################################
+import os
+
+import numpy as np
+from scipy import ndimage
+
+import moving_window as mw
+import raster_io
+from input_catalog import InputCatalog
+
+
+# Settings
+#############################################################################################################
+from wui_settings import address_points, catalog_file, nlcd_projected_clipped, space, temp
+pyramid_cache = temp + "pyramids\\"
+preview_output = space + "\\analysis\\preview\\"
+
+pyramid_factors = [3, 8, 16, 32]                                # coarse cells are factor x 30m: 90m, 240m, 480m, 960m
+coarse_cell_size = 240                                          # m, coarse cells used to size patches cut by a tile window
+block_size = 1920                                               # pyramid build block, a multiple of every factor
+refine_tile_size = 1024                                         # 30m cells per refined tile side
+patch_halo = 5000                                               # m of extra context around a refined tile for patch detection
+
+
+# Pyramid
+#############################################################################################################
+# Sum of each factor x factor block (the array must already be a multiple of factor in both directions)
+def blockSum(array, factor):
+    rows, cols = array.shape
+    return array.reshape(rows // factor, factor, cols // factor, factor).sum(axis=(1, 3), dtype=np.float32)
+
+
+# Pyramid factor whose coarse cells are closest to coarse_cell_size without exceeding it, so tiled runs at any cell size
+# look at patches on the same ground scale (8 at 30m, 24 at 10m); factors divide block_size so the pyramid can be built
+def previewFactor(cell_size):
+    target = max(1, int(coarse_cell_size // cell_size))
+    return max(factor for factor in range(1, target + 1) if block_size % factor == 0)
+
+
+# Wildland, valid and water fractions of every coarse cell for each factor, read from the NLCD in one block-wise pass
+def buildPyramid(curr_nlcd, factors=pyramid_factors, catalog=None, nodata=0):
+    catalog = InputCatalog(catalog_file) if catalog is None else catalog
+    cache_file = pyramid_cache + catalog.checksum(curr_nlcd)[:16] + "_" + "_".join(str(f) for f in factors) + ".npz"
+    grid = raster_io.rasterGrid(curr_nlcd, catalog)
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            return {factor: levelFromArrays(grid, factor, cached[f"wild_{factor}"], cached[f"valid_{factor}"], cached[f"water_{factor}"]) for factor in factors}
+
+    padded_rows = -(-grid["rows"] // block_size) * block_size
+    padded_cols = -(-grid["cols"] // block_size) * block_size
+    sums = {factor: {name: np.zeros((padded_rows // factor, padded_cols // factor), dtype=np.float32) for name in ("wild", "valid", "water")} for factor in factors}
+    for row, col, nrows, ncols in raster_io.iterBlocks(padded_rows, padded_cols, block_size):
+        nlcd = raster_io.readWindow(curr_nlcd, grid, row, col, nrows, ncols, nodata=nodata, dtype=np.uint8)
+        layers = {"wild": mw.wildlandBaseRaster(nlcd), "valid": mw.validMask(nlcd, nodata).astype(np.uint8), "water": 1 - mw.waterRaster(nlcd)}
+        for factor in factors:
+            for name, layer in layers.items():
+                sums[factor][name][row // factor:(row + nrows) // factor, col // factor:(col + ncols) // factor] = blockSum(layer, factor)
+    print(f"Preview: pyramid of {curr_nlcd} built.")
+
+    levels, arrays = {}, {}
+    for factor in factors:
+        # drop the coarse cells that only cover block padding past the raster edge
+        shape = (-(-grid["rows"] // factor), -(-grid["cols"] // factor))
+        wild, valid, water = (sums[factor][name][:shape[0], :shape[1]] / float(factor * factor) for name in ("wild", "valid", "water"))
+        levels[factor] = levelFromArrays(grid, factor, wild, valid, water)
+        arrays.update({f"wild_{factor}": wild, f"valid_{factor}": valid, f"water_{factor}": water})
+    if not os.path.exists(pyramid_cache):
+        os.makedirs(pyramid_cache, exist_ok=True)
+    partial = cache_file + f".{os.getpid()}.partial"             # queue workers may build the same pyramid at once
+    with open(partial, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(partial, cache_file)
+    return levels
+
+
+def levelFromArrays(grid, factor, wild, valid, water):
+    level_grid = dict(grid)
+    level_grid.update(mw.makeGrid(grid["x_min"], grid["y_max"], grid["cell_size"] * factor, wild.shape[0], wild.shape[1]))
+    return {"grid": level_grid, "factor": factor, "wild": wild, "valid": valid, "water": water}
+
+
+# Coarse classification
+#############################################################################################################
+# WUI classes on a pyramid level, with the radius and patch thresholds kept in meters
+def previewWUI(level, x, y, radius):
+    grid = level["grid"]
+    cell_size = grid["cell_size"]
+    valid = level["valid"] >= 0.5
+    nbr_houses = mw.discSum(mw.houseCounts(x, y, grid), radius, cell_size)
+    dense = mw.neighborhoodDensity(nbr_houses, radius)
+    buildable = (level["water"] < 0.5).astype(np.uint8)
+    # fractions are scaled up before summing since discSum rounds to whole counts
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cover = mw.discSum(level["wild"] * 1000, radius, cell_size) / np.maximum(mw.discSum(level["valid"] * 1000, radius, cell_size), 1)
+    wildcover50 = cover > mw.cover_threshold
+    patch_buffer = coarsePatchDistance(level) <= mw.patch_buffer_distance
+    return mw.calcWUI(dense, buildable, wildcover50, patch_buffer.astype(np.uint8), valid)
+
+
+# Distance to large wildland patches on a pyramid level, with patch areas counted from the wildland fraction of each cell
+def coarsePatchDistance(level):
+    cell_size = level["grid"]["cell_size"]
+    labels, count = ndimage.label(level["wild"] >= 0.5)
+    areas = np.bincount(labels.ravel(), weights=level["wild"].ravel() * cell_size * cell_size, minlength=count + 1)
+    areas[0] = 0
+    return mw.distanceToLargePatches(labels, areas, cell_size)
+
+
+# Refinement
+#############################################################################################################
+# Cells of context a refined tile needs on each side: the neighborhood radius, the patch buffer and patch_halo
+def tileHalo(radius, cell_size):
+    return int(np.ceil((radius + mw.patch_buffer_distance + patch_halo) / cell_size))
+
+
+# Full resolution WUI for one tile, computed on a window padded by tileHalo cells.
+def refineTile(curr_nlcd, grid, x, y, radius, tile_row, tile_col, coarse_level, tile_size=refine_tile_size, nodata=0):
+    halo = tileHalo(radius, grid["cell_size"])
+    row, col = tile_row * tile_size - halo, tile_col * tile_size - halo
+    size = tile_size + 2 * halo
+    nlcd = raster_io.readWindow(curr_nlcd, grid, row, col, size, size, nodata=nodata, dtype=np.uint8)
+    houses = mw.houseCounts(x, y, raster_io.windowGrid(grid, row, col, size, size))
+    wui = classifyWindow(nlcd, houses, grid["cell_size"], row, col, halo, radius, coarse_level, nodata)
+    return wui, raster_io.windowGrid(grid, tile_row * tile_size, tile_col * tile_size, tile_size, tile_size)
+
+
+# Patch buffer of a window whose upper-left cell is (row, col) of the full grid. Patches cut by the window edge are
+# treated as large when the coarse level says they belong to a large patch.
+def windowPatchBuffer(wildveg, cell_size, row, col, coarse_level):
+    labels, areas = mw.labelWildlandPatches(wildveg, cell_size)
+    edge_labels = np.unique(np.concatenate([labels[0], labels[-1], labels[:, 0], labels[:, -1]]))
+    if "large" not in coarse_level:                             # computed once per level and shared by every tile
+        coarse_level["large"] = coarsePatchDistance(coarse_level) <= 0
+    coarse_large = coarse_level["large"]
+    factor = coarse_level["factor"]
+    rows = np.clip((row + np.arange(wildveg.shape[0])) // factor, 0, coarse_large.shape[0] - 1)
+    cols = np.clip((col + np.arange(wildveg.shape[1])) // factor, 0, coarse_large.shape[1] - 1)
+    in_coarse_large = np.unique(labels[coarse_large[np.ix_(rows, cols)] & (labels > 0)])
+    areas[np.intersect1d(edge_labels[edge_labels > 0], in_coarse_large)] = np.inf
+    return (mw.distanceToLargePatches(labels, areas, cell_size) <= mw.patch_buffer_distance).astype(np.uint8)
+
+
+# WUI of the inside of a window whose upper-left cell is (row, col) of the full grid, without its halo cells;
+# method is the mw.discSum algorithm (mw.disc_sum_method by default)
+def classifyWindow(nlcd, houses, cell_size, row, col, halo, radius, coarse_level, nodata=0, method=None):
+    valid = mw.validMask(nlcd, nodata)
+    wildveg = mw.wildlandBaseRaster(nlcd)
+    wildveg_buffer = windowPatchBuffer(wildveg, cell_size, row, col, coarse_level)
+
+    dense = mw.neighborhoodDensity(mw.discSum(houses, radius, cell_size, method), radius)
+    wildcover50 = mw.calcWildlandCover(wildveg, valid, radius, cell_size, method=method)
+    wui = mw.calcWUI(dense, mw.waterRaster(nlcd), wildcover50, wildveg_buffer, valid)
+    return wui[halo:nlcd.shape[0] - halo, halo:nlcd.shape[1] - halo]
+
+
+# Main
+#############################################################################################################
+if __name__ == "__main__":
+    map_name = "Ketchpaw Flathead"
+    curr_nlcd = nlcd_projected_clipped + "nlcd_flathead.tif"
+    curr_address_points = address_points + "Flathead_2020_address_points.shp"
+    curr_buffer = 500
+    preview_factor = 8                                          # 240m preview
+    refine_tiles = [(0, 0)]                                     # (row, col) of refine_tile_size tiles to compute at 30m
+
+    levels = buildPyramid(curr_nlcd)
+    x, y = raster_io.readPointCoordinates(curr_address_points)
+    preview = previewWUI(levels[preview_factor], x, y, curr_buffer)
+    raster_io.saveArray(preview, levels[preview_factor]["grid"], preview_output + f"{map_name}_{int(levels[preview_factor]['grid']['cell_size'])}m.tif", nodata=0)
+    print(f"{map_name}: preview at {levels[preview_factor]['grid']['cell_size']:.0f}m completed, {np.count_nonzero(preview)} WUI cells.")
+
+    grid = raster_io.rasterGrid(curr_nlcd)
+    for tile_row, tile_col in refine_tiles:
+        wui, tile_grid = refineTile(curr_nlcd, grid, x, y, curr_buffer, tile_row, tile_col, levels[preview_factor])
+        raster_io.saveArray(wui, tile_grid, preview_output + f"{map_name}_tile_{tile_row}_{tile_col}.tif", nodata=0)
+        print(f"{map_name}: tile {tile_row}, {tile_col} refined to 30m.")
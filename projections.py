@@ -0,0 +1,158 @@
+# About
+#############################################################################################################
+
+# Vectorized map projections for point coordinates, so inputs can be brought onto a grid without arcpy.
+# Ellipsoidal Lambert Conformal Conic (2 standard parallels) and Albers Equal Area Conic following Snyder, Map
+# Projections - A Working Manual (USGS PP 1395, 1987), equations 15-1 to 15-11 and 14-1 to 14-21 with their inverses.
+# Projections are given by a factory code in crs_definitions or read from ESRI WKT (crsFromWKT), so the national NLCD
+# Albers grid works whether or not its metadata carries a code. Coordinates are in degrees and meters.
+# No datum shift is applied: WGS 84 and NAD 1983 (2011) differ by about a meter here, well under a 30m cell.
+
+
+# Imports
+#############################################################################################################
+import re
+
+import numpy as np
+
+
+# Settings
+#############################################################################################################
+grs80 = {"a": 6378137.0, "f": 1 / 298.257222101}
+
+crs_definitions = {
+    6514: dict(grs80, projection="lcc", lat_1=49.0, lat_2=45.0, lat_0=44.25, lon_0=-109.5, x_0=600000.0, y_0=0.0),   # NAD83(2011) / Montana (m)
+    5070: dict(grs80, projection="aea", lat_1=29.5, lat_2=45.5, lat_0=23.0, lon_0=-96.0, x_0=0.0, y_0=0.0),          # NAD83 / Conus Albers (NLCD)
+}
+wkt_projections = {"lambert_conformal_conic": "lcc", "albers": "aea", "albers_conic_equal_area": "aea", "albers_conical_equal_area": "aea"}
+wkt_parameters = {"standard_parallel_1": "lat_1", "standard_parallel_2": "lat_2", "latitude_of_origin": "lat_0", "latitude_of_center": "lat_0",
+                  "central_meridian": "lon_0", "longitude_of_center": "lon_0", "false_easting": "x_0", "false_northing": "y_0"}
+
+
+# Lambert Conformal Conic
+#############################################################################################################
+def lccConstants(crs):
+    a, f = crs["a"], crs["f"]
+    e = np.sqrt(f * (2 - f))
+    m = lambda phi: np.cos(phi) / np.sqrt(1 - (e * np.sin(phi)) ** 2)
+    t = lambda phi: np.tan(np.pi / 4 - phi / 2) / ((1 - e * np.sin(phi)) / (1 + e * np.sin(phi))) ** (e / 2)
+    phi_1, phi_2, phi_0 = (np.radians(crs[name]) for name in ("lat_1", "lat_2", "lat_0"))
+    n = (np.log(m(phi_1)) - np.log(m(phi_2))) / (np.log(t(phi_1)) - np.log(t(phi_2)))
+    F = m(phi_1) / (n * t(phi_1) ** n)
+    return {"a": a, "e": e, "n": n, "F": F, "rho_0": a * F * t(phi_0) ** n, "t": t}
+
+
+def lccForward(lon, lat, crs):
+    c = lccConstants(crs)
+    rho = c["a"] * c["F"] * c["t"](np.radians(np.asarray(lat, dtype=np.float64))) ** c["n"]
+    theta = c["n"] * np.radians(np.asarray(lon, dtype=np.float64) - crs["lon_0"])
+    return crs["x_0"] + rho * np.sin(theta), crs["y_0"] + c["rho_0"] - rho * np.cos(theta)
+
+
+def lccInverse(x, y, crs, iterations=6):
+    c = lccConstants(crs)
+    dx = np.asarray(x, dtype=np.float64) - crs["x_0"]
+    dy = c["rho_0"] - (np.asarray(y, dtype=np.float64) - crs["y_0"])
+    rho = np.sign(c["n"]) * np.hypot(dx, dy)
+    theta = np.arctan2(np.sign(c["n"]) * dx, np.sign(c["n"]) * dy)
+    t = (rho / (c["a"] * c["F"])) ** (1 / c["n"])
+    e = c["e"]
+    phi = np.pi / 2 - 2 * np.arctan(t)
+    for i in range(iterations):                                 # converges to well under a millimeter in 4-5 steps
+        phi = np.pi / 2 - 2 * np.arctan(t * ((1 - e * np.sin(phi)) / (1 + e * np.sin(phi))) ** (e / 2))
+    return np.degrees(theta / c["n"]) + crs["lon_0"], np.degrees(phi)
+
+
+# Albers Equal Area Conic
+#############################################################################################################
+def aeaConstants(crs):
+    a, f = crs["a"], crs["f"]
+    e = np.sqrt(f * (2 - f))
+    m = lambda phi: np.cos(phi) / np.sqrt(1 - (e * np.sin(phi)) ** 2)
+    q = lambda phi: (1 - e * e) * (np.sin(phi) / (1 - (e * np.sin(phi)) ** 2) - np.log((1 - e * np.sin(phi)) / (1 + e * np.sin(phi))) / (2 * e))
+    phi_1, phi_2, phi_0 = (np.radians(crs[name]) for name in ("lat_1", "lat_2", "lat_0"))
+    n = (m(phi_1) ** 2 - m(phi_2) ** 2) / (q(phi_2) - q(phi_1))
+    C = m(phi_1) ** 2 + n * q(phi_1)
+    return {"a": a, "e": e, "n": n, "C": C, "rho_0": a * np.sqrt(C - n * q(phi_0)) / n, "q": q}
+
+
+def aeaForward(lon, lat, crs):
+    c = aeaConstants(crs)
+    rho = c["a"] * np.sqrt(c["C"] - c["n"] * c["q"](np.radians(np.asarray(lat, dtype=np.float64)))) / c["n"]
+    theta = c["n"] * np.radians(np.asarray(lon, dtype=np.float64) - crs["lon_0"])
+    return crs["x_0"] + rho * np.sin(theta), crs["y_0"] + c["rho_0"] - rho * np.cos(theta)
+
+
+def aeaInverse(x, y, crs, iterations=6):
+    c = aeaConstants(crs)
+    a, e, n = c["a"], c["e"], c["n"]
+    dx = np.asarray(x, dtype=np.float64) - crs["x_0"]
+    dy = c["rho_0"] - (np.asarray(y, dtype=np.float64) - crs["y_0"])
+    rho = np.hypot(dx, dy)
+    theta = np.arctan2(np.sign(n) * dx, np.sign(n) * dy)
+    q = (c["C"] - (rho * n / a) ** 2) / n
+    phi = np.arcsin(np.clip(q / 2, -1, 1))
+    for i in range(iterations):                                 # Snyder 3-16, converges to well under a millimeter
+        sin_phi = np.sin(phi)
+        one = 1 - (e * sin_phi) ** 2
+        phi = phi + one ** 2 / (2 * np.cos(phi)) * (q / (1 - e * e) - sin_phi / one + np.log((1 - e * sin_phi) / (1 + e * sin_phi)) / (2 * e))
+    return np.degrees(theta / n) + crs["lon_0"], np.degrees(phi)
+
+
+# Dispatch
+#############################################################################################################
+# Definition of a projected CRS from ESRI/OGC WKT (Lambert Conformal Conic or Albers, in meters)
+def crsFromWKT(wkt):
+    projection = re.search(r'PROJECTION\["([^"]+)"', wkt)
+    spheroid = re.search(r'SPHEROID\["[^"]*",\s*([-\d.eE+]+),\s*([-\d.eE+]+)', wkt)
+    if projection is None or spheroid is None or projection.group(1).lower() not in wkt_projections:
+        raise ValueError(f"Only Lambert Conformal Conic and Albers projections are supported, not {wkt[:80]}...")
+    crs = {"projection": wkt_projections[projection.group(1).lower()], "a": float(spheroid.group(1)), "f": 1 / float(spheroid.group(2)), "x_0": 0.0, "y_0": 0.0}
+    for name, value in re.findall(r'PARAMETER\["([^"]+)",\s*([-\d.eE+]+)\]', wkt):
+        if name.lower() in wkt_parameters:
+            crs[wkt_parameters[name.lower()]] = float(value)
+    if "lat_2" not in crs:                                      # one standard parallel
+        crs["lat_2"] = crs["lat_1"]
+    return crs
+
+
+# Factory code in crs_definitions of a definition (e.g. one read by crsFromWKT), None if it matches none of them.
+# The two standard parallels may come in either order.
+def definitionCode(crs):
+    def values(definition):
+        parallels = sorted([definition.get("lat_1"), definition.get("lat_2")])
+        return [definition["projection"]] + parallels + [definition.get(key) for key in ("a", "f", "lat_0", "lon_0", "x_0", "y_0")]
+
+    for code, definition in crs_definitions.items():
+        expected, given = values(definition), values(crs)
+        if expected[0] == given[0] and all(value is not None and np.isclose(value, target, rtol=1e-9, atol=1e-9) for value, target in zip(given[1:], expected[1:])):
+            return code
+    return None
+
+
+# Definition of a CRS given as a factory code, a grid dict (wkid or crs_wkt) or a definition
+def crsDefinition(crs):
+    if isinstance(crs, dict) and "projection" in crs:
+        return crs
+    if isinstance(crs, dict):
+        if crs.get("wkid") in crs_definitions:
+            return crs_definitions[crs["wkid"]]
+        if crs.get("crs_wkt"):
+            return crsFromWKT(crs["crs_wkt"])
+        raise ValueError(f"Grid has no supported coordinate system (wkid {crs.get('wkid')}).")
+    return crs_definitions[crs]
+
+
+def forward(lon, lat, crs):
+    crs = crsDefinition(crs)
+    return (lccForward if crs["projection"] == "lcc" else aeaForward)(lon, lat, crs)
+
+
+def inverse(x, y, crs):
+    crs = crsDefinition(crs)
+    return (lccInverse if crs["projection"] == "lcc" else aeaInverse)(x, y, crs)
+
+
+# Projected coordinates in one CRS to another, through geographic coordinates
+def transform(x, y, source, target):
+    return forward(*inverse(x, y, source), target)
@@ -0,0 +1,174 @@
+# About
+#############################################################################################################
+
+# Block-wise raster reading and writing (and point loading) for the NumPy stages of the WUI pipeline.
+# Windows are read with arcpy.RasterToNumPyArray so only the requested block is ever in memory; windows that reach
+# past the raster edge (e.g. to include a moving window halo) are padded with nodata. Output rasters are created empty
+# up front and every block is written straight into them (arcpy.Raster.write), so neither reading nor writing ever
+# holds more than a block in memory.
+# arcpy is not thread safe, so callers that read and write from more than one thread take arcpy_lock around each call.
+# Grids use the dict layout of moving_window.makeGrid plus the CRS of the source raster.
+
+
+# Imports
+#############################################################################################################
+import os
+import threading
+
+import numpy as np
+
+import moving_window as mw
+import shapefile_reader
+from input_catalog import describeDataset
+
+
+# Settings
+#############################################################################################################
+arcpy_lock = threading.Lock()                                   # held around arcpy calls made from worker threads
+pixel_types = {"uint8": "U8", "int8": "S8", "uint16": "U16", "int16": "S16", "uint32": "U32", "int32": "S32", "float32": "F32", "float64": "F64"}
+
+
+# Grids
+#############################################################################################################
+# Grid of a raster, from a catalog record if a catalog is given, otherwise from arcpy.Describe
+def rasterGrid(path, catalog=None):
+    record = catalog.lookup(path) if catalog is not None else describeDataset(path)
+    grid = mw.makeGrid(record["x_min"], record["y_max"], record["cell_size"], record["rows"], record["cols"])
+    grid["wkid"] = record["wkid"]
+    grid["crs_wkt"] = record["crs_wkt"]
+    return grid
+
+
+def sameGrid(grid_a, grid_b, tolerance=1e-6):
+    return (grid_a["rows"] == grid_b["rows"] and grid_a["cols"] == grid_b["cols"]
+            and all(abs(grid_a[key] - grid_b[key]) <= tolerance * max(1.0, abs(grid_a[key])) for key in ("x_min", "y_max", "cell_size")))
+
+
+# Grid of a rows x cols window whose upper-left cell is (row, col) of grid
+def windowGrid(grid, row, col, nrows, ncols):
+    window = dict(grid)
+    window.update(mw.makeGrid(grid["x_min"] + col * grid["cell_size"], grid["y_max"] - row * grid["cell_size"], grid["cell_size"], nrows, ncols))
+    return window
+
+
+# (row, col, nrows, ncols) of every block covering a rows x cols raster
+def iterBlocks(rows, cols, block_rows=2048, block_cols=None):
+    block_cols = block_rows if block_cols is None else block_cols
+    for row in range(0, rows, block_rows):
+        for col in range(0, cols, block_cols):
+            yield row, col, min(block_rows, rows - row), min(block_cols, cols - col)
+
+
+# Reading
+#############################################################################################################
+# Read the window starting at (row, col); parts of the window outside the raster are filled with nodata
+def readWindow(path, grid, row, col, nrows, ncols, nodata=0, dtype=None):
+    import arcpy
+
+    r0, c0 = max(row, 0), max(col, 0)
+    r1, c1 = min(row + nrows, grid["rows"]), min(col + ncols, grid["cols"])
+    if r1 <= r0 or c1 <= c0:
+        return np.full((nrows, ncols), nodata, dtype=dtype or np.float32)
+    lower_left = arcpy.Point(grid["x_min"] + c0 * grid["cell_size"], grid["y_max"] - r1 * grid["cell_size"])
+    block = arcpy.RasterToNumPyArray(path, lower_left, c1 - c0, r1 - r0, nodata_to_value=nodata)
+    if dtype is not None:
+        block = block.astype(dtype, copy=False)
+    if (r0, c0, r1, c1) == (row, col, row + nrows, col + ncols):
+        return block
+    window = np.full((nrows, ncols), nodata, dtype=block.dtype)
+    window[r0 - row:r1 - row, c0 - col:c1 - col] = block
+    return window
+
+
+def readRaster(path, grid=None, nodata=0, dtype=None):
+    grid = rasterGrid(path) if grid is None else grid
+    return readWindow(path, grid, 0, 0, grid["rows"], grid["cols"], nodata, dtype)
+
+
+# Points
+#############################################################################################################
+# x and y of every feature as float64 arrays; polygon footprints are reduced to their centroids.
+# Shapefiles are parsed directly, other feature classes (e.g. in a geodatabase) go through arcpy.
+def readPointCoordinates(path):
+    if path.lower().endswith(".shp"):
+        return shapefile_reader.readPointCoordinates(path)
+    import arcpy
+
+    xy = arcpy.da.FeatureClassToNumPyArray(path, ["SHAPE@XY"])["SHAPE@XY"]
+    return xy[:, 0].astype(np.float64), xy[:, 1].astype(np.float64)
+
+
+# Writing
+#############################################################################################################
+# Spatial reference of a grid, None if it has no CRS
+def spatialReference(grid):
+    import arcpy
+
+    if grid.get("wkid"):
+        return arcpy.SpatialReference(grid["wkid"])
+    if grid.get("crs_wkt"):
+        spatial_ref = arcpy.SpatialReference()
+        spatial_ref.loadFromString(grid["crs_wkt"])
+        return spatial_ref
+    return None
+
+
+def saveArray(array, grid, path, nodata=None):
+    import arcpy
+
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    lower_left = arcpy.Point(grid["x_min"], grid["y_max"] - grid["rows"] * grid["cell_size"])
+    raster = arcpy.NumPyArrayToRaster(np.asarray(array), lower_left, grid["cell_size"], grid["cell_size"], nodata)
+    raster.save(path)
+    spatial_ref = spatialReference(grid)
+    if spatial_ref is not None:
+        arcpy.management.DefineProjection(path, spatial_ref)
+
+
+# Writes the blocks of an output raster straight into a raster created empty on the grid (arcpy.Raster.write, ArcGIS
+# Pro 3.x), so only the block being written is in memory; the raster is saved under path on close. Cells never written
+# are NoData unless fill is given.
+class BlockWriter:
+    def __init__(self, path, grid, dtype=np.uint8, nodata=None, fill=None, block_size=2048):
+        import arcpy
+
+        self.path = path
+        self.grid = grid
+        self.dtype = np.dtype(dtype)
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        info = arcpy.RasterInfo()
+        info.setBandCount(1)
+        info.setPixelType(pixel_types[self.dtype.name])
+        info.setCellSize((grid["cell_size"], grid["cell_size"]))
+        info.setExtent(arcpy.Extent(grid["x_min"], grid["y_max"] - grid["rows"] * grid["cell_size"],
+                                    grid["x_min"] + grid["cols"] * grid["cell_size"], grid["y_max"]))
+        spatial_ref = spatialReference(grid)
+        if spatial_ref is not None:
+            info.setSpatialReference(spatial_ref)
+        if nodata is not None:
+            info.setNoDataValues([nodata])
+        self.raster = arcpy.Raster(info)
+        if fill is not None:
+            for row, col, nrows, ncols in iterBlocks(grid["rows"], grid["cols"], block_size):
+                self.write(row, col, np.full((nrows, ncols), fill, dtype=self.dtype))
+
+    def write(self, row, col, block):
+        origin = (self.grid["x_min"] + col * self.grid["cell_size"], self.grid["y_max"] - row * self.grid["cell_size"])
+        self.raster.write(np.asarray(block, dtype=self.dtype)[:, :, np.newaxis], origin_coordinate=origin)
+
+    def close(self):
+        self.raster.save(self.path)
+        del self.raster
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            del self.raster
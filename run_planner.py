@@ -0,0 +1,186 @@
+# About
+#############################################################################################################
+
+# Run planner for the NumPy/tiled WUI pipeline.
+# Reads the raster size, cell size and address point count of a run from the input catalog, estimates the cost of the
+# three disc sum algorithms in moving_window.discSum for the requested radius, and picks the fastest one together with
+# the tile size and worker count that finish soonest within a memory budget:
+#   direct   one multiply-add per kernel cell per cell, ~ (radius / cell_size)^2, best for small radii
+#   rows     one subtraction per disc row per cell from row prefix sums, ~ radius / cell_size
+#   fft      overlap-add FFT convolution, ~ log of the padded tile size and nearly independent of the radius
+# Per-cell costs come from a short calibration run on this machine (saved in benchmark_results/planner/) and from the
+# latest benchmark_WUI_pipeline.py result for the stages that do not depend on the radius.
+
+
+# Imports
+#############################################################################################################
+import os
+import glob
+import json
+import time
+
+import numpy as np
+
+import moving_window as mw
+import preview_WUI
+import tiled_WUI
+
+
+# Settings
+#############################################################################################################
+from wui_settings import address_points, catalog_file, nlcd_projected_clipped
+results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_results")
+calibration_file = os.path.join(results_dir, "planner", "calibration.json")
+
+memory_budget_gb = 16                                           # RAM the run may use across all workers
+tile_sizes = [512, 1024, 2048, 4096, 8192]                      # candidate tile sides in cells, not counting the halo
+methods = ["direct", "rows", "fft"]
+disc_sums_per_tile = 3                                          # house counts, wildland cells and valid cells
+bytes_per_cell = {"direct": 40, "rows": 56, "fft": 64}          # peak bytes per window cell while a tile is classified
+queued_bytes_per_cell = 9                                       # per cell of a queued tile, uint8 NLCD and int64 houses
+default_costs = {                                               # ns per cell, used until the machine is calibrated
+    "direct": 0.9,                                              # per kernel cell
+    "rows": 1.5,                                                # per disc row
+    "fft": 6.0,                                                 # per log2 of the padded window cells
+    "fixed": 120.0,                                             # classification, patch labels and distances
+    "points": 4.0,                                              # per address point per tile, binning house counts
+}
+
+
+# Cost model
+#############################################################################################################
+def kernelCells(radius, cell_size):
+    return int(mw.discKernel(radius, cell_size).sum())
+
+
+def kernelRows(radius, cell_size):
+    return 2 * int(radius // cell_size) + 1
+
+
+# Seconds for one disc sum over a window of window_cells cells (a window_side x window_side square)
+def discSumSeconds(method, radius, cell_size, window_side, costs):
+    window_cells = window_side * window_side
+    if method == "direct":
+        per_cell = costs["direct"] * kernelCells(radius, cell_size)
+    elif method == "rows":
+        per_cell = costs["rows"] * kernelRows(radius, cell_size)
+    else:
+        padded = (window_side + kernelRows(radius, cell_size)) ** 2
+        per_cell = costs["fft"] * np.log2(padded) * padded / window_cells
+    return per_cell * window_cells * 1e-9
+
+
+# Estimated runtime and peak memory of one plan; besides the windows being classified, the reader and writer queues of
+# tiled_WUI.runTiled hold up to 2 * prefetch more windows
+def estimate(grid, point_count, radius, method, tile_size, workers, costs):
+    cell_size = grid["cell_size"]
+    halo = preview_WUI.tileHalo(radius, cell_size)
+    tile_size = min(tile_size, max(grid["rows"], grid["cols"]))
+    window_side = tile_size + 2 * halo
+    tiles = -(-grid["rows"] // tile_size) * -(-grid["cols"] // tile_size)
+    tile_seconds = (disc_sums_per_tile * discSumSeconds(method, radius, cell_size, window_side, costs)
+                    + costs["fixed"] * window_side * window_side * 1e-9 + costs["points"] * point_count * 1e-9)
+    waves = -(-tiles // workers)
+    window_bytes = workers * bytes_per_cell[method] + 2 * tiled_WUI.prefetch * queued_bytes_per_cell
+    return {
+        "method": method, "tile_size": tile_size, "halo": halo, "tiles": tiles, "workers": workers,
+        "seconds": waves * tile_seconds, "peak_gb": window_bytes * window_side * window_side / 1e9,
+    }
+
+
+# Fastest plan within the memory budget (or the smallest one if nothing fits)
+def planRun(grid, point_count, radius, budget_gb=memory_budget_gb, max_workers=None, costs=None):
+    costs = loadCosts() if costs is None else costs
+    max_workers = (os.cpu_count() or 1) if max_workers is None else max_workers
+    candidates = [estimate(grid, point_count, radius, method, tile_size, workers, costs)
+                  for method in methods for tile_size in tile_sizes for workers in range(1, max_workers + 1)]
+    fitting = [plan for plan in candidates if plan["peak_gb"] <= budget_gb]
+    if not fitting:
+        return min(candidates, key=lambda plan: plan["peak_gb"])
+    return min(fitting, key=lambda plan: (round(plan["seconds"], 1), plan["peak_gb"]))
+
+
+def printPlan(plan, grid, point_count, radius):
+    print(f"Plan for {grid['rows']}x{grid['cols']} cells at {grid['cell_size']:g}m, {point_count} address points, {radius}m radius:")
+    print(f"\tdisc sum:  {plan['method']} ({kernelCells(radius, grid['cell_size'])} kernel cells, {kernelRows(radius, grid['cell_size'])} rows)")
+    print(f"\ttiles:     {plan['tiles']} of {plan['tile_size']} cells with a {plan['halo']} cell halo")
+    print(f"\tworkers:   {plan['workers']}")
+    print(f"\testimated: {plan['seconds']:.0f}s, {plan['peak_gb']:.1f} GB peak memory")
+
+
+# Keyword arguments of tiled_WUI.runTiled for a plan; passed per run so concurrent runs with different plans do not
+# change each other's settings
+def tiledArguments(plan):
+    return {"tile_size": plan["tile_size"], "workers": plan["workers"], "method": plan["method"]}
+
+
+# Calibration
+#############################################################################################################
+# Time each disc sum method on a small array and derive its per-cell coefficient
+def calibrate(side=768, radius=150, cell_size=30, repeat=3):
+    array = (np.random.default_rng(0).random((side, side)) < 0.3).astype(np.uint8)
+    costs = dict(default_costs)
+    for method in methods:
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            mw.discSum(array, radius, cell_size, method)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        unit = discSumSeconds(method, radius, cell_size, side, dict(costs, **{method: 1.0}))
+        costs[method] = float(best / unit)
+    costs.update(benchmarkCosts())
+    if not os.path.exists(os.path.dirname(calibration_file)):
+        os.makedirs(os.path.dirname(calibration_file))
+    with open(calibration_file, "w") as f:
+        json.dump(costs, f, indent=1)
+    return costs
+
+
+# Per-cell cost of the radius independent stages from the latest benchmark result, if there is one
+def benchmarkCosts():
+    files = sorted(glob.glob(os.path.join(results_dir, "*.json")))
+    if not files:
+        return {}
+    with open(files[-1]) as f:
+        results = json.load(f)["results"]
+    fixed = [1000 / r["mp_per_s"] for r in results if r["stage"] in ("classification", "large_patch_buffer") and r["mp_per_s"]]
+    return {"fixed": sum(fixed) / len(fixed) * 2} if fixed else {}
+
+
+def loadCosts():
+    if os.path.exists(calibration_file):
+        with open(calibration_file) as f:
+            return dict(default_costs, **json.load(f))
+    return dict(default_costs)
+
+
+# Inputs
+#############################################################################################################
+# Grid of the NLCD raster and number of address points, from the catalog so no data is read
+def runInputs(curr_nlcd, curr_address_points):
+    from input_catalog import InputCatalog
+
+    catalog = InputCatalog(catalog_file)
+    nlcd = catalog.lookup(curr_nlcd)
+    points = catalog.lookup(curr_address_points)
+    grid = mw.makeGrid(nlcd["x_min"], nlcd["y_max"], nlcd["cell_size"], nlcd["rows"], nlcd["cols"])
+    return grid, int(points["feature_count"] or 0)
+
+
+# Main
+#############################################################################################################
+if __name__ == "__main__":
+    map_name = "2020"
+    curr_buffer = 500
+    recalibrate = False                                         # Set to True to time the disc sum methods on this machine
+
+    if recalibrate or not os.path.exists(calibration_file):
+        print("Calibrating disc sum costs.")
+        calibrate()
+    grid, point_count = runInputs(
+        nlcd_projected_clipped + "nlcd_" + map_name + "_pc.tif",
+        address_points + map_name + "_address_points.shp"
+    )
+    plan = planRun(grid, point_count, curr_buffer)
+    printPlan(plan, grid, point_count, curr_buffer)
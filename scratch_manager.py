@@ -0,0 +1,178 @@
+# About
+#############################################################################################################
+
+# Scratch workspaces for WUI runs.
+# Every map gets its own workspace folder, so runs of different maps never share or delete each other's files, and the
+# folder survives the run so an interrupted map resumes from its intermediates. Workspaces are placed on the first
+# scratch root (fastest first, e.g. a local SSD or RAM disk) whose quota and free space fit the run's estimated size,
+# and spill to the next, slower root when it is full. A workspace in use is held by an OS file lock, which the system
+# releases when the process ends, so a crashed run never leaves a stale lock behind.
+# Deleting is never on the critical path: a fresh run renames its old workspace into the root's .trash folder (a
+# single rename) and a background thread removes it, along with idle workspaces evicted when a root is over quota.
+# Workspaces named in `protected` (e.g. parent maps whose intermediates sub-region maps are windowed from) are never
+# evicted, only discarded by a fresh run of their own map.
+
+
+# Imports
+#############################################################################################################
+import os
+import time
+import queue
+import shutil
+import threading
+
+
+# Settings
+#############################################################################################################
+trash_folder = ".trash"
+lock_name = ".scratch_lock"
+bytes_per_cell = 48                                             # bytes of intermediates per NLCD cell and map, rasters and shapefiles together
+
+
+# File locks
+#############################################################################################################
+# Exclusive lock on an open file; False if another process holds it
+def lockFile(f):
+    try:
+        f.seek(0)                                               # lock the same first byte from every process
+        if os.name == "nt":
+            import msvcrt
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def folderSize(folder):
+    total = 0
+    for curr_root, dirs, files in os.walk(folder):
+        dirs[:] = [name for name in dirs if name != trash_folder]
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(curr_root, name))
+            except OSError:
+                pass                                            # removed while we were walking
+    return total
+
+
+# Scratch manager
+#############################################################################################################
+class ScratchManager:
+    # roots: [(folder, quota in bytes or None)], fastest first; protected: workspace names that are never evicted
+    def __init__(self, roots, protected=()):
+        self.roots = [(os.path.normpath(folder), quota) for folder, quota in roots]
+        self.protected = set(protected)
+        self.locks = {}                                         # workspace -> open lock file of this process
+        self.deletions = queue.Queue()
+        self.cleaner = threading.Thread(target=self.clean, daemon=True)
+        self.cleaner.start()
+        for folder, quota in self.roots:
+            trash = os.path.join(folder, trash_folder)
+            if os.path.isdir(trash):
+                # trash of earlier runs whose process ended before it was removed
+                for name in os.listdir(trash):
+                    self.deletions.put(os.path.join(trash, name))
+
+    def clean(self):
+        while True:
+            folder = self.deletions.get()
+            shutil.rmtree(folder, ignore_errors=True)
+            self.deletions.task_done()
+
+    # Existing workspace of a name on any root, or None
+    def find(self, name):
+        for folder, quota in self.roots:
+            workspace = os.path.join(folder, name)
+            if os.path.isdir(workspace):
+                return workspace + os.sep
+        return None
+
+    # Move a folder into its root's trash and queue it for deletion
+    def discard(self, workspace):
+        workspace = os.path.normpath(workspace)
+        trash = os.path.join(os.path.dirname(workspace), trash_folder)
+        if not os.path.exists(trash):
+            os.makedirs(trash, exist_ok=True)
+        target = os.path.join(trash, f"{os.path.basename(workspace)}_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}")
+        os.replace(workspace, target)
+        self.deletions.put(target)
+
+    # First root with room for expected_bytes within its quota and free space, evicting idle workspaces if that makes room
+    def chooseRoot(self, expected_bytes):
+        for index, (folder, quota) in enumerate(self.roots):
+            try:
+                os.makedirs(folder, exist_ok=True)
+            except OSError as e:
+                print(f"Scratch: {folder} is not available ({e}), skipping it.")
+                continue
+            free = shutil.disk_usage(folder).free
+            if quota is None:
+                if expected_bytes <= free or index == len(self.roots) - 1:
+                    return folder
+                continue
+            used = folderSize(folder)
+            if used + expected_bytes > quota:
+                used -= self.evict(folder, used + expected_bytes - quota)
+            if used + expected_bytes <= quota and expected_bytes <= free:
+                return folder
+            print(f"Scratch: {folder} is full ({used / 1e9:.1f} of {quota / 1e9:.1f} GB), spilling to the next root.")
+        return self.roots[-1][0]
+
+    # Discard idle workspaces of a root, least recently used first, until at least `needed` bytes are freed
+    def evict(self, folder, needed):
+        idle = []
+        for name in os.listdir(folder):
+            workspace = os.path.join(folder, name)
+            if name == trash_folder or name in self.protected or not os.path.isdir(workspace) or not self.idle(workspace):
+                continue
+            idle.append((os.path.getmtime(workspace), workspace))
+        freed = 0
+        for mtime, workspace in sorted(idle):
+            if freed >= needed:
+                break
+            freed += folderSize(workspace)
+            self.discard(workspace)
+            print(f"Scratch: evicted idle workspace {workspace}.")
+        return freed
+
+    # True if no process holds the workspace's lock
+    def idle(self, workspace):
+        lock_path = os.path.join(workspace, lock_name)
+        if os.path.normpath(workspace) in self.locks:
+            return False
+        if not os.path.exists(lock_path):
+            return True
+        with open(lock_path, "a+") as f:
+            return lockFile(f)                                  # released again when the file closes
+
+    # Locked workspace folder of a run (ending in a separator). The existing workspace is reused so the run resumes,
+    # unless fresh is set, in which case it is discarded in the background and a new one is placed.
+    def workspace(self, name, fresh=False, expected_bytes=0):
+        workspace = self.find(name)
+        if workspace is not None and not self.idle(workspace):
+            raise RuntimeError(f"Scratch workspace {workspace} is in use by another run.")
+        if workspace is not None and fresh:
+            self.discard(workspace)
+            workspace = None
+        if workspace is None:
+            workspace = os.path.join(self.chooseRoot(expected_bytes), name) + os.sep
+            os.makedirs(workspace, exist_ok=True)
+        lock = open(os.path.join(workspace, lock_name), "a+")
+        if not lockFile(lock):
+            lock.close()
+            raise RuntimeError(f"Scratch workspace {workspace} is in use by another run.")
+        self.locks[os.path.normpath(workspace)] = lock
+        os.utime(workspace)                                     # most recently used, evicted last
+        return workspace
+
+    def release(self, workspace):
+        lock = self.locks.pop(os.path.normpath(workspace), None)
+        if lock is not None:
+            lock.close()
+
+    # Block until the background deletions queued so far are done (e.g. before measuring disk use)
+    def wait(self):
+        self.deletions.join()
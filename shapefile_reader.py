@@ -0,0 +1,175 @@
+# About
+#############################################################################################################
+
+# Reader for ESRI shapefiles (.shp/.shx/.dbf) straight into NumPy arrays, without arcpy.
+# Files are memory-mapped. Point records all have the same length, so when the .shx shows them packed back to back the
+# coordinates are a strided view of the .shp; otherwise they are gathered at the .shx offsets. Polygon footprints are
+# reduced to area-weighted centroids (like FeatureToPoint's default) in one vectorized pass over every vertex.
+# Layouts follow the ESRI Shapefile Technical Description (1998) and the dBASE III table format.
+
+
+# Imports
+#############################################################################################################
+import os
+
+import numpy as np
+
+
+# Settings
+#############################################################################################################
+point_types = {1: 2, 11: 4, 21: 3}                              # shape type -> doubles per point record (x, y [, z] [, m])
+polygon_types = {5, 15, 25}                                     # polygon, polygonZ, polygonM
+header_size = 100                                               # bytes of the .shp and .shx file headers
+
+
+# Headers and record offsets
+#############################################################################################################
+def shapeType(path):
+    with open(os.path.splitext(path)[0] + ".shp", "rb") as f:
+        return int(np.frombuffer(f.read(header_size), dtype="<i4", count=1, offset=32)[0])
+
+
+# Byte offset and content length of every record in the .shp, from the .shx index
+def recordOffsets(path):
+    shx = np.memmap(os.path.splitext(path)[0] + ".shx", dtype=np.uint8, mode="r")
+    index = np.frombuffer(shx, dtype=">i4", offset=header_size).reshape(-1, 2).astype(np.int64)
+    return index[:, 0] * 2, index[:, 1] * 2                    # both are stored in 16-bit words
+
+
+# count float64 values (or int32 with dtype="<i4") at each byte offset of a byte array
+def gather(data, offsets, count=1, dtype="<f8"):
+    size = np.dtype(dtype).itemsize
+    index = np.asarray(offsets, dtype=np.int64)[:, None] + np.arange(count * size)
+    return data[index].view(dtype).reshape(len(offsets), count)
+
+
+# Points
+#############################################################################################################
+# x and y of every point record; null shapes are dropped, so with records=True the record index of every point
+# (its row in the .dbf) is returned as well
+def readPoints(path, records=False):
+    shp = np.memmap(os.path.splitext(path)[0] + ".shp", dtype=np.uint8, mode="r")
+    shape_type = shapeType(path)
+    if shape_type not in point_types:
+        raise ValueError(f"{path} has shape type {shape_type}, not a point type.")
+    offsets, lengths = recordOffsets(path)
+    content = 4 + 8 * point_types[shape_type]
+    record = 8 + content
+    if len(offsets) == 0:
+        return (np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64)) if records else (np.zeros(0), np.zeros(0))
+
+    packed = offsets[0] == header_size and np.array_equal(np.diff(offsets), np.full(len(offsets) - 1, record)) and (lengths == content).all()
+    if packed:
+        # every record is [number, length, type, x, y, ...] at a fixed stride: view x and y in place
+        xy = np.ndarray((len(offsets), 2), dtype="<f8", buffer=shp, offset=header_size + 12, strides=(record, 8))
+        present = np.ones(len(offsets), dtype=bool)
+        x, y = np.array(xy[:, 0]), np.array(xy[:, 1])
+    else:
+        present = lengths >= content                            # null shapes only store their type
+        xy = gather(shp, offsets[present] + 12, 2)
+        x, y = xy[:, 0].copy(), xy[:, 1].copy()
+    return (x, y, np.flatnonzero(present)) if records else (x, y)
+
+
+# Polygons
+#############################################################################################################
+# Area-weighted centroid of every polygon record (holes subtract, as they are wound the other way); null shapes are
+# dropped, so with records=True the record index of every centroid is returned as well
+def readCentroids(path, records=False):
+    shp = np.memmap(os.path.splitext(path)[0] + ".shp", dtype=np.uint8, mode="r")
+    shape_type = shapeType(path)
+    if shape_type not in polygon_types:
+        raise ValueError(f"{path} has shape type {shape_type}, not a polygon type.")
+    offsets, lengths = recordOffsets(path)
+    present = np.flatnonzero(lengths > 4)
+    offsets = offsets[present]
+    counts = gather(shp, offsets + 8 + 36, 2, "<i4").astype(np.int64)
+    part_counts, point_counts = counts[:, 0], counts[:, 1]
+
+    # byte offset of every vertex, records laid end to end
+    first_point = offsets + 8 + 44 + 4 * part_counts
+    record_of_point = np.repeat(np.arange(len(offsets)), point_counts)
+    point_starts = np.cumsum(point_counts) - point_counts
+    position = np.arange(point_counts.sum()) - point_starts[record_of_point]
+    xy = gather(shp, first_point[record_of_point] + 16 * position, 2)
+
+    # a vertex pairs with the next one unless it closes a ring
+    ring_ends = np.zeros(len(xy), dtype=bool)
+    part_index = np.repeat(np.arange(len(offsets)), part_counts)
+    part_starts = gather(shp, (offsets + 8 + 44)[part_index] + 4 * (np.arange(part_counts.sum()) - (np.cumsum(part_counts) - part_counts)[part_index]), 1, "<i4")[:, 0]
+    ring_ends[(point_starts[part_index] + part_starts - 1)[part_starts > 0]] = True
+    ring_ends[point_starts + point_counts - 1] = True
+
+    # shoelace terms relative to each record's first vertex, which keeps state plane coordinates from cancelling
+    origin = xy[point_starts][record_of_point]
+    local = xy - origin
+    following = np.roll(local, -1, axis=0)
+    cross = np.where(ring_ends, 0.0, local[:, 0] * following[:, 1] - following[:, 0] * local[:, 1])
+    area = np.bincount(record_of_point, cross, len(offsets))
+    cx = np.bincount(record_of_point, (local[:, 0] + following[:, 0]) * cross, len(offsets))
+    cy = np.bincount(record_of_point, (local[:, 1] + following[:, 1]) * cross, len(offsets))
+
+    # degenerate (zero area) footprints fall back to the mean of their vertices
+    mean_x = np.bincount(record_of_point, local[:, 0], len(offsets)) / np.maximum(point_counts, 1)
+    mean_y = np.bincount(record_of_point, local[:, 1], len(offsets)) / np.maximum(point_counts, 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x = np.where(area != 0, cx / (3 * area), mean_x)
+        y = np.where(area != 0, cy / (3 * area), mean_y)
+    x, y = x + xy[point_starts, 0], y + xy[point_starts, 1]
+    return (x, y, present) if records else (x, y)
+
+
+# x and y of every feature, with polygon footprints reduced to their centroids
+def readPointCoordinates(path, records=False):
+    shape_type = shapeType(path)
+    if shape_type in point_types:
+        return readPoints(path, records)
+    if shape_type in polygon_types:
+        return readCentroids(path, records)
+    raise ValueError(f"{path} has shape type {shape_type}, which is neither points nor polygons.")
+
+
+# Attributes
+#############################################################################################################
+# Field name -> (type, length, decimals) and the structured dtype of one .dbf record
+def dbfLayout(path):
+    with open(os.path.splitext(path)[0] + ".dbf", "rb") as f:
+        header = f.read(32)
+        header_length, record_length = (int(value) for value in np.frombuffer(header, dtype="<u2", count=2, offset=8))
+        descriptors = f.read(header_length - 32)
+    fields = {}
+    names, formats = ["deleted"], ["S1"]
+    for start in range(0, len(descriptors) - 1, 32):
+        descriptor = descriptors[start:start + 32]
+        if descriptor[0] == 0x0D:
+            break
+        name = descriptor[:11].split(b"\x00")[0].decode("ascii")
+        fields[name] = (chr(descriptor[11]), descriptor[16], descriptor[17])
+        names.append(name)
+        formats.append(f"S{descriptor[16]}")
+    return fields, np.dtype({"names": names, "formats": formats, "itemsize": record_length}), header_length
+
+
+# Columns of the .dbf as arrays: numeric fields as float64 (NaN where blank) or, when they have no decimals and no blanks,
+# int64 parsed from the text so large ids stay exact; everything else as stripped strings.
+# Deleted records are dropped unless deleted=True, which keeps the columns aligned with the .shp record indices.
+def readDBF(path, fields=None, deleted=False):
+    layout, dtype, header_length = dbfLayout(path)
+    dbf = os.path.splitext(path)[0] + ".dbf"
+    with open(dbf, "rb") as f:
+        count = int(np.frombuffer(f.read(8), dtype="<u4", count=1, offset=4)[0])
+    records = np.memmap(dbf, dtype=dtype, mode="r", offset=header_length, shape=(count,))
+    kept = np.ones(count, dtype=bool) if deleted else records["deleted"] != b"*"
+    columns = {}
+    for name in layout if fields is None else fields:
+        values = np.char.strip(records[name][kept])
+        if layout[name][0] in "NF" and layout[name][2] == 0 and (values != b"").all():
+            columns[name] = values.astype(np.int64)
+        elif layout[name][0] in "NF":
+            numbers = np.full(len(values), np.nan)
+            filled = values != b""
+            numbers[filled] = values[filled].astype(np.float64)
+            columns[name] = numbers
+        else:
+            columns[name] = np.char.decode(values, "latin-1")
+    return columns
@@ -0,0 +1,176 @@
+# About
+#############################################################################################################
+
+# Per-stage instrumentation for the WUI pipeline.
+# Records status, wall time, CPU time, peak RSS, bytes read/written and, for failed stages, the error of every stage of
+# a run, one CSV row per stage, and can optionally dump a cProfile file per stage so the hot path can be found and
+# tracked between runs.
+# psutil is used when it is installed (it ships with ArcGIS Pro); otherwise /proc and the resource module are used where available.
+
+
+# Imports
+#############################################################################################################
+import os
+import csv
+import time
+import cProfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# Settings
+#############################################################################################################
+trace_fields = ["started_at", "stage", "year", "radius", "status", "wall_s", "cpu_s", "peak_rss_mb", "read_mb", "write_mb", "error"]
+rss_sample_interval = 0.1                                                   # Seconds between RSS samples while a stage is running
+
+
+# Resource probes
+#############################################################################################################
+def currentRSS():
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        # ru_maxrss is the lifetime peak (KiB on Linux), the best we can do without psutil or /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+def ioCounters():
+    if psutil is not None:
+        try:
+            counters = psutil.Process().io_counters()
+            return counters.read_bytes, counters.write_bytes
+        except (AttributeError, psutil.Error):
+            pass
+    try:
+        fields = {}
+        with open("/proc/self/io") as f:
+            for line in f:
+                key, value = line.split(":")
+                fields[key] = int(value)
+        return fields["read_bytes"], fields["write_bytes"]
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+# Samples RSS on a background thread so short-lived allocation spikes inside a stage are captured
+class PeakRSSSampler:
+    def __init__(self):
+        self.peak = currentRSS()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(rss_sample_interval):
+            rss = currentRSS()
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        rss = currentRSS()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+
+# Trace
+#############################################################################################################
+# Collects one record per stage and appends it to trace_file as soon as the stage finishes,
+# so a run that dies part way still leaves a trace of everything before the failure.
+# With trace_file None records are only kept in memory; worker processes trace that way and hand their records to
+# the parent, which is the only process writing the CSV (see add), so rows never interleave.
+class StageTrace:
+    def __init__(self, trace_file, profile_dir=None):
+        self.trace_file = trace_file
+        self.profile_dir = profile_dir
+        self.records = []
+        self._lock = threading.Lock()
+        for folder in [os.path.dirname(trace_file) if trace_file else None, profile_dir]:
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+
+    @contextmanager
+    def stage(self, stage, year, radius=None):
+        record = {"started_at": datetime.now().isoformat(timespec="seconds"), "stage": stage, "year": year, "radius": radius}
+        profiler = cProfile.Profile() if self.profile_dir else None
+        read_start, write_start = ioCounters()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        status = "failed"
+        sampler = PeakRSSSampler()
+        try:
+            with sampler:
+                if profiler:
+                    profiler.enable()
+                try:
+                    yield record
+                    status = "ok"
+                except BaseException as e:
+                    record["error"] = f"{type(e).__name__}: {e}"
+                    raise
+                finally:
+                    if profiler:
+                        profiler.disable()
+                    record["wall_s"] = round(time.perf_counter() - wall_start, 3)
+                    record["cpu_s"] = round(time.process_time() - cpu_start, 3)
+        finally:
+            read_end, write_end = ioCounters()
+            record["status"] = status
+            record["peak_rss_mb"] = None if sampler.peak is None else round(sampler.peak / 2**20, 1)
+            record["read_mb"] = None if read_start is None else round((read_end - read_start) / 2**20, 1)
+            record["write_mb"] = None if write_start is None else round((write_end - write_start) / 2**20, 1)
+            if profiler:
+                suffix = "" if radius is None else "_" + str(radius)
+                profiler.dump_stats(os.path.join(self.profile_dir, f"{year}_{stage}{suffix}.prof"))
+            self._write(record)
+
+    def _appendRow(self, record):
+        if self.trace_file is None:
+            return
+        new_file = not os.path.exists(self.trace_file) or os.path.getsize(self.trace_file) == 0
+        with open(self.trace_file, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=trace_fields)
+            if new_file:
+                writer.writeheader()
+            writer.writerow({field: record.get(field) for field in trace_fields})
+
+    def _write(self, record):
+        with self._lock:
+            self.records.append(record)
+            self._appendRow(record)
+        print(f"[{record['started_at']}] {record['year']}: {record['stage']} {record['status']} in {record['wall_s']}s "
+              f"(cpu {record['cpu_s']}s, peak rss {record['peak_rss_mb']} MB).")
+
+    # Record of a stage traced in another process
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+            self._appendRow(record)
+
+    # Total wall time per stage across everything traced so far, slowest first
+    def summary(self):
+        totals = {}
+        for record in self.records:
+            totals[record["stage"]] = totals.get(record["stage"], 0) + record["wall_s"]
+        return sorted(totals.items(), key=lambda item: item[1], reverse=True)
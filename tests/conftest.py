@@ -0,0 +1,75 @@
+# About
+#############################################################################################################
+
+# Shared fixtures of the tests of the arcpy-free modules. The modules live at the repository root, which is put on
+# sys.path here; writePoints builds small shapefiles byte by byte so the readers are tested without arcpy.
+
+
+# Imports
+#############################################################################################################
+import os
+import sys
+import struct
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Shapefiles
+#############################################################################################################
+def shapeHeader(shape_type, length):
+    return struct.pack(">i20xi", 9994, length // 2) + struct.pack("<ii4d4d", 1000, shape_type, 0, 0, 1, 1, 0, 0, 0, 0)
+
+
+# .shp, .shx and .dbf from record contents (None for null shapes) and one column per field: name -> (type, width, decimals, values)
+def writeShapefile(stem, shape_type, contents, fields):
+    contents = [struct.pack("<i", 0) if content is None else content for content in contents]
+    shp = b"".join(struct.pack(">ii", index + 1, len(content) // 2) + content for index, content in enumerate(contents))
+    with open(stem + ".shp", "wb") as f:
+        f.write(shapeHeader(shape_type, 100 + len(shp)) + shp)
+    offset, shx = 100, b""
+    for content in contents:
+        shx += struct.pack(">ii", offset // 2, len(content) // 2)
+        offset += 8 + len(content)
+    with open(stem + ".shx", "wb") as f:
+        f.write(shapeHeader(shape_type, 100 + len(shx)) + shx)
+
+    record_length = 1 + sum(width for field_type, width, decimals, values in fields.values())
+    dbf = struct.pack("<BBBBIHH20x", 3, 0, 1, 1, len(contents), 32 + 32 * len(fields) + 1, record_length)
+    for name, (field_type, width, decimals, values) in fields.items():
+        dbf += struct.pack("<11sc4xBB14x", name.encode(), field_type.encode(), width, decimals)
+    dbf += b"\r"
+    for index in range(len(contents)):
+        dbf += b" "
+        for field_type, width, decimals, values in fields.values():
+            value = b"" if values[index] is None else str(values[index]).encode()
+            dbf += value.rjust(width) if field_type in "NF" else value.ljust(width)
+    with open(stem + ".dbf", "wb") as f:
+        f.write(dbf + b"\x1a")
+    return stem + ".shp"
+
+
+@pytest.fixture
+def writePoints(tmp_path):
+    def write(points, fields=None, name="points"):
+        contents = [None if point is None else struct.pack("<idd", 1, *point) for point in points]
+        fields = {"PID": ("N", 10, 0, list(range(len(points))))} if fields is None else fields
+        return writeShapefile(str(tmp_path / name), 1, contents, fields)
+    return write
+
+
+@pytest.fixture
+def writePolygons(tmp_path):
+    def write(polygons, name="polygons"):
+        contents = []
+        for rings in polygons:
+            if rings is None:
+                contents.append(None)
+                continue
+            points = [point for ring in rings for point in ring]
+            starts = [sum(len(ring) for ring in rings[:index]) for index in range(len(rings))]
+            contents.append(struct.pack("<i4dii", 5, 0, 0, 1, 1, len(rings), len(points))
+                            + struct.pack(f"<{len(rings)}i", *starts) + struct.pack(f"<{2 * len(points)}d", *[v for point in points for v in point]))
+        return writeShapefile(str(tmp_path / name), 5, contents, {"PID": ("N", 10, 0, list(range(len(polygons))))})
+    return write
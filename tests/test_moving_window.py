@@ -0,0 +1,105 @@
+# About
+#############################################################################################################
+
+# Tests of moving_window.py: the disc sum methods against each other and a brute force sum, the WUI classification
+# and the outlines traced for polygonizeWUI.
+
+
+# Imports
+#############################################################################################################
+import numpy as np
+import pytest
+from scipy import ndimage
+
+import moving_window as mw
+
+
+# Disc sums
+#############################################################################################################
+def bruteDiscSum(array, radius, cell_size):
+    half = int(radius // cell_size)
+    summed = np.zeros(array.shape, dtype=np.int64)
+    padded = np.pad(array.astype(np.int64), half)
+    for dr in range(-half, half + 1):
+        for dc in range(-half, half + 1):
+            if (dr * cell_size) ** 2 + (dc * cell_size) ** 2 <= radius ** 2:
+                summed += padded[half + dr:half + dr + array.shape[0], half + dc:half + dc + array.shape[1]]
+    return summed
+
+
+@pytest.mark.parametrize("radius, cell_size", [(30, 30), (100, 30), (500, 30), (95, 10)])
+@pytest.mark.parametrize("method", ["direct", "rows", "fft"])
+def test_disc_sum_methods_match_brute_force(method, radius, cell_size):
+    array = np.random.default_rng(radius).integers(0, 4, size=(61, 47)).astype(np.uint8)
+    np.testing.assert_array_equal(mw.discSum(array, radius, cell_size, method), bruteDiscSum(array, radius, cell_size))
+
+
+def test_disc_sum_default_method_and_unknown_method():
+    array = np.ones((20, 20), dtype=np.uint8)
+    np.testing.assert_array_equal(mw.discSum(array, 90, 30), mw.discSum(array, 90, 30, mw.disc_sum_method))
+    with pytest.raises(ValueError):
+        mw.discSum(array, 90, 30, "median")
+
+
+def test_house_counts_bin_points_into_cells():
+    grid = mw.makeGrid(0.0, 90.0, 30.0, 3, 3)
+    houses = mw.houseCounts(np.array([1.0, 2.0, 89.0, 200.0]), np.array([89.0, 88.0, 1.0, 50.0]), grid)
+    expected = np.zeros((3, 3), dtype=np.int64)
+    expected[0, 0], expected[2, 2] = 2, 1
+    np.testing.assert_array_equal(houses, expected)
+
+
+# Classification
+#############################################################################################################
+def test_calc_wui_prefers_intermix_and_masks_water():
+    dense = np.array([[True, True, True, False]])
+    buildable = np.array([[1, 1, 0, 1]], dtype=np.uint8)
+    wildcover50 = np.array([[True, False, True, True]])
+    wildveg_buffer = np.array([[1, 1, 1, 1]], dtype=np.uint8)
+    np.testing.assert_array_equal(mw.calcWUI(dense, buildable, wildcover50, wildveg_buffer), [[1, 2, 0, 0]])
+
+
+def test_tabulate_area_counts_classes_per_zone():
+    zones = np.array([[0, 0, 1, 1]])
+    wui = np.array([[1, 2, 2, 0]], dtype=np.uint8)
+    np.testing.assert_array_equal(mw.tabulateArea(zones, wui, 30), [[0, 900, 900], [900, 0, 900]])
+
+
+# Outlines
+#############################################################################################################
+def signedArea(ring):
+    x, y = ring[:, 1], -ring[:, 0]
+    return float(np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y)) / 2
+
+
+def test_outline_of_square_with_hole():
+    mask = np.ones((3, 3), dtype=bool)
+    mask[1, 1] = False
+    rings = mw.outlineRings(mask)
+    assert [signedArea(ring) for ring in rings] == [9, -1]
+    assert sorted(map(tuple, rings[0])) == [(0, 0), (0, 3), (3, 0), (3, 3)]
+
+
+def test_outline_keeps_diagonal_cells_apart():
+    mask = np.array([[1, 0, 0], [1, 1, 0], [0, 0, 1]], dtype=bool)
+    assert [signedArea(ring) for ring in mw.outlineRings(mask)] == [3, 1]
+
+
+def test_outline_rings_cover_every_region():
+    rng = np.random.default_rng(7)
+    for trial in range(100):
+        mask = rng.random((12, 15)) < 0.55
+        labels, count = ndimage.label(mask)
+        for label in range(1, count + 1):
+            areas = [signedArea(ring) for ring in mw.outlineRings(labels == label)]
+            assert sum(area > 0 for area in areas) == 1
+            assert sum(areas) == np.count_nonzero(labels == label)
+
+
+def test_polygonize_wui_outlines_are_in_full_grid_cells():
+    wui = np.zeros((6, 6), dtype=np.uint8)
+    wui[2:4, 3:5] = 2
+    wui[0, 0] = 1
+    regions = mw.polygonizeWUI(wui, outlines=True)
+    assert [(region["value"], region["cells"]) for region in regions] == [(1, 1), (2, 4)]
+    assert sorted(map(tuple, regions[1]["rings"][0])) == [(2, 3), (2, 5), (4, 3), (4, 5)]
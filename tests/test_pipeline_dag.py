@@ -0,0 +1,136 @@
+# About
+#############################################################################################################
+
+# Tests of pipeline_dag.py: stages run in dependency order, are skipped while their inputs are unchanged, rerun when
+# an input or their arguments change, and failures (traced in worker processes too) and bad graphs are reported.
+
+
+# Imports
+#############################################################################################################
+import os
+
+import pytest
+
+from pipeline_dag import Stage, PipelineRunner, datasetStamp
+from stage_trace import StageTrace
+
+
+# Stage functions
+#############################################################################################################
+calls = []
+
+
+def concatenate(out_path, separator, *in_paths):
+    calls.append(os.path.basename(out_path))
+    with open(out_path, "w") as f:
+        f.write(separator.join(open(path).read() for path in in_paths))
+
+
+def fail(out_path):
+    raise RuntimeError("stage broke")
+
+
+@pytest.fixture
+def files(tmp_path):
+    calls.clear()
+    source = tmp_path / "source.txt"
+    source.write_text("a")
+    return {name: str(tmp_path / f"{name}.txt") for name in ("source", "b", "c", "d")}
+
+
+# d reads b and c, c reads the source and b, b reads the source; listed out of order on purpose
+def chain(files, separator=""):
+    return [
+        Stage("d", concatenate, (files["d"], "", files["b"], files["c"]), [files["b"], files["c"]], [files["d"]]),
+        Stage("b", concatenate, (files["b"], "", files["source"]), [files["source"]], [files["b"]]),
+        Stage("c", concatenate, (files["c"], separator, files["source"], files["b"]), [files["source"], files["b"]], [files["c"]]),
+    ]
+
+
+# Tests
+#############################################################################################################
+def test_stages_run_in_dependency_order(files, tmp_path):
+    PipelineRunner(str(tmp_path / "state.json"), "2020").run(chain(files))
+    assert calls == ["b.txt", "c.txt", "d.txt"]
+    assert open(files["d"]).read() == "aaa"
+
+
+def test_unchanged_stages_are_skipped_on_rerun(files, tmp_path):
+    state_file = str(tmp_path / "state.json")
+    PipelineRunner(state_file, "2020").run(chain(files))
+    calls.clear()
+    PipelineRunner(state_file, "2020").run(chain(files))
+    assert calls == []
+
+
+def test_changed_input_reruns_downstream_stages(files, tmp_path):
+    state_file = str(tmp_path / "state.json")
+    PipelineRunner(state_file, "2020").run(chain(files))
+    calls.clear()
+    with open(files["source"], "w") as f:
+        f.write("xy")
+    PipelineRunner(state_file, "2020").run(chain(files))
+    assert calls == ["b.txt", "c.txt", "d.txt"]
+    assert open(files["d"]).read() == "xyxyxy"
+
+
+def test_changed_arguments_rerun_the_stage(files, tmp_path):
+    state_file = str(tmp_path / "state.json")
+    PipelineRunner(state_file, "2020").run(chain(files))
+    calls.clear()
+    PipelineRunner(state_file, "2020").run(chain(files, separator="-"))
+    assert calls == ["c.txt", "d.txt"]
+    assert open(files["d"]).read() == "aa-a"
+
+
+def test_checksums_skip_stages_whose_inputs_were_only_touched(files, tmp_path):
+    state_file = str(tmp_path / "state.json")
+    PipelineRunner(state_file, "2020", use_checksums=True).run(chain(files))
+    calls.clear()
+    os.utime(files["source"], (1, 1))
+    PipelineRunner(state_file, "2020", use_checksums=True).run(chain(files))
+    assert calls == []
+
+
+def test_failure_is_raised_and_later_stages_do_not_run(files, tmp_path):
+    stages = [
+        Stage("b", fail, (files["b"],), [files["source"]], [files["b"]]),
+        Stage("c", concatenate, (files["c"], "", files["b"]), [files["b"]], [files["c"]]),
+    ]
+    with pytest.raises(RuntimeError, match="stage b failed"):
+        PipelineRunner(str(tmp_path / "state.json"), "2020").run(stages)
+    assert calls == []
+
+
+def test_failed_stage_in_a_worker_process_is_traced(files, tmp_path):
+    trace = StageTrace(str(tmp_path / "trace.csv"))
+    stages = [Stage("b", fail, (files["b"],), [files["source"]], [files["b"]])]
+    with pytest.raises(RuntimeError, match="stage b failed: RuntimeError: stage broke"):
+        PipelineRunner(str(tmp_path / "state.json"), "2020", workers=1, processes=True, trace=trace).run(stages)
+    [record] = trace.records
+    assert record["status"] == "failed" and record["error"] == "RuntimeError: stage broke" and record["wall_s"] >= 0
+    assert "RuntimeError: stage broke" in open(trace.trace_file).read()
+
+
+def test_two_stages_writing_one_output_are_rejected(files, tmp_path):
+    stages = [
+        Stage("b", concatenate, (files["b"], "", files["source"]), [files["source"]], [files["b"]]),
+        Stage("b2", concatenate, (files["b"], "", files["source"]), [files["source"]], [files["b"]]),
+    ]
+    with pytest.raises(ValueError):
+        PipelineRunner(str(tmp_path / "state.json"), "2020").run(stages)
+
+
+def test_cycles_are_reported(files, tmp_path):
+    stages = [
+        Stage("b", concatenate, (files["b"], "", files["c"]), [files["c"]], [files["b"]]),
+        Stage("c", concatenate, (files["c"], "", files["b"]), [files["b"]], [files["c"]]),
+    ]
+    with pytest.raises(RuntimeError, match="could not run"):
+        PipelineRunner(str(tmp_path / "state.json"), "2020").run(stages)
+
+
+def test_dataset_stamp_lists_shapefile_sidecars(tmp_path):
+    for extension in (".shp", ".shx", ".dbf", ".shp.lock"):
+        (tmp_path / f"points{extension}").write_bytes(b"12")
+    assert [name for name, size, mtime in datasetStamp(str(tmp_path / "points.shp"))] == ["points.dbf", "points.shp", "points.shx"]
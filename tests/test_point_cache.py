@@ -0,0 +1,80 @@
+# About
+#############################################################################################################
+
+# Tests of point_cache.py: ingest of CSVs and shapefiles, PointCache.within against a scan of every point, and the
+# coordinate system the cache records.
+
+
+# Imports
+#############################################################################################################
+import numpy as np
+import pytest
+
+import moving_window as mw
+import point_cache
+
+
+montana_wkt = ('PROJCS["NAD_1983_2011_StatePlane_Montana_FIPS_2500",GEOGCS["GCS_NAD_1983_2011",DATUM["D_NAD_1983_2011",'
+               'SPHEROID["GRS_1980",6378137.0,298.257222101]],PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]],'
+               'PROJECTION["Lambert_Conformal_Conic"],PARAMETER["False_Easting",600000.0],PARAMETER["False_Northing",0.0],'
+               'PARAMETER["Central_Meridian",-109.5],PARAMETER["Standard_Parallel_1",45.0],PARAMETER["Standard_Parallel_2",49.0],'
+               'PARAMETER["Latitude_Of_Origin",44.25],UNIT["Meter",1.0]]')
+
+
+def writeCSV(path, rows):
+    with open(path, "w") as f:
+        f.write("\n".join(",".join(str(value) for value in row) for row in rows) + "\n")
+    return str(path)
+
+
+# Tests
+#############################################################################################################
+def test_within_matches_a_scan_of_every_point(tmp_path, monkeypatch):
+    monkeypatch.setattr(point_cache, "block_points", 64)        # many blocks, most of them outside each window
+    rng = np.random.default_rng(1)
+    x, y = rng.uniform(0, 30000, 5000), rng.uniform(0, 30000, 5000)
+    source = writeCSV(tmp_path / "points.csv", [("x", "y")] + list(zip(x, y)))
+    cache = point_cache.PointCache(point_cache.ingest(source, out_dir=str(tmp_path / "cache")))
+    assert cache.count == 5000
+    for row, col, size in [(0, 0, 100), (250, 400, 333), (990, 990, 50), (-20, -20, 40)]:
+        grid = mw.makeGrid(col * 30.0, 30000 - row * 30.0, 30.0, size, size)
+        within_x, within_y = cache.within(grid)
+        expected = mw.houseCounts(x, y, grid)
+        np.testing.assert_array_equal(mw.houseCounts(within_x, within_y, grid), expected)
+        assert len(within_x) == expected.sum()
+
+
+def test_blank_csv_coordinates_are_dropped(tmp_path):
+    source = writeCSV(tmp_path / "points.csv", [("id", "x", "y"), (1, 5, 6), (2, "", 7), (3, 8, " "), (4, 9, 10)])
+    cache = point_cache.PointCache(point_cache.ingest(source, ["id"], out_dir=str(tmp_path / "cache")))
+    assert sorted(np.asarray(cache.attribute("id")).tolist()) == [1.0, 4.0]
+    assert sorted(cache.points()[0].tolist()) == [5.0, 9.0]
+
+
+def test_cached_points_keep_the_fields_already_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(point_cache, "cacheFolder", lambda path: str(tmp_path / "cache"))
+    source = writeCSV(tmp_path / "points.csv", [("id", "kind", "x", "y"), (1, 2, 5, 6), (3, 4, 8, 9)])
+    point_cache.cachedPoints(source, ["id"])
+    cache = point_cache.cachedPoints(source, ["kind"])
+    assert sorted(cache.meta["fields"]) == ["id", "kind"]
+    assert sorted(np.asarray(cache.attribute("id")).tolist()) == [1.0, 3.0]
+
+
+def test_lon_lat_csv_is_projected(tmp_path):
+    source = writeCSV(tmp_path / "points.csv", [("lon", "lat"), (-109.5, 44.25)])
+    cache = point_cache.PointCache(point_cache.ingest(source, out_dir=str(tmp_path / "cache")))
+    np.testing.assert_allclose(np.concatenate(cache.points()), [600000.0, 0.0], atol=1e-6)
+    assert cache.crs() == {"wkid": point_cache.target_wkid, "crs_wkt": None}
+
+
+@pytest.mark.parametrize("wkt, wkid", [(montana_wkt, 6514), (montana_wkt.replace("-109.5", "-111.0"), None), (None, point_cache.target_wkid)])
+def test_shapefile_crs_comes_from_its_prj(writePoints, tmp_path, wkt, wkid):
+    path = writePoints([(600000.0, 100.0), None, (610000.0, 200.0)])
+    if wkt is not None:
+        with open(path[:-4] + ".prj", "w") as f:
+            f.write(wkt)
+    cache = point_cache.PointCache(point_cache.ingest(path, ["PID"], out_dir=str(tmp_path / "cache")))
+    assert cache.crs() == {"wkid": wkid, "crs_wkt": wkt}
+    # attributes stay with their points although the null shape is dropped
+    order = np.argsort(cache.points()[0])
+    np.testing.assert_array_equal(np.asarray(cache.attribute("PID"))[order], [0, 2])
@@ -0,0 +1,57 @@
+# About
+#############################################################################################################
+
+# Tests of projections.py: forward and inverse projections round trip, the projection origins land on the false
+# easting and northing, and ESRI WKT reads back as the built-in definitions.
+
+
+# Imports
+#############################################################################################################
+import numpy as np
+import pytest
+
+import projections
+
+
+montana_lon, montana_lat = np.meshgrid(np.linspace(-116.0, -104.0, 25), np.linspace(44.4, 49.0, 20))
+albers_wkt = ('PROJCS["NAD_1983_Albers",GEOGCS["GCS_North_American_1983",DATUM["D_North_American_1983",'
+              'SPHEROID["GRS_1980",6378137.0,298.257222101]],PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]],'
+              'PROJECTION["Albers"],PARAMETER["false_easting",0.0],PARAMETER["false_northing",0.0],'
+              'PARAMETER["central_meridian",-96.0],PARAMETER["standard_parallel_1",29.5],'
+              'PARAMETER["standard_parallel_2",45.5],PARAMETER["latitude_of_origin",23.0],UNIT["Meter",1.0]]')
+
+
+# Tests
+#############################################################################################################
+@pytest.mark.parametrize("wkid", [6514, 5070])
+def test_forward_inverse_round_trip(wkid):
+    x, y = projections.forward(montana_lon.ravel(), montana_lat.ravel(), wkid)
+    lon, lat = projections.inverse(x, y, wkid)
+    np.testing.assert_allclose(lon, montana_lon.ravel(), atol=1e-9)
+    np.testing.assert_allclose(lat, montana_lat.ravel(), atol=1e-9)
+
+
+@pytest.mark.parametrize("wkid", [6514, 5070])
+def test_origin_maps_to_false_easting_and_northing(wkid):
+    crs = projections.crs_definitions[wkid]
+    x, y = projections.forward(np.array([crs["lon_0"]]), np.array([crs["lat_0"]]), wkid)
+    np.testing.assert_allclose([x[0], y[0]], [crs["x_0"], crs["y_0"]], atol=1e-6)
+
+
+def test_transform_round_trip_between_state_plane_and_albers():
+    x, y = projections.forward(montana_lon.ravel(), montana_lat.ravel(), 6514)
+    albers_x, albers_y = projections.transform(x, y, 6514, {"wkid": None, "crs_wkt": albers_wkt})
+    back_x, back_y = projections.transform(albers_x, albers_y, {"wkid": 5070}, 6514)
+    np.testing.assert_allclose(back_x, x, atol=1e-5)
+    np.testing.assert_allclose(back_y, y, atol=1e-5)
+
+
+def test_wkt_reads_as_the_built_in_definition():
+    crs = projections.crsFromWKT(albers_wkt)
+    assert projections.definitionCode(crs) == 5070
+    assert projections.definitionCode(dict(crs, lon_0=-100.0)) is None
+
+
+def test_unsupported_wkt_is_rejected():
+    with pytest.raises(ValueError):
+        projections.crsFromWKT(albers_wkt.replace('PROJECTION["Albers"]', 'PROJECTION["Transverse_Mercator"]'))
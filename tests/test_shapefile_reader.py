@@ -0,0 +1,79 @@
+# About
+#############################################################################################################
+
+# Tests of shapefile_reader.py on small shapefiles written by conftest.writeShapefile: packed and unpacked point
+# records, null shapes, polygon centroids and .dbf columns.
+
+
+# Imports
+#############################################################################################################
+import numpy as np
+
+import shapefile_reader
+
+
+# Points
+#############################################################################################################
+def test_packed_points(writePoints):
+    path = writePoints([(1.5, 2.5), (3.0, 4.0), (-5.0, 6.25)])
+    x, y = shapefile_reader.readPoints(path)
+    np.testing.assert_array_equal(x, [1.5, 3.0, -5.0])
+    np.testing.assert_array_equal(y, [2.5, 4.0, 6.25])
+
+
+def test_null_shapes_are_dropped_with_their_record_index(writePoints):
+    path = writePoints([(1.0, 2.0), None, (3.0, 4.0), None])
+    x, y, records = shapefile_reader.readPoints(path, records=True)
+    np.testing.assert_array_equal(x, [1.0, 3.0])
+    np.testing.assert_array_equal(y, [2.0, 4.0])
+    np.testing.assert_array_equal(records, [0, 2])
+
+
+def test_read_point_coordinates_dispatches_on_shape_type(writePoints, writePolygons):
+    np.testing.assert_array_equal(shapefile_reader.readPointCoordinates(writePoints([(7.0, 8.0)]))[0], [7.0])
+    square = [[(0, 0), (0, 2), (2, 2), (2, 0), (0, 0)]]
+    x, y = shapefile_reader.readPointCoordinates(writePolygons([square]))
+    np.testing.assert_allclose([x[0], y[0]], [1.0, 1.0])
+
+
+# Polygons
+#############################################################################################################
+def test_centroids_weight_by_area_and_subtract_holes(writePolygons):
+    # shapefile outer rings are clockwise, holes counterclockwise
+    square = [(0, 0), (0, 4), (4, 4), (4, 0), (0, 0)]
+    hole = [(0, 0), (2, 0), (2, 2), (0, 2), (0, 0)]
+    rectangle = [(10, 10), (10, 11), (14, 11), (14, 10), (10, 10)]
+    x, y, records = shapefile_reader.readCentroids(writePolygons([[square, hole], None, [rectangle]]), records=True)
+    np.testing.assert_allclose(x, [7 / 3, 12.0])
+    np.testing.assert_allclose(y, [7 / 3, 10.5])
+    np.testing.assert_array_equal(records, [0, 2])
+
+
+# Attributes
+#############################################################################################################
+def test_dbf_columns(writePoints):
+    fields = {
+        "ID": ("N", 20, 0, [9007199254740993, 2, 3]),
+        "SCORE": ("N", 8, 2, [1.25, None, 3.5]),
+        "NAME": ("C", 12, 0, ["Kalispell", "Libby", ""]),
+    }
+    columns = shapefile_reader.readDBF(writePoints([(0, 0)] * 3, fields))
+    assert columns["ID"].dtype == np.int64 and columns["ID"][0] == 9007199254740993
+    np.testing.assert_array_equal(columns["SCORE"], [1.25, np.nan, 3.5])
+    assert list(columns["NAME"]) == ["Kalispell", "Libby", ""]
+
+
+def test_blank_integers_read_as_float_nan(writePoints):
+    columns = shapefile_reader.readDBF(writePoints([(0, 0)] * 2, {"ID": ("N", 10, 0, [1, None])}))
+    np.testing.assert_array_equal(columns["ID"], [1.0, np.nan])
+
+
+def test_deleted_records(writePoints):
+    path = writePoints([(0, 0)] * 3)
+    dbf = path[:-4] + ".dbf"
+    with open(dbf, "r+b") as f:
+        layout, dtype, header_length = shapefile_reader.dbfLayout(path)
+        f.seek(header_length + dtype.itemsize)
+        f.write(b"*")
+    np.testing.assert_array_equal(shapefile_reader.readDBF(path)["PID"], [0, 2])
+    np.testing.assert_array_equal(shapefile_reader.readDBF(path, deleted=True)["PID"], [0, 1, 2])
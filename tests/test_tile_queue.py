@@ -0,0 +1,60 @@
+# About
+#############################################################################################################
+
+# Tests of the work unit leases in tile_queue.py: units go to one worker at a time, expired leases are handed out
+# again, the worker that lost a unit cannot renew or finish it, and failures are retried up to max_attempts.
+
+
+# Imports
+#############################################################################################################
+import pytest
+
+import tile_queue
+
+
+@pytest.fixture
+def queue_db(tmp_path):
+    db_path = str(tmp_path / "queue.sqlite")
+    connection = tile_queue.connect(db_path)
+    for tile_col in range(3):
+        connection.execute("INSERT INTO units VALUES ('2020', 500, 0, ?, 'pending', NULL, NULL, 0, NULL)", (tile_col,))
+    connection.close()
+    return db_path
+
+
+# Tests
+#############################################################################################################
+def test_each_unit_is_claimed_once(queue_db):
+    connections = [tile_queue.connect(queue_db) for worker in range(2)]
+    claimed = [tile_queue.claimUnit(connections[index % 2], f"worker{index % 2}") for index in range(4)]
+    assert sorted(unit[3] for unit in claimed[:3]) == [0, 1, 2]
+    assert claimed[3] is None
+    assert tile_queue.queueStatus(queue_db) == {"leased": 3}
+
+
+def test_expired_lease_moves_to_another_worker(queue_db, monkeypatch):
+    connection = tile_queue.connect(queue_db)
+    connection.execute("DELETE FROM units WHERE tile_col > 0")
+    monkeypatch.setattr(tile_queue, "lease_seconds", -1)        # every lease has already expired
+    unit = tile_queue.claimUnit(connection, "slow")
+    assert tile_queue.claimUnit(connection, "fast") == unit
+    monkeypatch.setattr(tile_queue, "lease_seconds", 300)
+    assert not tile_queue.renewLease(connection, unit, "slow")
+    assert tile_queue.renewLease(connection, unit, "fast")
+    tile_queue.finishUnit(connection, unit, "slow")             # ignored, the unit is no longer slow's
+    assert tile_queue.queueStatus(queue_db)["leased"] == 1
+    tile_queue.finishUnit(connection, unit, "fast")
+    assert tile_queue.queueStatus(queue_db) == {"done": 1}
+
+
+def test_failures_are_retried_up_to_max_attempts(queue_db, monkeypatch):
+    monkeypatch.setattr(tile_queue, "max_attempts", 2)
+    connection = tile_queue.connect(queue_db)
+    connection.execute("DELETE FROM units WHERE tile_col > 0")
+    unit = tile_queue.claimUnit(connection, "worker")
+    tile_queue.finishUnit(connection, unit, "worker", error="read failed")
+    assert tile_queue.queueStatus(queue_db) == {"pending": 1}
+    assert tile_queue.claimUnit(connection, "worker") == unit
+    tile_queue.finishUnit(connection, unit, "worker", error="read failed again")
+    assert tile_queue.queueStatus(queue_db) == {"failed": 1}
+    assert tile_queue.claimUnit(connection, "worker") is None
@@ -0,0 +1,120 @@
+# About
+#############################################################################################################
+
+# Threshold sensitivity mode for the WUI classification.
+# The expensive parts of the pipeline (neighborhood house counts, wildland cover fractions, wildland patch labels
+# and the distance to large patches) are computed once per radius. Every combination of density, cover, large patch
+# area and patch buffer thresholds is then evaluated with cheap vectorized comparisons, so a 50 combination study
+# costs about as much as one run.
+# The 5000 m^2 small patch threshold only feeds the wildlandAreas raster, which calcWUI does not use, so it has no
+# effect on the WUI classes and is not swept.
+
+
+# Imports
+#############################################################################################################
+import os
+import csv
+import itertools
+
+import numpy as np
+
+import moving_window as mw
+import raster_io
+
+
+# Settings
+#############################################################################################################
+from wui_settings import address_points, nlcd_projected_clipped, space
+sensitivity_output = space + "\\analysis\\sensitivity\\"
+
+# swept values (radii, density_thresholds, cover_thresholds, large_patch_areas, patch_buffer_distances) are in wui_settings.py
+from wui_settings import radii, density_thresholds, cover_thresholds, large_patch_areas, patch_buffer_distances
+
+
+# Precomputation
+#############################################################################################################
+# Everything that does not depend on the thresholds, computed once
+def prepareInputs(nlcd, x, y, grid, radii, large_areas, nodata=0):
+    cell_size = grid["cell_size"]
+    wildveg = mw.wildlandBaseRaster(nlcd)
+    valid = mw.validMask(nlcd, nodata)
+    labels, areas = mw.labelWildlandPatches(wildveg, cell_size)
+    prepared = {
+        "buildable": (mw.waterRaster(nlcd) == 1) & valid,
+        "density": {},
+        "cover": {},
+        "patch_distance": {area: mw.distanceToLargePatches(labels, areas, cell_size, area).astype(np.float32) for area in large_areas},
+    }
+    del labels
+    for radius in radii:
+        nbr_houses = mw.makeNeighborhoods(x, y, grid, radius)
+        prepared["density"][radius] = (nbr_houses / (3.14 * float(radius) * float(radius)) * 1000000).astype(np.float32)
+        prepared["cover"][radius] = mw.wildlandCoverFraction(wildveg, valid, radius, cell_size).astype(np.float32)
+        print(f"Sensitivity: neighborhood counts at {radius}m completed.")
+    return prepared
+
+
+# Evaluation
+#############################################################################################################
+def thresholdGrid(radii, densities, covers, large_areas, buffers):
+    return [dict(zip(["radius", "density", "cover", "large_patch_area", "patch_buffer"], combination))
+            for combination in itertools.product(radii, densities, covers, large_areas, buffers)]
+
+
+def classifyThresholds(prepared, thresholds):
+    dense = (prepared["density"][thresholds["radius"]] > thresholds["density"]) & prepared["buildable"]
+    wildcover = prepared["cover"][thresholds["radius"]] > thresholds["cover"]
+    patch_buffer = prepared["patch_distance"][thresholds["large_patch_area"]] <= thresholds["patch_buffer"]
+    return np.where(dense & wildcover, 1, np.where(dense & patch_buffer, 2, 0)).astype(np.uint8)
+
+
+# Evaluate every threshold combination and return one row per combination (and zone, if zones are given) with WUI areas
+def runSensitivity(prepared, combinations, cell_size, zones=None, raster_grid=None, raster_folder=None):
+    rows = []
+    for index, thresholds in enumerate(combinations):
+        wui = classifyThresholds(prepared, thresholds)
+        if zones is None:
+            areas = mw.tabulateArea(np.zeros(wui.shape, dtype=np.int32), wui, cell_size, 1)
+        else:
+            areas = mw.tabulateArea(zones, wui, cell_size)
+        for zone in range(areas.shape[0]):
+            if zones is not None and (zone == 0 or areas[zone].sum() == 0):
+                continue
+            rows.append(dict(thresholds, combination=index, zone=zone, intermix_m2=float(areas[zone, 1]), interface_m2=float(areas[zone, 2])))
+        if raster_folder is not None:
+            raster_io.saveArray(wui, raster_grid, os.path.join(raster_folder, f"wui_{index}.tif"), nodata=0)
+    return rows
+
+
+def writeSensitivityTable(rows, out_csv):
+    folder = os.path.dirname(out_csv)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    fields = ["combination", "radius", "density", "cover", "large_patch_area", "patch_buffer", "zone", "intermix_m2", "interface_m2"]
+    with open(out_csv, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Sensitivity table written to {out_csv}.")
+
+
+# Main
+#############################################################################################################
+if __name__ == "__main__":
+    map_name = "2020"
+    save_rasters = False                                        # Set to True to also save one WUI raster per combination
+
+    curr_nlcd = nlcd_projected_clipped + "nlcd_" + map_name + "_pc.tif"
+    grid = raster_io.rasterGrid(curr_nlcd)
+    nlcd = raster_io.readRaster(curr_nlcd, grid, nodata=0, dtype=np.uint8)
+    x, y = raster_io.readPointCoordinates(address_points + map_name + "_address_points.shp")
+
+    prepared = prepareInputs(nlcd, x, y, grid, radii, large_patch_areas)
+    del nlcd
+    combinations = thresholdGrid(radii, density_thresholds, cover_thresholds, large_patch_areas, patch_buffer_distances)
+    print(f"Sensitivity: evaluating {len(combinations)} threshold combinations.")
+    rows = runSensitivity(
+        prepared, combinations, grid["cell_size"],
+        raster_grid=grid, raster_folder=sensitivity_output + map_name + "\\" if save_rasters else None
+    )
+    writeSensitivityTable(rows, sensitivity_output + "sensitivity_" + map_name + ".csv")
@@ -0,0 +1,237 @@
+# About
+#############################################################################################################
+
+# Work queue that spreads tiled WUI runs over any number of worker processes and hosts.
+# A coordinator writes one work unit per (year, radius, tile) into a SQLite file on a shared filesystem. Workers
+# claim units with a lease inside an immediate transaction, renew the lease from a heartbeat thread while they
+# compute, and write each finished tile as a .npy file next to the queue. Units whose lease ran out (a worker died or
+# lost its connection) are claimed again, up to max_attempts times. Once every unit is done, assemble stitches the
+# tiles of each year and radius into one GeoTIFF. Several workers on one machine exercise the same code paths.
+# SQLite locking needs a filesystem with working POSIX/SMB locks; on NFS without them keep the queue on local disk
+# and only the tiles on the shared one.
+
+
+# Imports
+#############################################################################################################
+import os
+import time
+import socket
+import sqlite3
+import threading
+import traceback
+
+import numpy as np
+
+import preview_WUI
+import raster_io
+
+
+# Settings
+#############################################################################################################
+from wui_settings import address_points, nlcd_projected_clipped, queue_dir, queue_output
+
+tile_size = 2048                                                # cells per tile side, not counting the halo
+lease_seconds = 300                                             # a unit is handed out again if its lease is not renewed in time
+heartbeat_seconds = 60                                          # how often a worker renews the lease of the unit it is computing
+max_attempts = 3                                                # attempts before a unit is marked failed
+
+
+# Queue
+#############################################################################################################
+def connect(db_path):
+    connection = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS units (year TEXT, radius INTEGER, tile_row INTEGER, tile_col INTEGER, status TEXT, "
+        "worker TEXT, lease_expires REAL, attempts INTEGER, error TEXT, PRIMARY KEY (year, radius, tile_row, tile_col))"
+    )
+    return connection
+
+
+def yearInputs(year):
+    return nlcd_projected_clipped + "nlcd_" + str(year) + "_pc.tif", address_points + str(year) + "_address_points.shp"
+
+
+# Coordinator: one pending unit per tile of every year and radius (units already in the queue are kept as they are)
+def createQueue(db_path, years, radii):
+    connection = connect(db_path)
+    added = 0
+    for year in years:
+        grid = raster_io.rasterGrid(yearInputs(year)[0])
+        for radius in radii:
+            for row, col, nrows, ncols in raster_io.iterBlocks(grid["rows"], grid["cols"], tile_size):
+                cursor = connection.execute(
+                    "INSERT OR IGNORE INTO units VALUES (?, ?, ?, ?, 'pending', NULL, NULL, 0, NULL)",
+                    (str(year), int(radius), row // tile_size, col // tile_size)
+                )
+                added += cursor.rowcount
+    connection.close()
+    print(f"Queue: {added} work units added to {db_path}.")
+    return added
+
+
+# Claim the next pending unit or one whose lease expired; None when nothing is left to claim
+def claimUnit(connection, worker):
+    now = time.time()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        unit = connection.execute(
+            "SELECT year, radius, tile_row, tile_col FROM units WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?)) "
+            "AND attempts < ? ORDER BY attempts, year, radius, tile_row, tile_col LIMIT 1", (now, max_attempts)
+        ).fetchone()
+        if unit is not None:
+            connection.execute(
+                "UPDATE units SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE year = ? AND radius = ? AND tile_row = ? AND tile_col = ?", (worker, now + lease_seconds) + tuple(unit)
+            )
+        # leased units that used up their attempts will not be handed out again
+        connection.execute("UPDATE units SET status = 'failed' WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?", (now, max_attempts))
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    return unit
+
+
+# Renew the lease, returning False if another worker has taken the unit over in the meantime
+def renewLease(connection, unit, worker):
+    cursor = connection.execute(
+        "UPDATE units SET lease_expires = ? WHERE year = ? AND radius = ? AND tile_row = ? AND tile_col = ? AND worker = ? AND status = 'leased'",
+        (time.time() + lease_seconds,) + tuple(unit) + (worker,)
+    )
+    return cursor.rowcount == 1
+
+
+def finishUnit(connection, unit, worker, error=None):
+    if error is None:
+        status = "done"
+    else:
+        attempts = connection.execute("SELECT attempts FROM units WHERE year = ? AND radius = ? AND tile_row = ? AND tile_col = ?", unit).fetchone()[0]
+        status = "failed" if attempts >= max_attempts else "pending"
+    connection.execute(
+        "UPDATE units SET status = ?, lease_expires = NULL, error = ? WHERE year = ? AND radius = ? AND tile_row = ? AND tile_col = ? AND worker = ?",
+        (status, error) + tuple(unit) + (worker,)
+    )
+
+
+def queueStatus(db_path):
+    connection = connect(db_path)
+    counts = dict(connection.execute("SELECT status, COUNT(*) FROM units GROUP BY status").fetchall())
+    connection.close()
+    return counts
+
+
+# Worker
+#############################################################################################################
+def tileFile(tile_dir, unit):
+    year, radius, tile_row, tile_col = unit
+    return os.path.join(tile_dir, f"{year}_{radius}", f"{tile_row}_{tile_col}.npy")
+
+
+class Heartbeat(threading.Thread):
+    def __init__(self, db_path, unit, worker):
+        super().__init__(daemon=True)
+        self.db_path, self.unit, self.worker = db_path, unit, worker
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        connection = connect(self.db_path)
+        while not self.stopped.wait(heartbeat_seconds):
+            if not renewLease(connection, self.unit, self.worker):
+                self.lost = True
+                break
+        connection.close()
+
+
+# Claim and compute units until the queue is empty; returns the number of units this worker completed
+def runWorker(db_path, tile_dir=queue_output, worker=None):
+    worker = f"{socket.gethostname()}:{os.getpid()}" if worker is None else worker
+    connection = connect(db_path)
+    inputs = {}                                                 # grid, points and coarse level of each year this worker has seen
+    completed = 0
+    while True:
+        unit = claimUnit(connection, worker)
+        if unit is None:
+            break
+        year, radius, tile_row, tile_col = unit
+        heartbeat = Heartbeat(db_path, unit, worker)
+        heartbeat.start()
+        try:
+            if year not in inputs:
+                curr_nlcd, curr_address_points = yearInputs(year)
+                grid = raster_io.rasterGrid(curr_nlcd)
+                x, y = raster_io.readPointCoordinates(curr_address_points)
+                factor = preview_WUI.previewFactor(grid["cell_size"])
+                inputs[year] = (curr_nlcd, grid, x, y, preview_WUI.buildPyramid(curr_nlcd, [factor])[factor])
+            curr_nlcd, grid, x, y, coarse_level = inputs[year]
+            wui, tile_grid = preview_WUI.refineTile(curr_nlcd, grid, x, y, radius, tile_row, tile_col, coarse_level, tile_size)
+            # tiles at the right and bottom edges are cut back to the raster
+            wui = wui[:min(tile_size, grid["rows"] - tile_row * tile_size), :min(tile_size, grid["cols"] - tile_col * tile_size)]
+            out_file = tileFile(tile_dir, unit)
+            if not os.path.exists(os.path.dirname(out_file)):
+                os.makedirs(os.path.dirname(out_file), exist_ok=True)
+            partial = out_file + f".{os.getpid()}.partial"
+            with open(partial, "wb") as f:
+                np.save(f, wui)
+            os.replace(partial, out_file)                       # readers never see a half written tile
+            error = None
+        except Exception:
+            error = traceback.format_exc()
+        finally:
+            heartbeat.stopped.set()
+            heartbeat.join()
+        if heartbeat.lost:
+            print(f"Worker {worker}: lease of {unit} was lost, leaving it to the worker that took it over.")
+            continue
+        finishUnit(connection, unit, worker, error)
+        if error is None:
+            completed += 1
+            print(f"Worker {worker}: tile {tile_row}, {tile_col} of {year} at {radius}m completed.")
+        else:
+            print(f"Worker {worker}: tile {tile_row}, {tile_col} of {year} at {radius}m failed:\n{error}")
+    connection.close()
+    print(f"Worker {worker}: queue is empty, {completed} units completed.")
+    return completed
+
+
+# Assembly
+#############################################################################################################
+# Stitch the tiles of every year and radius whose units are all done into {year}_{radius}.tif
+def assemble(db_path, tile_dir=queue_output, out_dir=queue_output):
+    connection = connect(db_path)
+    groups = connection.execute(
+        "SELECT year, radius, COUNT(*), SUM(status = 'done') FROM units GROUP BY year, radius ORDER BY year, radius"
+    ).fetchall()
+    connection.close()
+    assembled = []
+    for year, radius, total, done in groups:
+        if done < total:
+            print(f"Assemble: {year} at {radius}m has {total - done} of {total} tiles outstanding, skipping.")
+            continue
+        grid = raster_io.rasterGrid(yearInputs(year)[0])
+        out_path = os.path.join(out_dir, f"{year}_{radius}.tif")
+        with raster_io.BlockWriter(out_path, grid, np.uint8, nodata=0) as writer:
+            for row, col, nrows, ncols in raster_io.iterBlocks(grid["rows"], grid["cols"], tile_size):
+                writer.write(row, col, np.load(tileFile(tile_dir, (year, radius, row // tile_size, col // tile_size))))
+        assembled.append(out_path)
+        print(f"Assemble: {out_path} written.")
+    return assembled
+
+
+# Main
+#############################################################################################################
+if __name__ == "__main__":
+    import sys
+
+    db_path = queue_dir + "queue.sqlite"
+    mode = sys.argv[1] if len(sys.argv) > 1 else "work"         # "init", "work", "assemble" or "status"
+
+    if mode == "init":
+        if not os.path.exists(queue_dir):
+            os.makedirs(queue_dir)
+        createQueue(db_path, range(2012, 2025), [500])
+    elif mode == "work":
+        runWorker(db_path)
+    elif mode == "assemble":
+        assemble(db_path)
+    print(queueStatus(db_path))
@@ -0,0 +1,152 @@
+# About
+#############################################################################################################
+
+# Tiled WUI run with reading, classification and writing overlapped.
+# A reader thread reads the NLCD window of the next tile (with the halo preview_WUI.tileHalo asks for) and builds its
+# house count grid while the main thread classifies the current tile, and a writer thread drains finished tiles into the
+# output raster through raster_io.BlockWriter; arcpy is not thread safe, so the reads and writes take turns on
+# raster_io.arcpy_lock while classification runs alongside both. Up to `workers` tiles are classified at once on a
+# thread pool (the FFT, labeling and distance transforms release the GIL). The queues between them hold at most
+# `prefetch` tiles, so the tile arrays in memory are bounded by (2 * prefetch + workers) halo windows whatever the
+# raster size, and disk waits on the reader overlap with compute instead of adding to it. The address points (x and y,
+# or the cached points near each tile with a point_cache.PointCache) and the coarse pyramid level are held whole, and
+# BlockWriter's output raster is kept by arcpy, which pages it to disk.
+
+
+# Imports
+#############################################################################################################
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+import moving_window as mw
+import preview_WUI
+import raster_io
+
+
+# Settings
+#############################################################################################################
+from wui_settings import address_points, nlcd_projected_clipped, output
+tiled_output = output + "tiled\\"
+
+tile_size = 2048                                                # cells per tile side, not counting the halo
+prefetch = 2                                                    # tiles buffered between each pair of threads
+workers = 1                                                     # tiles classified at once
+
+
+# Threads
+#############################################################################################################
+# Put every item of a generator on a queue followed by None, or the exception that stopped it
+def produce(items, out_queue):
+    try:
+        for item in items:
+            out_queue.put(item)
+        out_queue.put(None)
+    except BaseException as e:
+        out_queue.put(e)
+
+
+# NLCD window and house counts of every tile; with a point_cache.PointCache only the points near the tile are read
+def readTiles(curr_nlcd, grid, x, y, halo, tile_size, nodata=0, points=None):
+    for row, col, nrows, ncols in raster_io.iterBlocks(grid["rows"], grid["cols"], tile_size):
+        window = raster_io.windowGrid(grid, row - halo, col - halo, nrows + 2 * halo, ncols + 2 * halo)
+        with raster_io.arcpy_lock:
+            nlcd = raster_io.readWindow(curr_nlcd, grid, row - halo, col - halo, window["rows"], window["cols"], nodata=nodata, dtype=np.uint8)
+        yield row, col, nlcd, mw.houseCounts(*(points.within(window) if points is not None else (x, y)), window)
+
+
+# Write tiles until None arrives; after a failure keep draining the queue so the compute thread never blocks on it
+def writeTiles(writer, in_queue, errors):
+    while True:
+        item = in_queue.get()
+        if item is None:
+            return
+        if errors:
+            continue
+        try:
+            with raster_io.arcpy_lock:
+                writer.write(*item)
+        except BaseException as e:
+            errors.append(e)
+
+
+# Run
+#############################################################################################################
+# Classify curr_nlcd tile by tile into out_path; returns seconds spent computing and waiting on the reader and writer.
+# The address points are x and y, or a point_cache.PointCache passed as points (x and y are then None). tile_size,
+# workers and the disc sum method default to the settings above and mw.disc_sum_method; run_planner.tiledArguments
+# turns a run_planner.planRun plan for the grid and point count into these arguments.
+def runTiled(curr_nlcd, x, y, radius, out_path, coarse_level=None, nodata=0, points=None, tile_size=tile_size, workers=workers, method=None):
+    grid = raster_io.rasterGrid(curr_nlcd)
+    cell_size = grid["cell_size"]
+    halo = preview_WUI.tileHalo(radius, cell_size)
+    if coarse_level is None:
+        factor = preview_WUI.previewFactor(cell_size)
+        coarse_level = preview_WUI.buildPyramid(curr_nlcd, [factor])[factor]
+    tile_count = -(-grid["rows"] // tile_size) * -(-grid["cols"] // tile_size)
+
+    read_queue = queue.Queue(maxsize=prefetch)
+    write_queue = queue.Queue(maxsize=prefetch)
+    write_errors = []
+    timing = {"compute_s": 0.0, "read_wait_s": 0.0, "write_wait_s": 0.0}
+    with raster_io.BlockWriter(out_path, grid, np.uint8, nodata=0) as writer:
+        reader = threading.Thread(target=produce, args=(readTiles(curr_nlcd, grid, x, y, halo, tile_size, nodata, points), read_queue), daemon=True)
+        drain = threading.Thread(target=writeTiles, args=(writer, write_queue, write_errors), daemon=True)
+        reader.start()
+        drain.start()
+        done = 0
+        pending = set()
+
+        def finish(futures):
+            nonlocal done
+            for future in futures:
+                row, col, wui = future.result()
+                start = time.perf_counter()
+                write_queue.put((row, col, wui))
+                timing["write_wait_s"] += time.perf_counter() - start
+                done += 1
+                print(f"Tiled: tile {done} of {tile_count} classified.")
+            if write_errors:
+                raise write_errors[0]
+
+        def classify(row, col, nlcd, houses):
+            return row, col, preview_WUI.classifyWindow(nlcd, houses, cell_size, row - halo, col - halo, halo, radius, coarse_level, nodata, method)
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                started = time.perf_counter()
+                while True:
+                    start = time.perf_counter()
+                    item = read_queue.get()
+                    timing["read_wait_s"] += time.perf_counter() - start
+                    if item is None:
+                        break
+                    if isinstance(item, BaseException):
+                        raise item
+                    pending.add(pool.submit(classify, *item))
+                    if len(pending) >= workers:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        finish(finished)
+                finish(wait(pending)[0])
+                timing["compute_s"] = time.perf_counter() - started - timing["read_wait_s"] - timing["write_wait_s"]
+        finally:
+            write_queue.put(None)
+            drain.join()
+        if write_errors:
+            raise write_errors[0]
+    print(f"Tiled: {out_path} written, {timing['compute_s']:.1f}s computing, {timing['read_wait_s']:.1f}s waiting on reads.")
+    return timing
+
+
+# Main
+#############################################################################################################
+if __name__ == "__main__":
+    map_name = "2020"
+    curr_buffer = 500
+
+    curr_nlcd = nlcd_projected_clipped + "nlcd_" + map_name + "_pc.tif"
+    x, y = raster_io.readPointCoordinates(address_points + map_name + "_address_points.shp")
+    runTiled(curr_nlcd, x, y, curr_buffer, tiled_output + map_name + ".tif")
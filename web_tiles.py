@@ -0,0 +1,226 @@
+# About
+#############################################################################################################
+
+# Export of the yearly WUI maps as slippy map tile pyramids for the web map, one MBTiles file per year.
+# Each {year}.tif is warped to Web Mercator at the pixel size of max_zoom, snapped onto the global tile pixel grid,
+# and read into NumPy. The warp is kept next to a JSON file holding the stamp (pipeline_dag.datasetStamp) of the map it
+# came from and is redone when the map or max_zoom changes. Every lower zoom is the 2x2 mode of the one above it (ties go to the higher class, so thin
+# interface strips survive), computed in row strips on a thread pool, and the tiles of a level are PNG encoded on the
+# same pool while the next level is downsampled. Tiles are 8-bit palette PNGs (non-WUI is transparent), written with
+# zlib directly, and tiles with no WUI cells are not written at all; web maps show nothing for missing tiles.
+# MBTiles 1.3: https://github.com/mapbox/mbtiles-spec/blob/master/1.3/spec.md
+
+
+# Imports
+#############################################################################################################
+import os
+import json
+import math
+import time
+import zlib
+import struct
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import raster_io
+from pipeline_dag import datasetStamp
+
+
+# Settings
+#############################################################################################################
+from wui_settings import output, temp
+web_tiles_output = output + "web_tiles\\"
+mercator_temp = temp + "web_tiles\\"
+
+min_zoom = 5
+max_zoom = 12                                                   # 38m pixels at the equator, ~26m on the ground in Montana
+tile_pixels = 256
+workers = 4                                                     # threads downsampling strips and encoding tiles
+strip_tiles = 8                                                 # tile rows per downsampling strip
+palette = {                                                     # class -> (red, green, blue, alpha)
+    0: (0, 0, 0, 0),                                            # non-WUI, transparent
+    1: (230, 85, 13, 255),                                      # intermix
+    2: (253, 174, 107, 255),                                    # interface
+}
+origin_shift = 20037508.342789244                               # half the width of the Web Mercator world in m
+
+
+# Web Mercator
+#############################################################################################################
+def pixelSize(zoom):
+    return 2 * origin_shift / (tile_pixels * 2 ** zoom)
+
+
+# Warp a WUI raster onto the Web Mercator pixel grid of max_zoom (nearest neighbour keeps the class codes), reusing
+# an earlier warp only if it was made from the same version of the raster at the same zoom
+def projectToMercator(wui_path, out_path):
+    import arcpy
+
+    stamp_file = os.path.splitext(out_path)[0] + ".json"
+    key = {"source": datasetStamp(wui_path), "max_zoom": max_zoom}
+    if arcpy.Exists(out_path) and os.path.exists(stamp_file):
+        with open(stamp_file) as f:
+            if json.load(f) == key:
+                return out_path
+    if not os.path.exists(os.path.dirname(out_path)):
+        os.makedirs(os.path.dirname(out_path))
+    if os.path.exists(stamp_file):
+        os.remove(stamp_file)
+    if arcpy.Exists(out_path):
+        arcpy.management.Delete(out_path)
+    size = pixelSize(max_zoom)
+    arcpy.management.ProjectRaster(
+        in_raster=wui_path,
+        out_raster=out_path,
+        out_coor_system=arcpy.SpatialReference(3857),
+        resampling_type="NEAREST",
+        cell_size=f"{size} {size}",
+        Registration_Point=f"{-origin_shift} {origin_shift}"
+    )
+    with open(stamp_file, "w") as f:
+        json.dump(key, f)
+    return out_path
+
+
+# Place an array on a canvas of whole tiles of max_zoom; returns the canvas and the tile column and row of its corner
+def tileCanvas(array, grid):
+    size = pixelSize(max_zoom)
+    px = int(round((grid["x_min"] + origin_shift) / size))
+    py = int(round((origin_shift - grid["y_max"]) / size))
+    tx, ty = px // tile_pixels, py // tile_pixels
+    rows = -(-(py + array.shape[0]) // tile_pixels) - ty
+    cols = -(-(px + array.shape[1]) // tile_pixels) - tx
+    canvas = np.zeros((rows * tile_pixels, cols * tile_pixels), dtype=np.uint8)
+    top, left = py - ty * tile_pixels, px - tx * tile_pixels
+    canvas[top:top + array.shape[0], left:left + array.shape[1]] = array
+    return canvas, tx, ty
+
+
+# Downsampling
+#############################################################################################################
+# 2x2 mode of a strip whose height and width are even; ties go to the higher class
+def modeStrip(strip):
+    blocks = strip.reshape(strip.shape[0] // 2, 2, strip.shape[1] // 2, 2)
+    best = np.zeros((strip.shape[0] // 2, strip.shape[1] // 2), dtype=np.uint8)
+    best_count = np.zeros(best.shape, dtype=np.uint8)
+    for value in sorted(palette):
+        count = (blocks == value).sum(axis=(1, 3), dtype=np.uint8)
+        better = count >= best_count
+        best[better] = value
+        best_count[better] = count[better]
+    return best
+
+
+# Canvas of the next zoom level out: pad to an even tile corner and tile count, then take the 2x2 mode strip by strip
+def downsample(canvas, tx, ty, pool):
+    left, top = (tx % 2) * tile_pixels, (ty % 2) * tile_pixels
+    cols = -(-(left + canvas.shape[1]) // (2 * tile_pixels)) * 2 * tile_pixels
+    rows = -(-(top + canvas.shape[0]) // (2 * tile_pixels)) * 2 * tile_pixels
+    if (left, top, cols, rows) != (0, 0, canvas.shape[1], canvas.shape[0]):
+        padded = np.zeros((rows, cols), dtype=np.uint8)
+        padded[top:top + canvas.shape[0], left:left + canvas.shape[1]] = canvas
+        canvas = padded
+    step = 2 * tile_pixels * strip_tiles
+    strips = pool.map(modeStrip, [canvas[row:row + step] for row in range(0, canvas.shape[0], step)])
+    return np.vstack(list(strips)), tx // 2, ty // 2
+
+
+# Tiles
+#############################################################################################################
+def pngChunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+
+# 8-bit palette PNG of a tile of class codes
+def encodePNG(tile):
+    height, width = tile.shape
+    values = range(max(palette) + 1)
+    plte = b"".join(bytes(palette.get(value, (0, 0, 0, 0))[:3]) for value in values)
+    trns = bytes(palette.get(value, (0, 0, 0, 0))[3] for value in values)
+    scanlines = np.zeros((height, width + 1), dtype=np.uint8)     # filter type 0 (none) in front of every row
+    scanlines[:, 1:] = tile
+    return (b"\x89PNG\r\n\x1a\n"
+            + pngChunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0))
+            + pngChunk(b"PLTE", plte) + pngChunk(b"tRNS", trns)
+            + pngChunk(b"IDAT", zlib.compress(scanlines.tobytes(), 6)) + pngChunk(b"IEND", b""))
+
+
+# (column, row, png) of every tile of a canvas that holds any WUI cells
+def encodeTiles(canvas, tx, ty):
+    occupied = canvas.reshape(canvas.shape[0] // tile_pixels, tile_pixels, canvas.shape[1] // tile_pixels, tile_pixels).any(axis=(1, 3))
+    tiles = []
+    for row, col in zip(*np.nonzero(occupied)):
+        tile = canvas[row * tile_pixels:(row + 1) * tile_pixels, col * tile_pixels:(col + 1) * tile_pixels]
+        tiles.append((tx + int(col), ty + int(row), encodePNG(tile)))
+    return tiles
+
+
+# MBTiles
+#############################################################################################################
+def createMBTiles(path, name, canvas, tx, ty):
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+    connection.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)")
+    connection.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+
+    # bounds in degrees from the tile corners of the max_zoom canvas
+    size = pixelSize(max_zoom)
+    west, north = tx * tile_pixels * size - origin_shift, origin_shift - ty * tile_pixels * size
+    east, south = west + canvas.shape[1] * size, north - canvas.shape[0] * size
+    lon = lambda x: x / origin_shift * 180
+    lat = lambda y: math.degrees(2 * math.atan(math.exp(y / origin_shift * math.pi)) - math.pi / 2)
+    metadata = {
+        "name": name, "format": "png", "type": "overlay", "version": "1",
+        "minzoom": str(min_zoom), "maxzoom": str(max_zoom),
+        "bounds": f"{lon(west):.6f},{lat(south):.6f},{lon(east):.6f},{lat(north):.6f}",
+        "description": "WUI classes: 1 intermix, 2 interface; non-WUI cells are transparent",
+    }
+    connection.executemany("INSERT INTO metadata VALUES (?, ?)", metadata.items())
+    return connection
+
+
+# Export
+#############################################################################################################
+# Tile pyramid of one WUI raster; returns the number of tiles written
+def exportTiles(wui_path, out_path, name=None):
+    start = time.perf_counter()
+    mercator = projectToMercator(wui_path, mercator_temp + os.path.splitext(os.path.basename(wui_path))[0] + "_3857.tif")
+    grid = raster_io.rasterGrid(mercator)
+    canvas, tx, ty = tileCanvas(raster_io.readRaster(mercator, grid, nodata=0, dtype=np.uint8), grid)
+    connection = createMBTiles(out_path, name or os.path.basename(os.path.splitext(wui_path)[0]), canvas, tx, ty)
+
+    written = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for zoom in range(max_zoom, min_zoom - 1, -1):
+            # encode this level's tiles in strips while the main thread downsamples the next level
+            step = tile_pixels * strip_tiles
+            encoding = [pool.submit(encodeTiles, canvas[row:row + step], tx, ty + row // tile_pixels) for row in range(0, canvas.shape[0], step)]
+            next_level = downsample(canvas, tx, ty, pool) if zoom > min_zoom else None
+            for future in encoding:
+                tiles = future.result()
+                # MBTiles rows count from the south (TMS)
+                connection.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", [(zoom, col, 2 ** zoom - 1 - row, png) for col, row, png in tiles])
+                written += len(tiles)
+            connection.commit()
+            if next_level is not None:
+                canvas, tx, ty = next_level
+    connection.close()
+    print(f"Web tiles: {written} tiles of {wui_path} written to {out_path} in {time.perf_counter() - start:.0f}s.")
+    return written
+
+
+def exportYears(years):
+    if not os.path.exists(web_tiles_output):
+        os.makedirs(web_tiles_output)
+    for year in years:
+        exportTiles(output + str(year) + ".tif", web_tiles_output + str(year) + ".mbtiles", f"Montana WUI {year}")
+
+
+# Main
+#############################################################################################################
+if __name__ == "__main__":
+    exportYears(range(2012, 2025))
@@ -0,0 +1,295 @@
+# About
+#############################################################################################################
+
+# Command line entry point for the WUI workflows.
+# Only argparse and wui_settings are imported at startup; each subcommand imports its backend (arcpy, NumPy, SciPy)
+# when it runs, so --help and --dry-run return immediately and never check out a Spatial Analyst license.
+#
+#   python wui_cli.py run 2020 2021 --buffer 500 [--fresh] [--native]       WUI maps with generate_WUI_maps.createMaps
+#   python wui_cli.py sweep 2020                                            threshold sensitivity (threshold_sensitivity.py)
+#   python wui_cli.py aggregate 2012-2024                                   county WUI areas (county_aggregation.py)
+#   python wui_cli.py yoy 2013-2024 [--mode wide|per_year]                  year over year county maps (generate_YOY_maps.py)
+#   python wui_cli.py lookup points.shp 2012-2024 --out lookup.csv          per point WUI classes (point_lookup.py)
+#   python wui_cli.py tiles 2012-2024                                       MBTiles web tile pyramids (web_tiles.py)
+#   python wui_cli.py ingest 2012-2024 [--file points.csv]                   columnar point caches (point_cache.py)
+#   python wui_cli.py queue init|work|assemble|status [2012-2024] [--db q]   tiled runs over many workers (tile_queue.py)
+#
+# Every subcommand takes --dry-run, which checks that the inputs exist and prints what would run without running it.
+
+
+# Imports
+#############################################################################################################
+import os
+import sys
+import argparse
+
+import wui_settings as settings
+
+
+# Arguments
+#############################################################################################################
+# Years from "2012-2024" ranges and single years
+def parseYears(values):
+    years = []
+    for value in values:
+        if "-" in value and not value.startswith("-"):
+            first, last = value.split("-")
+            years.extend(range(int(first), int(last) + 1))
+        else:
+            years.append(int(value))
+    return years
+
+
+# Print a plan and the inputs it needs; returns False if any input is missing
+def reportPlan(title, steps, inputs):
+    print(title)
+    for step in steps:
+        print(f"\t{step}")
+    missing = [path for path in inputs if not os.path.exists(path)]
+    for path in missing:
+        print(f"\tMISSING: {path}")
+    print(f"\t{len(inputs) - len(missing)} of {len(inputs)} inputs found.")
+    return not missing
+
+
+# Subcommands
+#############################################################################################################
+def runCommand(args):
+    maps = [str(year) for year in parseYears(args.years)] + args.maps
+    if args.dry_run:
+        steps, inputs = [], []
+        for map_name in maps:
+            curr_address_points, curr_unclipped_nlcd, curr_nlcd, curr_study_area = settings.mapInputs(map_name)
+            source = curr_unclipped_nlcd if curr_unclipped_nlcd is not None else curr_nlcd
+            if args.native and settings.nativeNLCD(map_name) is not None:
+                source = settings.nativeNLCD(map_name)
+            inputs += [curr_address_points, source, curr_study_area]
+            steps.append(f"{map_name}: {os.path.basename(source)} + {os.path.basename(curr_address_points)} at {args.buffer}m"
+                         + (" (window of map " + settings.sub_regions[map_name]["parent"] + " if its intermediates exist)" if map_name in settings.sub_regions else ""))
+            steps += planSteps(curr_nlcd if os.path.exists(curr_nlcd) and source != settings.nativeNLCD(map_name) else source, curr_address_points, args.buffer)
+        return reportPlan(f"Would create {len(maps)} map(s) with {args.workers} worker(s):", steps, sorted(set(inputs)))
+
+    import generate_WUI_maps
+    from stage_trace import StageTrace
+    from datetime import datetime
+
+    trace = StageTrace(settings.traces + "wui_trace_" + datetime.now().strftime("%Y%m%d_%H%M%S") + ".csv")
+    failed = []
+    for map_name in maps:
+        try:
+            generate_WUI_maps.createMaps(map_name, args.buffer, trace, fresh=args.fresh, workers=args.workers, native=args.native or None)
+        except Exception as e:
+            print(f"An error occurred while creating {map_name} at {args.buffer}m buffer distance: {e}")
+            failed.append(map_name)
+    return not failed
+
+
+# Estimated cost of a map from its cataloged metadata, if the catalog already describes its inputs
+def planSteps(curr_nlcd, curr_address_points, buffer):
+    if not os.path.exists(settings.catalog_file):
+        return []
+    from input_catalog import InputCatalog
+
+    catalog = InputCatalog(settings.catalog_file)
+    nlcd, points = catalog.cached(curr_nlcd), catalog.cached(curr_address_points)
+    catalog.close()
+    if nlcd is None or points is None or not nlcd["rows"]:
+        return ["\t(not cataloged yet, no estimate)"]
+    import run_planner
+    import moving_window as mw
+
+    grid = mw.makeGrid(nlcd["x_min"], nlcd["y_max"], nlcd["cell_size"], nlcd["rows"], nlcd["cols"])
+    plan = run_planner.planRun(grid, int(points["feature_count"] or 0), buffer)
+    return [f"\t{grid['rows']}x{grid['cols']} cells, {points['feature_count']} points: {plan['method']} disc sums, "
+            f"{plan['tiles']} tiles of {plan['tile_size']}, {plan['workers']} workers, ~{plan['seconds']:.0f}s, {plan['peak_gb']:.1f} GB"]
+
+
+def sweepCommand(args):
+    curr_nlcd = settings.nlcd_projected_clipped + "nlcd_" + args.map + "_pc.tif"
+    curr_address_points = settings.address_points + args.map + "_address_points.shp"
+    sizes = [settings.radii, settings.density_thresholds, settings.cover_thresholds, settings.large_patch_areas, settings.patch_buffer_distances]
+    if args.dry_run:
+        count = 1
+        for values in sizes:
+            count *= len(values)
+        steps = [f"radii {settings.radii}, {count} threshold combinations",
+                 f"table: {settings.space}\\analysis\\sensitivity\\sensitivity_{args.map}.csv"]
+        return reportPlan(f"Would run the threshold sweep for {args.map}:", steps, [curr_nlcd, curr_address_points])
+
+    import threshold_sensitivity as ts
+    import numpy as np
+    import raster_io
+
+    grid = raster_io.rasterGrid(curr_nlcd)
+    nlcd = raster_io.readRaster(curr_nlcd, grid, nodata=0, dtype=np.uint8)
+    x, y = raster_io.readPointCoordinates(curr_address_points)
+    prepared = ts.prepareInputs(nlcd, x, y, grid, settings.radii, settings.large_patch_areas)
+    del nlcd
+    rows = ts.runSensitivity(prepared, ts.thresholdGrid(*sizes), grid["cell_size"])
+    ts.writeSensitivityTable(rows, ts.sensitivity_output + "sensitivity_" + args.map + ".csv")
+    return True
+
+
+def aggregateCommand(args):
+    years = parseYears(args.years)
+    if args.dry_run:
+        return reportPlan(f"Would tabulate WUI area per county for {len(years)} year(s) onto {settings.county_polygons}:",
+                          [f"{year}: TabulateArea of {year}.tif" for year in years],
+                          [settings.county_polygons] + [settings.output + str(year) + ".tif" for year in years])
+    import county_aggregation
+
+    county_aggregation.aggregateCounties(years)
+    return True
+
+
+def yoyCommand(args):
+    years = parseYears(args.years)
+    if args.dry_run:
+        target = settings.yoy_wide_gdb if args.mode == "wide" else settings.yoy_output_dir
+        return reportPlan(f"Would export {len(years)} year(s) of county WUI maps ({args.mode}) to {target}:",
+                          [f"years {years[0]}-{years[-1]}"], [settings.counties, settings.yoy_data])
+    import generate_YOY_maps
+    import arcpy
+
+    if args.mode == "wide":
+        generate_YOY_maps.createWideMap(years)
+    else:
+        arcpy.management.MakeFeatureLayer(settings.counties, "county_layer")
+        for year in years:
+            generate_YOY_maps.createMaps(year)
+    return True
+
+
+def lookupCommand(args):
+    years = parseYears(args.years)
+    if args.dry_run:
+        return reportPlan(f"Would look up {len(years)} year(s) of WUI classes for {args.points} into {args.out}:",
+                          ["stack the yearly maps (reused if newer than every map)", "stream the lookup in chunks of 1,000,000 points"],
+                          [args.points] + [settings.output + str(year) + ".tif" for year in years])
+    import point_lookup
+
+    stack, grid, years = point_lookup.yearlyStack(years)
+    x, y, ids, records = point_lookup.readLookupPoints(args.points, args.id_field)
+    point_lookup.writeLookup(stack, grid, years, x, y, args.out, ids, records)
+    return True
+
+
+def tilesCommand(args):
+    years = parseYears(args.years)
+    if args.dry_run:
+        return reportPlan(f"Would export {len(years)} year(s) of web tiles to {settings.output}web_tiles\\:",
+                          [f"{year}: {year}.mbtiles" for year in years], [settings.output + str(year) + ".tif" for year in years])
+    import web_tiles
+
+    web_tiles.exportYears(years)
+    return True
+
+
+def ingestCommand(args):
+    files = args.files if args.files else [settings.address_points + str(year) + "_address_points.shp" for year in parseYears(args.years)]
+    if args.dry_run:
+        return reportPlan(f"Would cache {len(files)} point dataset(s):", [f"{os.path.basename(path)}" + (f" with {', '.join(args.fields)}" if args.fields else "") for path in files], files)
+    import point_cache
+
+    for path in files:
+        point_cache.ingest(path, args.fields)
+    return True
+
+
+def queueCommand(args):
+    db_path = args.db if args.db else settings.queue_dir + "queue.sqlite"
+    tile_dir = args.tiles if args.tiles else settings.queue_output
+    years = parseYears(args.years)
+    if args.dry_run:
+        if args.action == "init":
+            steps = [f"{year} at {radius}m: one unit per tile" for year in years for radius in args.radius]
+            return reportPlan(f"Would queue {len(steps)} year and radius run(s) in {db_path}:", steps,
+                              [settings.nlcd_projected_clipped + "nlcd_" + str(year) + "_pc.tif" for year in years])
+        counts = {}
+        if os.path.exists(db_path):
+            import sqlite3
+
+            connection = sqlite3.connect(db_path)
+            counts = dict(connection.execute("SELECT status, COUNT(*) FROM units GROUP BY status").fetchall())
+            connection.close()
+        return reportPlan(f"Would {args.action} the queue {db_path}:", [f"{status}: {count} units" for status, count in sorted(counts.items())], [db_path])
+    import tile_queue
+
+    if args.action == "init":
+        if not os.path.exists(os.path.dirname(db_path)):
+            os.makedirs(os.path.dirname(db_path))
+        tile_queue.createQueue(db_path, years, args.radius)
+    elif args.action == "work":
+        tile_queue.runWorker(db_path, tile_dir)
+    elif args.action == "assemble":
+        tile_queue.assemble(db_path, tile_dir, tile_dir)
+    counts = tile_queue.queueStatus(db_path)
+    print(f"Queue {db_path}: " + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+    return not counts.get("failed")
+
+
+# Main
+#############################################################################################################
+def buildParser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--dry-run", action="store_true", help="check the inputs and print the plan without running anything")
+
+    parser = argparse.ArgumentParser(description="Montana WUI mapping workflows.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", parents=[common], help="create WUI maps")
+    run.add_argument("years", nargs="*", default=["2012-2024"], help="years or ranges such as 2012-2024")
+    run.add_argument("--map", dest="maps", action="append", default=[], help="named map such as 'Ketchpaw Flathead' (repeatable)")
+    run.add_argument("--buffer", type=int, default=500, help="neighborhood radius in m")
+    run.add_argument("--workers", type=int, default=3)
+    run.add_argument("--fresh", action="store_true", help="start each map in a new scratch workspace")
+    run.add_argument("--native", action="store_true", help="compute yearly maps on the source NLCD grid and reproject only the result")
+    run.set_defaults(function=runCommand)
+
+    sweep = commands.add_parser("sweep", parents=[common], help="threshold sensitivity sweep")
+    sweep.add_argument("map", nargs="?", default="2020")
+    sweep.set_defaults(function=sweepCommand)
+
+    aggregate = commands.add_parser("aggregate", parents=[common], help="WUI area per county")
+    aggregate.add_argument("years", nargs="*", default=["2012-2024"])
+    aggregate.set_defaults(function=aggregateCommand)
+
+    yoy = commands.add_parser("yoy", parents=[common], help="year over year county maps")
+    yoy.add_argument("years", nargs="*", default=["2013-2024"])
+    yoy.add_argument("--mode", choices=["wide", "per_year"], default="wide")
+    yoy.set_defaults(function=yoyCommand)
+
+    lookup = commands.add_parser("lookup", parents=[common], help="WUI class of points in every year")
+    lookup.add_argument("points", help="shapefile of the points to look up")
+    lookup.add_argument("years", nargs="*", default=["2012-2024"])
+    lookup.add_argument("--out", default=settings.space + "\\analysis\\lookup\\point_lookup.csv")
+    lookup.add_argument("--id-field", help="attribute written as the id column (default: the record index)")
+    lookup.set_defaults(function=lookupCommand)
+
+    tiles = commands.add_parser("tiles", parents=[common], help="web map tile pyramids of the yearly maps")
+    tiles.add_argument("years", nargs="*", default=["2012-2024"])
+    tiles.set_defaults(function=tilesCommand)
+
+    ingest = commands.add_parser("ingest", parents=[common], help="cache address points as memory-mapped columns")
+    ingest.add_argument("years", nargs="*", default=["2012-2024"], help="years of address points to cache")
+    ingest.add_argument("--file", dest="files", action="append", default=[], help="shapefile, CSV or GeoJSON to cache instead (repeatable)")
+    ingest.add_argument("--field", dest="fields", action="append", default=[], help="attribute to keep (repeatable)")
+    ingest.set_defaults(function=ingestCommand)
+
+    work_queue = commands.add_parser("queue", parents=[common], help="tiled runs shared by workers on many machines")
+    work_queue.add_argument("action", choices=["init", "work", "assemble", "status"])
+    work_queue.add_argument("years", nargs="*", default=["2012-2024"], help="years to queue (init only)")
+    work_queue.add_argument("--radius", type=int, action="append", help="neighborhood radius in m (repeatable, init only)")
+    work_queue.add_argument("--db", help="queue file on the shared filesystem (default temp\\tile_queue\\queue.sqlite)")
+    work_queue.add_argument("--tiles", help="shared folder for tiles and assembled maps (default output\\distributed\\)")
+    work_queue.set_defaults(function=queueCommand)
+    return parser
+
+
+if __name__ == "__main__":
+    args = buildParser().parse_args()
+    if args.command == "run" and args.maps and args.years == ["2012-2024"]:
+        args.years = []                                         # --map alone runs only the named maps
+    if args.command == "queue" and not args.radius:
+        args.radius = [500]
+    sys.exit(0 if args.function(args) else 1)
@@ -0,0 +1,192 @@
+# About
+#############################################################################################################
+
+# In-memory WUI session for notebooks.
+# A session loads the NLCD and address points of a map once and computes the moving_window stages lazily when an
+# array is first asked for. Every stage result is memoized under the parameters it depends on, so changing a
+# threshold only recomputes the stages downstream of it: a new cover threshold reuses the wildland cover fractions,
+# a new radius reuses the patch distances, and going back to an earlier value is a cache hit.
+#
+#   from wui_session import WUISession
+#   session = WUISession.fromMap("2020", window=(20000, 15000, 3000, 3000))
+#   session.summary()                                           # WUI area per class
+#   session.set(radius=1000, cover_threshold=0.4)
+#   wui = session.wui                                           # only nbr_houses, cover and the steps after them rerun
+
+
+# Imports
+#############################################################################################################
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import moving_window as mw
+import raster_io
+
+
+# Settings
+#############################################################################################################
+variants = 4                                                    # results kept per stage, e.g. the last 4 radii
+defaults = {
+    "radius": 500,                                              # m
+    "density_threshold": mw.density_threshold,                  # houses per km^2
+    "cover_threshold": mw.cover_threshold,                      # share of wildland vegetation
+    "large_patch_area": mw.large_patch_area,                    # m^2
+    "patch_buffer_distance": mw.patch_buffer_distance,          # m
+}
+
+# parameters each stage depends on, directly or through the stages it reads
+stage_parameters = {
+    "valid": (),
+    "buildable": (),
+    "wildveg": (),
+    "patches": (),
+    "houses": (),
+    "patch_distance": ("large_patch_area",),
+    "wildveg_buffer": ("large_patch_area", "patch_buffer_distance"),
+    "nbr_houses": ("radius",),
+    "dense": ("radius", "density_threshold"),
+    "cover": ("radius",),
+    "wildcover50": ("radius", "cover_threshold"),
+    "wui": ("radius", "density_threshold", "cover_threshold", "large_patch_area", "patch_buffer_distance"),
+}
+
+
+# Session
+#############################################################################################################
+class WUISession:
+    def __init__(self, nlcd, x, y, grid, nodata=0, **parameters):
+        self.nlcd = nlcd
+        self.x, self.y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        self.grid = grid
+        self.cell_size = grid["cell_size"]
+        self.nodata = nodata
+        self.parameters = dict(defaults)
+        self.cache = {name: OrderedDict() for name in stage_parameters}
+        self.timings = {}                                       # seconds of the last computation of each stage
+        self.set(**parameters)
+
+    # Session on the inputs of a map from wui_settings, optionally only a (row, col, rows, cols) window of its NLCD.
+    # A window is classified like a map clipped to it: neighborhoods and patches at its edge only see what is inside.
+    @classmethod
+    def fromMap(cls, map_name, window=None, **parameters):
+        from wui_settings import mapInputs
+
+        curr_address_points, curr_unclipped_nlcd, curr_nlcd, curr_study_area = mapInputs(map_name)
+        grid = raster_io.rasterGrid(curr_nlcd)
+        if window is not None:
+            nlcd = raster_io.readWindow(curr_nlcd, grid, *window, nodata=0, dtype=np.uint8)
+            grid = raster_io.windowGrid(grid, *window)
+        else:
+            nlcd = raster_io.readRaster(curr_nlcd, grid, nodata=0, dtype=np.uint8)
+        x, y = raster_io.readPointCoordinates(curr_address_points)
+        print(f"Session: {map_name} loaded, {grid['rows']}x{grid['cols']} cells and {len(x)} address points.")
+        return cls(nlcd, x, y, grid, **parameters)
+
+    # Change parameters; stages that depend on them are recomputed the next time they are read
+    def set(self, **parameters):
+        unknown = set(parameters) - set(defaults)
+        if unknown:
+            raise ValueError(f"Unknown parameters {sorted(unknown)}, expected some of {sorted(defaults)}.")
+        self.parameters.update(parameters)
+        return self
+
+    def clear(self):
+        for results in self.cache.values():
+            results.clear()
+
+    # Memoized result of a stage under the current values of the parameters it depends on
+    def stage(self, name, compute):
+        key = tuple(self.parameters[parameter] for parameter in stage_parameters[name])
+        results = self.cache[name]
+        if key in results:
+            results.move_to_end(key)
+            return results[key]
+        start = time.perf_counter()
+        value = compute()
+        self.timings[name] = time.perf_counter() - start
+        results[key] = value
+        if len(results) > variants:
+            results.popitem(last=False)
+        return value
+
+    # Stages
+    #########################################################################################################
+    @property
+    def valid(self):
+        return self.stage("valid", lambda: mw.validMask(self.nlcd, self.nodata))
+
+    @property
+    def buildable(self):
+        return self.stage("buildable", lambda: mw.waterRaster(self.nlcd))
+
+    @property
+    def wildveg(self):
+        return self.stage("wildveg", lambda: mw.wildlandBaseRaster(self.nlcd))
+
+    # (labels, areas in m^2) of the wildland patches
+    @property
+    def patches(self):
+        return self.stage("patches", lambda: mw.labelWildlandPatches(self.wildveg, self.cell_size))
+
+    @property
+    def patch_distance(self):
+        return self.stage("patch_distance", lambda: mw.distanceToLargePatches(*self.patches, self.cell_size, self.parameters["large_patch_area"]))
+
+    @property
+    def wildveg_buffer(self):
+        return self.stage("wildveg_buffer", lambda: (self.patch_distance <= self.parameters["patch_buffer_distance"]).astype(np.uint8))
+
+    @property
+    def houses(self):
+        return self.stage("houses", lambda: mw.houseCounts(self.x, self.y, self.grid))
+
+    @property
+    def nbr_houses(self):
+        return self.stage("nbr_houses", lambda: mw.discSum(self.houses, self.parameters["radius"], self.cell_size))
+
+    @property
+    def dense(self):
+        return self.stage("dense", lambda: mw.neighborhoodDensity(self.nbr_houses, self.parameters["radius"], self.parameters["density_threshold"]))
+
+    # share of wildland vegetation among the valid cells of each neighborhood
+    @property
+    def cover(self):
+        return self.stage("cover", lambda: mw.wildlandCoverFraction(self.wildveg, self.valid, self.parameters["radius"], self.cell_size))
+
+    @property
+    def wildcover50(self):
+        return self.stage("wildcover50", lambda: self.cover > self.parameters["cover_threshold"])
+
+    @property
+    def wui(self):
+        return self.stage("wui", lambda: mw.calcWUI(self.dense, self.buildable, self.wildcover50, self.wildveg_buffer, self.valid))
+
+    # Tables
+    #########################################################################################################
+    # One row per zone (a single row without zones) with the parameters and the WUI area of each class in km^2
+    def summary(self, zones=None):
+        wui = self.wui
+        if zones is None:
+            areas = mw.tabulateArea(np.zeros(wui.shape, dtype=np.int32), wui, self.cell_size, 1)
+        else:
+            areas = mw.tabulateArea(zones, wui, self.cell_size)
+        rows = []
+        for zone in range(areas.shape[0]):
+            if zones is not None and (zone == 0 or areas[zone].sum() == 0):
+                continue
+            rows.append(dict(self.parameters, zone=zone, intermix_km2=float(areas[zone, 1]) / 1e6, interface_km2=float(areas[zone, 2]) / 1e6))
+        return rows
+
+    # WUI summary for every value of one parameter, e.g. session.sweep("radius", [250, 500, 1000])
+    def sweep(self, parameter, values, zones=None):
+        original = self.parameters[parameter]
+        rows = []
+        try:
+            for value in values:
+                self.set(**{parameter: value})
+                rows += self.summary(zones)
+        finally:
+            self.set(**{parameter: original})
+        return rows
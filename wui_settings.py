@@ -0,0 +1,125 @@
+# About
+#############################################################################################################
+
+# Paths, map inputs and scenario definitions of the WUI pipeline, kept free of arcpy and other heavy imports so the
+# command line (wui_cli.py) can validate a run and print its plan without checking out a license.
+
+
+# Paths
+#############################################################################################################
+# workspace
+space = "C:\\Users\\Cheryl\\Documents\\montana_wui_mapping"     # Make sure all other input files are in this folder!
+
+# main folders
+output = space + "\\output\\" 
+temp = space + "\\temp\\"
+raw = space + "\\data\\raw\\"
+prepared = space + "\\data\\prepared\\"
+misc = space + "\\data\\misc\\"
+traces = space + "\\analysis\\traces\\"                          # per-stage timing/resource traces written by each run
+
+# scratch workspaces of the maps as (folder, quota in bytes or None), fastest first; point the first one at a local SSD
+# or RAM disk. Maps spill to the next folder when it is full (see scratch_manager.py)
+scratch_roots = [
+    (space + "\\scratch", 200 * 10**9),
+    (temp, None),                                               # also where workspaces of earlier runs are found
+]
+
+# raw data
+address_point_downloads = raw + "\\address_point_downloads\\"
+boundary_downloads = raw + "\\boundary_downloads\\"
+nlcd_downloads = raw + "\\nlcd_downloads\\"
+
+# prepared data
+address_points = prepared + "\\address_points\\"
+study_areas = prepared + "\\study_area\\"
+nlcd_projected = prepared + "\\nlcd\\nlcd_projected\\"
+nlcd_projected_clipped = prepared + "\\nlcd\\nlcd_projected_clipped\\"
+footprints = prepared + "\\footprints\\"                            # building footprint polygons, used in place of address points
+land_cover_10m = prepared + "\\land_cover_10m\\"                    # 10m land cover in NLCD classes, projected and clipped
+reprojected = prepared + "\\reprojected\\"                        # cache of inputs warped to projection_factory_code, keyed by source checksum
+catalog_file = prepared + "\\catalog.sqlite"                      # metadata index of the prepared inputs (see input_catalog.py)
+counties = prepared + "\\counties\\County.shp"
+
+# analysis
+county_analysis_output = space + "\\analysis\\county_analysis_output\\"
+county_polygons = county_analysis_output + "county_analysis_output.shp"     # county layer the yearly WUI areas are joined onto
+yoy_data = space + "\\analysis\\tabular\\YOY_WUI.csv"                    # year over year tabular
+yoy_output_dir = space + "\\analysis\\yoy_wui_maps\\"
+yoy_wide_gdb = yoy_output_dir + "yoy_wui_maps.gdb"                          # single layer with one column per measure and year
+
+# distributed tiled runs (see tile_queue.py)
+queue_dir = temp + "tile_queue\\"                                  # queue file; keep it on local disk if the share has no locks
+queue_output = output + "distributed\\"                            # finished tiles and the assembled maps
+
+# sub-region maps computed from windows of a statewide map's intermediates instead of their own inputs (see windowedWUI)
+sub_regions = {
+    "Ketchpaw Flathead": {"parent": "2020", "study_area": study_areas + "FlatheadCounty.shp"},
+}
+
+# maps at a cell size other than the 30m NLCD; they run on the tiled NumPy engine (see tiledWUI in generate_WUI_maps.py)
+# since FocalStatistics and PointStatistics cost grows with the square of the radius in cells
+cell_size = 30                                                  # m, cell size of the arcpy pipeline (arcpy.env.cellSize)
+fine_maps = {
+    "2020 10m": {
+        "cell_size": 10,
+        "address_points": footprints + "2020_footprints.shp",
+        "nlcd": land_cover_10m + "land_cover_2020_pc.tif",
+    },
+}
+
+# yearly maps can run on the grid of the source NLCD download (Albers) instead of its StatePlane warp in nlcd_projected:
+# the address points are transformed to the NLCD's CRS and only the finished WUI map is reprojected, if at all
+native_grid = False                                             # default of createMaps(native=...) and wui_cli run --native
+reproject_native_output = True                                  # warp the finished map to StatePlane; False keeps it on the NLCD grid
+
+# scenarios compared by runScenarios, which computes the stages they have in common once
+ketchpaw_scenarios = {
+    "Ketchpaw Flathead": {
+        "address_points": address_points + "Flathead_2020_address_points.shp",
+        "nlcd": nlcd_projected_clipped + "nlcd_flathead.tif",
+        "study_area": study_areas + "FlatheadCounty.shp",
+    },
+    "Ketchpaw Source Flathead": {
+        "address_points": address_points + "Flathead_2020_address_points.shp",
+        "nlcd": nlcd_projected_clipped + "nlcd_kp_pc2.tif",
+        "study_area": study_areas + "FlatheadCounty.shp",
+    },
+}
+
+
+# threshold sensitivity sweep (threshold_sensitivity.py)
+radii = [500]                                                   # m, neighborhood radius
+density_thresholds = [3.09, 6.17, 12.34, 24.69, 49.38]          # houses per km^2 (6.17 is the 16 houses per mi^2 standard)
+cover_thresholds = [0.3, 0.4, 0.5, 0.6, 0.75]                   # share of wildland vegetation in the neighborhood
+large_patch_areas = [5000000, 25000000]                         # m^2
+patch_buffer_distances = [2400]                                 # m
+
+
+# Map inputs
+#############################################################################################################
+# Address points, unclipped NLCD (None when the map uses an already clipped raster), clipped NLCD and study area of a map
+def mapInputs(map_name):
+    map_name = str(map_name)
+    if map_name in fine_maps:
+        return fine_maps[map_name]["address_points"], None, fine_maps[map_name]["nlcd"], study_areas + "StateofMontanaBuffered.shp"
+    if (map_name == "Ketchpaw Flathead"):
+        return (address_points + "Flathead_2020_address_points.shp", None,
+                nlcd_projected_clipped + "nlcd_flathead.tif", study_areas + "FlatheadCounty.shp")
+    elif (map_name == "Ketchpaw Source Flathead"):
+        return (address_points + "Flathead_2020_address_points.shp", None,
+                nlcd_projected_clipped + "nlcd_kp_pc2.tif", study_areas + "FlatheadCounty.shp")
+    return (address_points + map_name + "_address_points.shp", nlcd_projected + "nlcd_" + map_name + "_p.tif",
+            nlcd_projected_clipped + "nlcd_" + map_name + "_pc.tif", study_areas + "StateofMontanaBuffered.shp")
+
+
+def mapCellSize(map_name):
+    return fine_maps.get(str(map_name), {}).get("cell_size", cell_size)
+
+
+# Source NLCD download of a yearly map for native grid runs, None for named and fine maps
+def nativeNLCD(map_name):
+    map_name = str(map_name)
+    if not map_name.isdigit():
+        return None
+    return nlcd_downloads + "Annual_NLCD_LndCov_" + map_name + "_CU_C1V1.tif"
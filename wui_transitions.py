@@ -0,0 +1,118 @@
+# About
+#############################################################################################################
+
+# Per-pixel change detection between consecutive yearly WUI maps.
+# Reads the {year}.tif rasters from the output folder block by block, encodes every cell's from/to class pair as
+# from_class * 3 + to_class (0-8, see transition_names) into one transition raster per pair of years, and accumulates
+# per-county transition matrices in the same pass. Each block is read once per year, so the whole 2012-2024 series is
+# processed while holding only the current block of each year in memory.
+
+
+# Imports
+#############################################################################################################
+import csv
+
+import numpy as np
+
+import moving_window as mw
+import raster_io
+
+
+# Settings
+#############################################################################################################
+from wui_settings import counties, output, temp
+transitions_output = output + "transitions\\"
+block_size = 2048                                               # rows and columns per block
+class_count = len(mw.wui_classes)
+transition_names = {
+    from_class * class_count + to_class: f"{mw.wui_classes[from_class]} -> {mw.wui_classes[to_class]}"
+    for from_class in mw.wui_classes for to_class in mw.wui_classes
+}
+
+
+# Zones
+#############################################################################################################
+# County numbers rasterized onto the WUI grid, so counties can be read block by block alongside the WUI rasters
+def countyZoneRaster(snap_raster, zone_field="COUNTYNUMB"):
+    import arcpy
+
+    zone_raster = temp + "county_zones.tif"
+    with arcpy.EnvManager(snapRaster=snap_raster, extent=snap_raster, cellSize=snap_raster):
+        arcpy.conversion.PolygonToRaster(counties, zone_field, zone_raster, "CELL_CENTER")
+    return zone_raster
+
+
+# Add counts into the running total, growing it if this block had a higher zone number
+def accumulate(total, counts):
+    if len(counts) > len(total):
+        total = np.concatenate([total, np.zeros(len(counts) - len(total), dtype=total.dtype)])
+    total[:len(counts)] += counts
+    return total
+
+
+# Transitions
+#############################################################################################################
+def encodeTransitions(from_block, to_block):
+    return (from_block.astype(np.uint8) * class_count + to_block.astype(np.uint8)).astype(np.uint8)
+
+
+# Stream consecutive years block by block, writing transition rasters and returning {(from_year, to_year): counts[zone, transition]}
+def detectTransitions(years, zone_raster=None):
+    years = sorted(years)
+    wui_rasters = {year: output + str(year) + ".tif" for year in years}
+    grid = raster_io.rasterGrid(wui_rasters[years[0]])
+    for year in years[1:]:
+        if not raster_io.sameGrid(grid, raster_io.rasterGrid(wui_rasters[year])):
+            raise ValueError(f"{wui_rasters[year]} is not on the same grid as {wui_rasters[years[0]]}.")
+    zone_raster = countyZoneRaster(wui_rasters[years[0]]) if zone_raster is None else zone_raster
+    pairs = list(zip(years[:-1], years[1:]))
+    totals = {pair: np.zeros(0, dtype=np.int64) for pair in pairs}
+    writers = {pair: raster_io.BlockWriter(transitions_output + f"{pair[0]}_{pair[1]}.tif", grid, np.uint8) for pair in pairs}
+
+    for row, col, nrows, ncols in raster_io.iterBlocks(grid["rows"], grid["cols"], block_size):
+        zones = raster_io.readWindow(zone_raster, grid, row, col, nrows, ncols, nodata=0, dtype=np.int64).ravel()
+        previous = None
+        for year in years:
+            # NoData in the WUI maps is non-WUI (calcWUI saves 0 as NoData)
+            curr = raster_io.readWindow(wui_rasters[year], grid, row, col, nrows, ncols, nodata=0, dtype=np.uint8)
+            if previous is not None:
+                pair = (previous[0], year)
+                codes = encodeTransitions(previous[1], curr)
+                writers[pair].write(row, col, codes)
+                totals[pair] = accumulate(totals[pair], np.bincount(zones * len(transition_names) + codes.ravel()))
+            previous = (year, curr)
+        print(f"Transitions: block at row {row}, col {col} completed.")
+
+    for writer in writers.values():
+        writer.close()
+    return {pair: transitionMatrix(total) for pair, total in totals.items()}
+
+
+# Reshape flat zone * 9 + transition counts to a [zone, transition] matrix
+def transitionMatrix(total):
+    zone_count = -(-len(total) // len(transition_names))
+    return np.pad(total, (0, zone_count * len(transition_names) - len(total))).reshape(zone_count, len(transition_names))
+
+
+# One row per year pair, county and transition with cell counts and areas; zone 0 is outside every county
+def writeTransitionMatrices(matrices, cell_size, out_csv=None):
+    out_csv = transitions_output + "county_transition_matrices.csv" if out_csv is None else out_csv
+    with open(out_csv, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["from_year", "to_year", "COUNTYNUMB", "from_class", "to_class", "transition", "cells", "area_m2"])
+        for (from_year, to_year), matrix in sorted(matrices.items()):
+            for zone in np.flatnonzero(matrix.sum(axis=1)):
+                if zone == 0:
+                    continue
+                for code, cells in enumerate(matrix[zone]):
+                    writer.writerow([from_year, to_year, zone, code // class_count, code % class_count, transition_names[code],
+                                     int(cells), float(cells) * cell_size * cell_size])
+    print(f"County transition matrices written to {out_csv}.")
+
+
+# Main
+#############################################################################################################
+if __name__ == "__main__":
+    years = range(2012, 2025)
+    matrices = detectTransitions(years)
+    writeTransitionMatrices(matrices, raster_io.rasterGrid(output + str(years[0]) + ".tif")["cell_size"])